@@ -0,0 +1,103 @@
+"""
+Load test of AsyncPostgreSQLConnectionPool against the threaded sync pool.
+
+Both sides run --requests short queries (SELECT pg_sleep(--query-ms / 1000))
+through a pool of --pool-size connections. The async side runs every request
+as its own coroutine; the sync side uses a thread pool of --threads workers,
+which is how the API tier has to use src.database today. Needs the database
+configured through DataBaseSettings.
+
+Usage:
+    python -m benchmarks.async_pool_load
+    python -m benchmarks.async_pool_load --requests 20000 --pool-size 10 --threads 200
+"""
+
+import argparse
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from config import DataBaseSettings
+from src.database.async_connection import AsyncConnectionPool, AsyncPooledDatabaseConnection, connect, execute
+from src.database.connection import PooledDatabaseConnection
+from src.database.pool import ConnectionPool
+from src.database.validation import PassiveValidate
+
+QUERY = "SELECT pg_sleep(%s)"
+
+
+def connection_parameters():
+    config = DataBaseSettings.get_config()
+    return {"host": config.host, "database": config.database, "user": config.user,
+            "password": config.password.get_secret_value()}
+
+
+def percentile(latencies, quantile):
+    latencies = sorted(latencies)
+    return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)]
+
+
+async def run_async(arguments):
+    pool = AsyncConnectionPool(arguments.pool_size, arguments.pool_size,
+                               functools.partial(connect, **connection_parameters()),
+                               timeout=300, validation_policy=PassiveValidate())
+    await pool.open()
+    latencies = []
+
+    async def request():
+        start = time.perf_counter()
+        async with AsyncPooledDatabaseConnection(pool) as connection:
+            await execute(connection, QUERY, [arguments.query_ms / 1000])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(arguments.requests)))
+    elapsed = time.perf_counter() - start
+    await pool.closeall()
+    return elapsed, latencies
+
+
+def run_sync(arguments):
+    pool = ConnectionPool(arguments.pool_size, arguments.pool_size,
+                          functools.partial(psycopg2.connect, **connection_parameters()),
+                          timeout=300, validation_policy=PassiveValidate())
+    latencies = []
+
+    def request():
+        start = time.perf_counter()
+        with PooledDatabaseConnection(pool) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(QUERY, [arguments.query_ms / 1000])
+            connection.commit()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(arguments.threads) as executor:
+        for future in [executor.submit(request) for _ in range(arguments.requests)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    pool.closeall()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=100)
+    parser.add_argument("--query-ms", type=float, default=1.0)
+    arguments = parser.parse_args()
+
+    results = {"async": asyncio.run(run_async(arguments)), "sync": run_sync(arguments)}
+
+    print(f"{'pool':<8}{'req/s':>10}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for name, (elapsed, latencies) in results.items():
+        print(f"{name:<8}{arguments.requests / elapsed:>10.0f}"
+              f"{percentile(latencies, 0.5) * 1000:>12.2f}{percentile(latencies, 0.99) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Rows per second of bulk_insert() per method, against one INSERT per row.
+
+Loads --rows generated order lines into a temporary table with each method
+and reports the throughput. Needs the database configured through
+DataBaseSettings.
+
+Usage:
+    python -m benchmarks.bulk_insert
+    python -m benchmarks.bulk_insert --rows 1000000 --skip-single
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from config import DataBaseSettings
+from src.database.bulk import bulk_insert
+
+TABLE = "bulk_insert_benchmark"
+COLUMNS = ["order_id", "product_id", "unit_price", "quantity", "note", "shipped_at"]
+
+
+def connect():
+    config = DataBaseSettings.get_config()
+    return psycopg2.connect(host=config.host, database=config.database, user=config.user,
+                            password=config.password.get_secret_value())
+
+
+def generate(rows):
+    start = datetime(2024, 1, 1)
+    for index in range(rows):
+        yield (index, index % 77, (index % 1000) / 10, index % 50, f"line {index}", start + timedelta(seconds=index))
+
+
+def single_inserts(connection, rows):
+    with connection.cursor() as cursor:
+        for row in generate(rows):
+            cursor.execute(f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)", row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--skip-single", action="store_true", help="skip the one INSERT per row baseline")
+    arguments = parser.parse_args()
+
+    methods = {
+        "values": lambda connection: bulk_insert(connection, TABLE, generate(arguments.rows), COLUMNS, method="values"),
+        "copy text": lambda connection: bulk_insert(connection, TABLE, generate(arguments.rows), COLUMNS, method="copy"),
+        "copy binary": lambda connection: bulk_insert(connection, TABLE, generate(arguments.rows), COLUMNS,
+                                                      method="copy", copy_format="binary"),
+    }
+    if not arguments.skip_single:
+        methods = {"single": lambda connection: single_inserts(connection, arguments.rows), **methods}
+
+    connection = connect()
+    print(f"{'method':<14}{'rows / s':>12}")
+    for name, load in methods.items():
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TEMPORARY TABLE {TABLE} (order_id bigint, product_id integer, "
+                           "unit_price double precision, quantity smallint, note text, "
+                           "shipped_at timestamp without time zone)")
+        start = time.perf_counter()
+        load(connection)
+        connection.commit()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<14}{arguments.rows / elapsed:>12.0f}")
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {TABLE}")
+        connection.commit()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Cost of pool instrumentation on a bare getconn/putconn cycle.
+
+Runs the same checkout loop against a ConnectionPool with metrics recording
+switched on and off, using connections that never talk to a server, so the
+difference is the bookkeeping alone.
+
+Usage:
+    python -m benchmarks.checkout_overhead
+    python -m benchmarks.checkout_overhead --checkouts 500000 --threads 8
+"""
+
+import argparse
+import threading
+import time
+
+from src.database.pool import ConnectionPool
+
+
+class IdleConnection:
+    closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+def run(record_metrics, checkouts, threads):
+    pool = ConnectionPool(threads, threads, IdleConnection, record_metrics=record_metrics)
+
+    def worker():
+        for _ in range(checkouts // threads):
+            pool.putconn(pool.getconn())
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - start) / checkouts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=200_000)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    results = {}
+    for record_metrics in (False, True):
+        results[record_metrics] = min(run(record_metrics, arguments.checkouts, arguments.threads)
+                                      for _ in range(arguments.repeat))
+
+    print(f"{'metrics':<10}{'ns / checkout':>16}")
+    print(f"{'off':<10}{results[False] * 1e9:>16.0f}")
+    print(f"{'on':<10}{results[True] * 1e9:>16.0f}")
+    print(f"overhead: {(results[True] / results[False] - 1) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
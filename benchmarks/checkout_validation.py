@@ -0,0 +1,108 @@
+"""
+Checkout latency per connection validation policy.
+
+Compares how long `with PooledDatabaseConnection(pool)` takes under each
+validation policy. By default the connections are simulated and every server
+round trip costs --rtt-ms milliseconds, so the numbers can be reproduced
+without a database. Pass --database to run against the configured server.
+
+Usage:
+    python -m benchmarks.checkout_validation
+    python -m benchmarks.checkout_validation --rtt-ms 1.5 --checkouts 2000
+    python -m benchmarks.checkout_validation --database
+"""
+
+import argparse
+import functools
+import statistics
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from config import DataBaseSettings
+from src.database.connection import PooledDatabaseConnection
+from src.database.pool import ConnectionPool
+from src.database.validation import AlwaysValidate, BackgroundValidate, IdleValidate, PassiveValidate
+
+
+class SimulatedCursor:
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def execute(self, query, params=None):
+        time.sleep(self.rtt)
+
+    def fetchone(self):
+        return (1,)
+
+
+class SimulatedConnection:
+    """A connection whose every server round trip costs rtt seconds."""
+
+    closed = 0
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    def cursor(self):
+        return SimulatedCursor(self.rtt)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def connection_factory(arguments):
+    if arguments.database:
+        config = DataBaseSettings.get_config()
+        return functools.partial(psycopg2.connect, host=config.host, database=config.database,
+                                 user=config.user, password=config.password.get_secret_value())
+    return functools.partial(SimulatedConnection, arguments.rtt_ms / 1000)
+
+
+def measure(policy, factory, checkouts):
+    pool = ConnectionPool(1, 1, factory, validation_policy=policy)
+    policy.start(pool)
+    timings = []
+    try:
+        for _ in range(checkouts):
+            start = time.perf_counter()
+            with PooledDatabaseConnection(pool):
+                timings.append(time.perf_counter() - start)
+    finally:
+        policy.stop()
+        pool.closeall()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=1000)
+    parser.add_argument("--rtt-ms", type=float, default=0.5, help="simulated round trip time")
+    parser.add_argument("--database", action="store_true", help="use the configured PostgreSQL server")
+    arguments = parser.parse_args()
+
+    factory = connection_factory(arguments)
+    policies = [AlwaysValidate(), IdleValidate(idle_threshold=5.0), PassiveValidate(), BackgroundValidate(interval=30.0)]
+
+    print(f"{'policy':<12}{'mean (us)':>12}{'p50 (us)':>12}{'p99 (us)':>12}")
+    for policy in policies:
+        timings = sorted(measure(policy, factory, arguments.checkouts))
+        mean = statistics.fmean(timings) * 1e6
+        p50 = timings[len(timings) // 2] * 1e6
+        p99 = timings[int(len(timings) * 0.99) - 1] * 1e6
+        print(f"{policy.name:<12}{mean:>12.1f}{p50:>12.1f}{p99:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+QueryBuilder.to_polars() against pl.read_database() on a large table.
+
+Fills a temporary table with --rows generated orders, then reads it back into
+a Polars DataFrame both ways and reports the time and rows/s. Needs the
+database configured through DataBaseSettings, polars and pyarrow.
+
+Usage:
+    python -m benchmarks.columnar_fetch
+    python -m benchmarks.columnar_fetch --rows 5000000 --repeat 3
+"""
+
+import argparse
+import time
+
+import polars as pl
+import psycopg2
+
+from config import DataBaseSettings
+from src.database.query_executors import QueryBuilder
+
+TABLE = "columnar_fetch_benchmark"
+
+
+def connect():
+    config = DataBaseSettings.get_config()
+    return psycopg2.connect(host=config.host, database=config.database, user=config.user,
+                            password=config.password.get_secret_value())
+
+
+def fill(connection, rows):
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TEMPORARY TABLE {TABLE} AS "
+                       "SELECT id AS order_id, 'C' || (id % 91) AS customer_id, "
+                       "DATE '1996-07-04' + (id % 700) AS order_date, "
+                       "(id % 1000) / 10.0::double precision AS freight, id % 2 = 0 AS shipped "
+                       "FROM generate_series(1, %s) AS id", [rows])
+    connection.commit()
+
+
+def timed(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame = function()
+        best = min(best, time.perf_counter() - start)
+    return best, frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+
+    connection = connect()
+    fill(connection, arguments.rows)
+    query = QueryBuilder().select("*").from_table(TABLE)
+
+    methods = {
+        "read_database": lambda: pl.read_database(query=str(query), connection=connection),
+        "to_polars": lambda: query.to_polars(connection),
+    }
+    print(f"{'method':<16}{'seconds':>10}{'rows / s':>14}")
+    for name, function in methods.items():
+        seconds, frame = timed(function, arguments.repeat)
+        assert frame.height == arguments.rows
+        print(f"{name:<16}{seconds:>10.2f}{arguments.rows / seconds:>14.0f}")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Cold start cost of importing the package, measured with python -X importtime.
+
+Every measurement runs a fresh interpreter, so nothing is cached in
+sys.modules, and reports the cumulative import time of each module (the best
+of --repeat runs) along with the slowest imports it pulled in. It exits with
+status 1 when src.database or config is over its IMPORT_BUDGETS entry. Wall
+clock timings are too noisy for the unit tests, which only check that no
+heavy dependency is imported (see tests/unit/test_import_time.py).
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time src.database.query_executors --top 20
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Milliseconds a cold import may take
+IMPORT_BUDGETS = {
+    "src.database": 100.0,
+    "config": 100.0,
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module):
+    """Cumulative import time in milliseconds of module and every module it imported, by name."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=ROOT, capture_output=True, text=True, check=True)
+    imported = []  # Since the last top level import, which are listed after what they imported
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported.append((name.strip(), int(cumulative) / 1000))
+        if len(name) - len(name.lstrip()) == 1:  # Not nested under another import
+            if name.strip() == module:
+                return dict(imported)
+            imported = []
+    raise ValueError(f"{module} was not imported")
+
+
+def best_of(module, repeat):
+    """The fastest of repeat cold imports of module, in milliseconds, and that run's timings."""
+    runs = [measure(module) for _ in range(repeat)]
+    best = min(runs, key=lambda timings: timings[module])
+    return best[module], best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["src.database", "config", "src.database.query_executors",
+                                                       "src.database.connection"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    arguments = parser.parse_args()
+
+    over_budget = False
+    for module in arguments.modules:
+        total, timings = best_of(module, arguments.repeat)
+        budget = IMPORT_BUDGETS.get(module)
+        verdict = "" if budget is None else f"  (budget {budget:.0f} ms{', OVER' if total > budget else ''})"
+        over_budget |= budget is not None and total > budget
+        print(f"{module:<32} {total:8.1f} ms{verdict}")
+        slowest = sorted((name for name in timings if name != module), key=timings.get, reverse=True)
+        for name in slowest[:arguments.top]:
+            print(f"    {name:<28} {timings[name]:8.1f} ms")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Cost of turning a QueryBuilder into SQL, rebuilt every time versus compiled.
+
+Turns builders of the same query shape into SQL over and over, like a request
+handler would, and times three ways of getting the SQL and parameters:
+
+- build:   build_sql() on every call, what __str__ used to do
+- get_sql: builder.get_sql(), a lookup in the shared template cache
+- bind:    template.bind(values) on a template compiled once up front
+
+Usage:
+    python -m benchmarks.query_compile
+    python -m benchmarks.query_compile --iterations 500000
+"""
+
+import argparse
+import time
+
+from src.database.query_executors import QueryBuilder, build_sql
+
+
+def make_builder(customer_id):
+    return (QueryBuilder()
+            .select("o.order_id", "o.order_date", "c.company_name")
+            .from_table("orders o")
+            .inner_join("customers c", "c.customer_id = o.customer_id")
+            .where("o.customer_id = %s", customer_id, "o.shipped_date IS NOT NULL")
+            .order_by("o.order_date DESC")
+            .limit(20))
+
+
+def time_per_call(function, iterations):
+    start = time.perf_counter()
+    for index in range(iterations):
+        function(index)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+
+    builders = [make_builder(f"C{index:04}") for index in range(100)]
+    template = builders[0].compile()
+
+    def build(index):
+        builder = builders[index % 100]
+        return build_sql(*builder._shape()), builder.get_params()
+
+    def get_sql(index):
+        return builders[index % 100].get_sql()
+
+    def bind(index):
+        return template.bind([f"C{index % 100:04}"])
+
+    results = {}
+    for name, function in (("build", build), ("get_sql", get_sql), ("bind", bind)):
+        results[name] = min(time_per_call(function, arguments.iterations) for _ in range(arguments.repeat))
+
+    print(f"{'method':<10}{'ns / query':>14}{'speedup':>10}")
+    for name, seconds in results.items():
+        print(f"{name:<10}{seconds * 1e9:>14.0f}{results['build'] / seconds:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
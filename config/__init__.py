@@ -1,4 +1,15 @@
-from .settings import DataBaseSettings
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from .settings import DataBaseSettings
 
-__all__ = ['DataBaseSettings']
\ No newline at end of file
+
+__all__ = ['DataBaseSettings']
+
+
+def __getattr__(name):
+    # pydantic takes long to import, only load it once the settings are needed
+    if name == 'DataBaseSettings':
+        from .settings import DataBaseSettings
+        return DataBaseSettings
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,20 @@
+import importlib
 import os
+import threading
+from typing import List, Literal, Optional
+
 from pydantic import Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from . import development, production, test
+
+_config = None
+_config_lock = threading.Lock()
+_from_dotenv = {}  # Environment variables set from .env, with the value they were given
 
 
 class DataBaseSettings(BaseSettings):
-    model_config = SettingsConfigDict(env_prefix="DB_", case_sensitive=True, frozen=True, env_file=".env")
+    # .env may hold variables that aren't settings, DB_ENVIRONMENT for one
+    model_config = SettingsConfigDict(env_prefix="DB_", case_sensitive=True, frozen=True, env_file=".env",
+                                      extra="ignore")
 
     host: str = Field(..., alias="HOST")
     database: str = Field(..., alias="NAME")
@@ -14,6 +23,24 @@ class DataBaseSettings(BaseSettings):
     port: int = Field(default=5432, alias="PORT")
     min_connections: int = Field(default=1, alias="MIN_CONNECTIONS")
     max_connections: int = Field(default=10, alias="MAX_CONNECTIONS")
+    pool_timeout: float = Field(default=30.0, alias="POOL_TIMEOUT")
+    validation_policy: Literal["always", "idle", "passive", "background"] = Field(default="idle", alias="VALIDATION_POLICY")
+    validation_idle_threshold: float = Field(default=5.0, alias="VALIDATION_IDLE_THRESHOLD")
+    validation_interval: float = Field(default=30.0, alias="VALIDATION_INTERVAL")
+    max_lifetime: Optional[float] = Field(default=3600.0, alias="MAX_LIFETIME")
+    max_idle_time: Optional[float] = Field(default=600.0, alias="MAX_IDLE_TIME")
+    maintenance_interval: float = Field(default=30.0, alias="MAINTENANCE_INTERVAL")
+    statement_timeout: Optional[float] = Field(default=None, alias="STATEMENT_TIMEOUT")  # Seconds, for every connection
+    lock_timeout: Optional[float] = Field(default=None, alias="LOCK_TIMEOUT")
+    circuit_failure_threshold: int = Field(default=5, alias="CIRCUIT_FAILURE_THRESHOLD")  # 0 turns the breaker off
+    circuit_reset_timeout: float = Field(default=30.0, alias="CIRCUIT_RESET_TIMEOUT")
+    load_shedding: bool = Field(default=True, alias="LOAD_SHEDDING")
+    max_concurrency: Optional[int] = Field(default=None, alias="MAX_CONCURRENCY")  # Defaults to 2 * MAX_CONNECTIONS
+    latency_tolerance: float = Field(default=2.0, alias="LATENCY_TOLERANCE")
+    replica_hosts: List[str] = Field(default_factory=list, alias="REPLICA_HOSTS")  # "host" or "host:port"
+    routing_strategy: Literal["least_outstanding", "round_robin"] = Field(default="least_outstanding", alias="ROUTING_STRATEGY")
+    max_replica_lag: Optional[float] = Field(default=None, alias="MAX_REPLICA_LAG")
+    replica_check_interval: float = Field(default=5.0, alias="REPLICA_CHECK_INTERVAL")
     
     @classmethod
     def get_environment(cls) -> str:
@@ -21,10 +48,50 @@ class DataBaseSettings(BaseSettings):
     
     @classmethod
     def get_config(cls) -> "DataBaseSettings":
+        """The settings of DB_ENVIRONMENT, read once and cached until reload()."""
+        config = _config
+        if config is None:
+            with _config_lock:
+                config = _config or cls._load()
+                cls._store(config)
+        return config
+
+    @classmethod
+    def reload(cls) -> "DataBaseSettings":
+        """Read the environment and .env again, replacing the cached settings."""
+        with _config_lock:
+            config = cls._load()
+            cls._store(config)
+        return config
+
+    @staticmethod
+    def _store(config):
+        global _config
+        _config = config
+
+    @staticmethod
+    def _read_dotenv():
+        """
+        Put the variables of .env into the environment, like load_dotenv() but
+        again on every call: variables that came from an earlier read follow
+        the edits of .env, the ones set some other way keep their value.
+        """
+        from dotenv import dotenv_values, find_dotenv
+
+        values = {key: value for key, value in dotenv_values(find_dotenv(usecwd=True)).items() if value is not None}
+        for key, value in list(_from_dotenv.items()):
+            if os.environ.get(key) != value:
+                del _from_dotenv[key]  # Changed since, no longer ours
+            elif key not in values:
+                del os.environ[key], _from_dotenv[key]
+        for key, value in values.items():
+            if key not in os.environ or key in _from_dotenv:
+                os.environ[key] = _from_dotenv[key] = value
+
+    @classmethod
+    def _load(cls) -> "DataBaseSettings":
+        cls._read_dotenv()  # DB_ENVIRONMENT may be set in .env too
         environment = DataBaseSettings.get_environment()
-        if environment == "production":
-            return production.get_settings()
-        elif environment == "development":
-            return development.get_settings()
-        else:
-            return test.get_settings()
\ No newline at end of file
+        if environment not in ("production", "development"):
+            environment = "test"
+        return importlib.import_module(f".{environment}", __package__).get_settings()
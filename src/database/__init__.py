@@ -1,2 +1,40 @@
-from .connection import PostgreSQLConnectionPool, PooledDatabaseConnection
-from .query_executors import QueryBuilder
\ No newline at end of file
+"""
+PostgreSQL connection pooling, query building and error handling.
+
+The public names are imported from their modules on first use, so importing
+the package (or just its exceptions) doesn't load psycopg2, pydantic or
+stamina.
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .async_connection import AsyncPostgreSQLConnectionPool, AsyncPooledDatabaseConnection
+    from .connection import PostgreSQLConnectionPool, PooledDatabaseConnection
+    from .pool import ConnectionPool
+    from .query_executors import QueryBuilder
+
+_EXPORTS = {
+    "AsyncPostgreSQLConnectionPool": ".async_connection",
+    "AsyncPooledDatabaseConnection": ".async_connection",
+    "PostgreSQLConnectionPool": ".connection",
+    "PooledDatabaseConnection": ".connection",
+    "ConnectionPool": ".pool",
+    "QueryBuilder": ".query_executors",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,445 @@
+"""
+asyncio counterparts of PostgreSQLConnectionPool and PooledDatabaseConnection.
+
+Connections are opened in psycopg2's asynchronous mode, and instead of blocking
+the event loop every network wait is handed to the loop through add_reader/
+add_writer on the connection's socket. Thousands of coroutines can share a
+small pool: when it is exhausted they queue up in arrival order, just like
+threads do with ConnectionPool.
+
+psycopg2 puts some limits on asynchronous connections: they are always in
+autocommit mode, and named (server side) cursors can't be used.
+
+Example:
+    async with AsyncPostgreSQLConnectionPool() as pool:
+        async with AsyncPooledDatabaseConnection(pool) as conn:
+            cursor = await execute(conn, "SELECT * FROM customers WHERE country = %s", ["Germany"])
+            rows = cursor.fetchall()
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+import config
+from .connection import database_parameters
+from .exceptions import ConfigurationError, ConnectionError, DatabaseError, PoolTimeoutError, QueryTimeoutError
+from .metrics import LatencySummary, PoolMetrics, PoolStats, oldest_age
+from .retrying import retry
+from .validation import AlwaysValidate, IdleValidate, PassiveValidate, create_validation_policy, looks_alive
+
+logger = logging.getLogger(__name__)
+
+_POOL_CLOSED = object()  # Handed to waiters when the pool is closed under them
+
+
+async def wait_for(connection):
+    """Drive an asynchronous psycopg2 connection until its current operation has finished."""
+    loop = asyncio.get_running_loop()
+    file_descriptor = connection.fileno()
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(file_descriptor, _set_ready, ready)
+            remove = loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(file_descriptor, _set_ready, ready)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+        try:
+            await ready
+        finally:
+            remove(file_descriptor)
+
+
+def _set_ready(future):
+    if not future.done():
+        future.set_result(None)
+
+
+async def connect(**connection_parameters):
+    """Open an asynchronous psycopg2 connection without blocking the event loop."""
+    connection = psycopg2.connect(async_=1, **connection_parameters)
+    try:
+        await wait_for(connection)
+    except BaseException:
+        connection.close()
+        raise
+    return connection
+
+
+async def execute(connection, query, params=None, timeout=None):
+    """
+    Run a query on an asynchronous connection and return the cursor once the
+    results have arrived. PostgreSQL errors are raised as DatabaseError subclasses.
+
+    When the calling task is cancelled, or the query takes longer than timeout
+    seconds (raising QueryTimeoutError), the query is cancelled on the server
+    too, leaving the connection ready for the next query.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        await asyncio.wait_for(wait_for(connection), timeout)
+    except psycopg2.Error as postgres_error:
+        custom_error = DatabaseError.from_postgres_exception(
+            postgres_error, params=params if isinstance(params, dict) else None, query=query)
+        raise custom_error from postgres_error
+    except asyncio.TimeoutError as timeout_error:
+        await cancel_query(connection)
+        raise QueryTimeoutError(f"Query took longer than {timeout}s and was cancelled.",
+                                {"query": query, "timeout": timeout}) from timeout_error
+    except asyncio.CancelledError:
+        await cancel_query(connection)
+        raise
+    return cursor
+
+
+async def cancel_query(connection):
+    """Cancel the query running on an asynchronous connection and wait until the server gave up on it."""
+    if not connection.isexecuting():
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        # cancel() blocks until the server has received the request
+        await asyncio.shield(loop.run_in_executor(None, connection.cancel))
+        await asyncio.shield(wait_for(connection))
+    except psycopg2.Error:
+        pass  # Most likely the QueryCanceled error the cancel caused
+    except asyncio.CancelledError:
+        pass  # Cancelled again, the connection is discarded as busy when it's returned
+
+
+async def ping(connection):
+    """Asynchronous version of validation.ping."""
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        await wait_for(connection)
+        return cursor.fetchone()[0] == 1
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+class AsyncConnectionPool:
+    """
+    An asyncio pool of connections, the coroutine counterpart of ConnectionPool.
+
+    connection_factory is a coroutine function taking no arguments. The pool
+    belongs to the event loop it is first used on.
+
+    There is no maintenance thread: connections idle for longer than
+    max_idle_time are closed, coldest first and only while the pool is above
+    min_connections, whenever a connection is returned.
+    """
+    def __init__(self, min_connections, max_connections, connection_factory, timeout=30.0,
+                 validation_policy=None, max_lifetime=None, max_idle_time=None):
+        if min_connections < 0 or max_connections < 1 or min_connections > max_connections:
+            raise ConfigurationError(
+                f"Invalid pool size: min_connections={min_connections}, max_connections={max_connections}")
+
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle_time = max_idle_time
+        self.validation_policy = validation_policy or PassiveValidate()
+        self.metrics = PoolMetrics()
+        self.closed = False
+
+        self._connection_factory = connection_factory
+        self._idle = []          # Used as a stack, the end of the list holds the warmest connection
+        self._in_use = {}        # id(connection) -> connection
+        self._waiters = deque()  # FIFO queue of futures, resolved with a connection or None for a free slot
+        self._size = 0
+        self._last_used = {}
+        self._created_at = {}
+        self._checked_out_at = {}
+
+    async def open(self):
+        """Open min_connections up front."""
+        for _ in range(self.min_connections - self._size):
+            self._size += 1
+            try:
+                connection = await self._create_connection()
+            except BaseException:
+                self._size -= 1
+                raise
+            self._idle.append(connection)
+        return self
+
+    async def getconn(self, timeout=None):
+        """
+        Take a connection out of the pool, waiting up to timeout seconds
+        (defaults to the pool's timeout) when it is exhausted.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        started = time.perf_counter()
+        self._check_open()
+
+        if self._idle and not self._waiters:
+            return self._check_out(self._idle.pop(), started)
+        if self._size < self.max_connections and not self._waiters:
+            self._size += 1
+            return await self._check_out_new(started)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            connection = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                waiter.cancel()
+                self.metrics.timeouts += 1
+                raise PoolTimeoutError(
+                    f"Timed out after {timeout}s waiting for a connection from the pool.",
+                    {"max_connections": self.max_connections, "waiting": len(self._waiters)}) from None
+            connection = waiter.result()
+        except asyncio.CancelledError:
+            # Whatever was handed to us in the meantime must not get lost
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and waiter.result() is None:
+                self._size -= 1
+                self._wake_waiter_with_slot()
+            elif waiter.done() and waiter.result() is not _POOL_CLOSED:
+                self._release(waiter.result())
+            raise
+
+        if connection is _POOL_CLOSED:
+            self._check_open()
+        if connection is not None:
+            return self._check_out(connection, started)
+        return await self._check_out_new(started)
+
+    def putconn(self, connection, close=False):
+        """Return a connection to the pool, closing it if close is set or it expired."""
+        if self._in_use.pop(id(connection), None) is None:
+            raise ConfigurationError("Trying to return a connection that is not checked out from this pool.")
+        self.metrics.hold_times.record(time.perf_counter() - self._checked_out_at.pop(id(connection)))
+
+        now = time.monotonic()
+        expired = self.max_lifetime is not None and now - self._created_at[id(connection)] > self.max_lifetime
+        if close or self.closed or connection.closed or expired:
+            self._discard(connection)
+            return
+        self._last_used[id(connection)] = now
+        self._close_idle_too_long(now)
+        self._release(connection)
+
+    async def closeall(self):
+        """Close every idle connection and refuse further checkouts."""
+        self.closed = True
+        idle, self._idle = self._idle, []
+        self._size -= len(idle)
+        self.metrics.connections_closed += len(idle)
+        for connection in idle:
+            self._forget(connection)
+            connection.close()
+        waiters, self._waiters = self._waiters, deque()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(_POOL_CLOSED)
+
+    def idle_seconds(self, connection):
+        return time.monotonic() - self._last_used.get(id(connection), time.monotonic())
+
+    def stats(self):
+        """Take a PoolStats snapshot, see ConnectionPool.stats."""
+        return PoolStats(
+            size=self._size,
+            idle=len(self._idle),
+            in_use=len(self._in_use),
+            waiting=len(self._waiters),
+            min_connections=self.min_connections,
+            max_connections=self.max_connections,
+            checkouts=self.metrics.checkouts,
+            timeouts=self.metrics.timeouts,
+            connections_opened=self.metrics.connections_opened,
+            connections_closed=self.metrics.connections_closed,
+            wait_time=LatencySummary.from_reservoir(self.metrics.wait_times),
+            hold_time=LatencySummary.from_reservoir(self.metrics.hold_times),
+            oldest_connection_age=oldest_age(self._created_at),
+            errors=self.metrics.errors(),
+        )
+
+    def _release(self, connection):
+        """Hand a connection to the longest waiting coroutine, or park it as idle."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(connection)
+                return
+        self._idle.append(connection)
+
+    def _close_idle_too_long(self, now):
+        while (self.max_idle_time is not None and self._idle and self._size > self.min_connections
+               and now - self._last_used[id(self._idle[0])] > self.max_idle_time):  # Coldest first
+            self._discard(self._idle.pop(0))
+
+    def _discard(self, connection):
+        self._size -= 1
+        self.metrics.connections_closed += 1
+        self._forget(connection)
+        connection.close()
+        self._wake_waiter_with_slot()
+
+    def _forget(self, connection):
+        self._last_used.pop(id(connection), None)
+        self._created_at.pop(id(connection), None)
+
+    def _check_out(self, connection, started):
+        now = time.perf_counter()
+        self._in_use[id(connection)] = connection
+        self._checked_out_at[id(connection)] = now
+        self.metrics.checkouts += 1
+        self.metrics.wait_times.record(now - started)
+        return connection
+
+    async def _check_out_new(self, started):
+        """Open a connection for a slot that was already reserved in _size."""
+        try:
+            connection = await self._create_connection()
+        except BaseException:
+            self._size -= 1
+            self._wake_waiter_with_slot()
+            raise
+        if self.closed:
+            self._discard(connection)
+            self._check_open()
+        return self._check_out(connection, started)
+
+    def _wake_waiter_with_slot(self):
+        """Let the longest waiting coroutine open a connection in a freed slot."""
+        while self._waiters and self._size < self.max_connections:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._size += 1
+                waiter.set_result(None)
+                return
+
+    async def _create_connection(self):
+        connection = await self._connection_factory()
+        self._last_used[id(connection)] = self._created_at[id(connection)] = time.monotonic()
+        self.metrics.connections_opened += 1
+        return connection
+
+    def _check_open(self):
+        if self.closed:
+            raise ConfigurationError("Connection pool is closed.")
+
+
+class AsyncPostgreSQLConnectionPool:
+    """
+    Manages an AsyncConnectionPool configured from DataBaseSettings.
+
+    Unlike PostgreSQLConnectionPool this is not a singleton, a pool can only
+    be used from the event loop that created it.
+
+    Example:
+        async with AsyncPostgreSQLConnectionPool() as pool:
+            # Use the connection pool
+    """
+    def __init__(self):
+        self.connection_pool = None
+
+    async def __aenter__(self):
+        database_config = config.DataBaseSettings.get_config()
+        connection_parameters = database_parameters(database_config)
+        self.connection_pool = AsyncConnectionPool(database_config.min_connections,
+                                                   database_config.max_connections,
+                                                   functools.partial(connect, **connection_parameters),
+                                                   timeout=database_config.pool_timeout,
+                                                   validation_policy=create_validation_policy(database_config),
+                                                   max_lifetime=database_config.max_lifetime,
+                                                   max_idle_time=database_config.max_idle_time)
+        try:
+            await self.connection_pool.open()
+        except psycopg2.Error as postgres_error:
+            custom_error = DatabaseError.from_postgres_exception(postgres_error)
+            raise custom_error from postgres_error
+        logger.info("Async connection pool was succesfully created.")
+        return self.connection_pool
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.connection_pool is not None:
+            await self.connection_pool.closeall()
+
+
+class AsyncPooledDatabaseConnection:
+    """
+    Manages a single connection obtained from an AsyncConnectionPool.
+
+    Connections are validated like the pool's ValidationPolicy would, but
+    with an asynchronous ping. The background policy has no thread here and
+    behaves like the passive one.
+
+    Example:
+        async with AsyncPostgreSQLConnectionPool() as pool:
+            async with AsyncPooledDatabaseConnection(pool) as conn:
+                cursor = await execute(conn, "SELECT * FROM users")
+    """
+    def __init__(self, connection_pool):
+        self.connection = None
+        self.connection_pool = connection_pool
+
+    async def __aenter__(self):
+        if self.connection_pool is None:
+            raise ConfigurationError("Connection pool is missing.")
+        self.connection = await self.get_valid_connection()
+        return self.connection
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if isinstance(exc_val, (psycopg2.Error, DatabaseError)):
+            self.connection_pool.metrics.record_error(exc_val)
+        if self.connection is not None:
+            # A coroutine cancelled mid-query leaves the connection busy, it can't be reused
+            busy = self.connection.isexecuting()
+            self.connection_pool.putconn(self.connection, close=busy)
+            self.connection = None
+
+    @retry(on=psycopg2.OperationalError, attempts=5, timeout=30.0, wait_initial=0.1, wait_max=5.0)
+    async def get_valid_connection(self):
+        """
+        Get a connection from the pool and ensure it's valid, discarding dead
+        ones, with the same stamina retry policy as PooledDatabaseConnection.
+        """
+        try:
+            for _ in range(self.connection_pool.max_connections + 1):
+                connection = await self.connection_pool.getconn()
+                try:
+                    alive = await self.is_connection_alive(connection)
+                except BaseException:
+                    # Cancelled or failed mid-ping, the connection's state is unknown
+                    self.connection_pool.putconn(connection, close=True)
+                    raise
+                if alive:
+                    return connection
+                self.connection_pool.putconn(connection, close=True)
+                logger.info("Chosen connection was no longer active, retrying.")
+        except psycopg2.Error as postgres_error:
+            self.connection_pool.metrics.record_error(postgres_error)
+            custom_error = DatabaseError.from_postgres_exception(postgres_error)
+            raise custom_error from postgres_error
+        raise ConnectionError("Could not acquire a working connection from the pool.")
+
+    async def is_connection_alive(self, connection):
+        policy = self.connection_pool.validation_policy
+        if isinstance(policy, AlwaysValidate):
+            return await ping(connection)
+        if not looks_alive(connection):
+            return False
+        if isinstance(policy, IdleValidate) and self.connection_pool.idle_seconds(connection) > policy.idle_threshold:
+            return await ping(connection)
+        return True
@@ -0,0 +1,246 @@
+"""
+Batched execution of independent read queries on one connection.
+
+A request handler running ten small SELECTs one after another pays ten
+network round trips. execute_batch() sends them together instead:
+
+- psycopg (3) connections run the queries in libpq pipeline mode, every
+  statement is sent before the first result is read.
+- psycopg2 has no pipeline mode and only returns the result of the last
+  statement of a multi-statement query, so the queries are combined into one
+  statement whose columns hold each query's rows as a JSON array:
+
+      SELECT (SELECT coalesce(json_agg(batch_row), '[]') FROM (<query 1>) AS batch_row)::text AS result_1, ...,
+             NULL AS qb_batch_columns_1, qb_batch_columns_1.*, ...
+      FROM (SELECT) AS batch
+      LEFT JOIN (SELECT * FROM (<query 1>) AS batch_row LIMIT 0) AS qb_batch_columns_1 ON true ...
+
+  The LIMIT 0 joins return no rows, they only put each query's columns, with
+  their type OIDs, in the description of the result. The JSON is parsed with
+  the position and text of every value kept, then cast by the psycopg2
+  typecaster of its column, so the rows equal those execute() returns: columns
+  with the same name stay apart, numerics are Decimals and dates are dates.
+
+Results are returned in the order of the queries. When the combined round
+trip fails, the queries are run one by one under savepoints, so that every
+query gets its own result or its own error, mapped through
+DatabaseError.from_postgres_exception.
+
+Example:
+    orders, categories = PooledDatabaseConnection(pool).batch([orders_query, categories_query])
+"""
+
+import json
+import logging
+
+import psycopg2
+import psycopg2.extensions
+
+from .exceptions import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+_RESULT_COLUMN = "(SELECT coalesce(json_agg(batch_row), '[]') FROM ({query}) AS batch_row)::text AS result_{index}"
+_COLUMNS_MARKER = "qb_batch_columns_{index}"
+_COLUMNS_JOIN = "LEFT JOIN (SELECT * FROM ({query}) AS batch_row LIMIT 0) AS qb_batch_columns_{index} ON true"
+_JSON_TYPES = frozenset({114, 3802})  # json, jsonb
+
+
+class _Number(str):
+    """A JSON number, kept as its text until the type of its column is known."""
+
+
+class _Object(list):
+    """The (key, value) pairs of a JSON object, in order and with duplicate keys kept."""
+
+
+def statement_of(query):
+    """The (sql, params) of a QueryBuilder, an (sql, params) pair or a plain SQL string."""
+    if hasattr(query, "get_sql"):
+        return query.get_sql()
+    if isinstance(query, str):
+        return query, None
+    sql, params = query
+    return sql, params
+
+
+def _postgres_errors(connection):
+    """The exception base class of the driver of connection."""
+    if hasattr(connection, "pipeline"):
+        import psycopg
+        return psycopg.Error
+    return psycopg2.Error
+
+
+def _map_error(postgres_error, sql, params):
+    return DatabaseError.from_postgres_exception(
+        postgres_error, params=params if isinstance(params, dict) else None, query=sql)
+
+
+def _plain(value):
+    """A value parsed by _parse() as json.loads would have returned it."""
+    if isinstance(value, _Number):
+        return float(value) if any(char in value for char in ".eE") else int(value)
+    if isinstance(value, _Object):
+        return {key: _plain(item) for key, item in value}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _array_elements(values):
+    """Array values ready for array_literal(): nested JSON objects as dicts, numbers as their text."""
+    return [_array_elements(value) if type(value) is list else _plain(value) if isinstance(value, _Object) else value
+            for value in values]
+
+
+def _converter(cursor, type_code):
+    """Turn a value of a column of type type_code, as parsed by _parse(), into what execute() returns for it."""
+    if type_code in _JSON_TYPES:
+        return _plain
+    casters = getattr(cursor.connection, "string_types", None) or {}
+    caster = casters.get(type_code) or psycopg2.extensions.string_types.get(type_code)
+
+    def convert(value):
+        if value is None:
+            return None
+        if value is True or value is False:
+            text = "t" if value else "f"
+        elif isinstance(value, _Object):
+            text = json.dumps(_plain(value))
+        elif isinstance(value, list):
+            from .bulk import array_literal
+            text = array_literal(_array_elements(value))
+        else:
+            text = value
+        return caster(text, cursor) if caster is not None else str(text)
+
+    return convert
+
+
+def _parse(json_rows):
+    return json.loads(json_rows, object_pairs_hook=_Object, parse_int=_Number, parse_float=_Number)
+
+
+def _rows_of(json_rows, converters=None):
+    """
+    Turn json_agg output into row tuples, in column order, with each value
+    cast by its column's converter, or as plain JSON values without converters.
+    """
+    rows = []
+    for row in _parse(json_rows):
+        if converters is None:
+            rows.append(tuple(_plain(value) for _, value in row))
+        else:
+            rows.append(tuple(convert(value) for convert, (_, value) in zip(converters, row)))
+    return rows
+
+
+def _column_types(description, count):
+    """The type OIDs of the columns of each of count batched queries, None if the description lacks them."""
+    names = [column[0] for column in description or ()]
+    try:
+        markers = [names.index(_COLUMNS_MARKER.format(index=index), count) for index in range(1, count + 1)]
+    except ValueError:
+        return [None] * count
+    ends = markers[1:] + [len(names)]
+    return [[column[1] for column in description[start + 1:end]] for start, end in zip(markers, ends)]
+
+
+def _results_of(cursor, count):
+    row = cursor.fetchone()
+    results = []
+    for json_rows, types in zip(row, _column_types(cursor.description, count)):
+        converters = None if types is None else [_converter(cursor, type_code) for type_code in types]
+        results.append(_rows_of(json_rows, converters))
+    return results
+
+
+def _literal_sql(cursor, sql, params):
+    """The query with its parameters quoted in, so queries with different parameter styles can be combined."""
+    if params is None:
+        return sql
+    return cursor.mogrify(sql, params).decode(psycopg2.extensions.encodings.get(cursor.connection.encoding, "utf-8"))
+
+
+def _combined(cursor, statements):
+    queries = [_literal_sql(cursor, sql, params) for sql, params in statements]
+    columns = [_RESULT_COLUMN.format(query=query, index=index) for index, query in enumerate(queries, 1)]
+    columns += [f"NULL AS {_COLUMNS_MARKER.format(index=index)}, {_COLUMNS_MARKER.format(index=index)}.*"
+                for index in range(1, len(queries) + 1)]
+    joins = [_COLUMNS_JOIN.format(query=query, index=index) for index, query in enumerate(queries, 1)]
+    return "SELECT " + ",\n       ".join(columns) + "\nFROM (SELECT) AS batch\n" + "\n".join(joins)
+
+
+def _pipelined(connection, statements):
+    cursors = []
+    with connection.pipeline():
+        if not connection.autocommit:
+            connection.execute("SAVEPOINT qb_batch_all")
+        for sql, params in statements:
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            cursors.append(cursor)
+    return [cursor.fetchall() for cursor in cursors]
+
+
+def _in_transaction(connection):
+    return connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+
+def _one_by_one(connection, statements, record_error):
+    """Run every statement under its own savepoint, so one failure doesn't abort the others."""
+    errors = _postgres_errors(connection)
+    use_savepoints = not connection.autocommit
+    results = []
+    with connection.cursor() as cursor:
+        for sql, params in statements:
+            try:
+                if use_savepoints:
+                    cursor.execute("SAVEPOINT qb_batch")
+                cursor.execute(sql, params)
+                results.append(cursor.fetchall())
+                if use_savepoints:
+                    cursor.execute("RELEASE SAVEPOINT qb_batch")
+            except errors as postgres_error:
+                if use_savepoints:
+                    cursor.execute("ROLLBACK TO SAVEPOINT qb_batch")
+                record_error(postgres_error)
+                results.append(_map_error(postgres_error, sql, params))
+    return results
+
+
+def execute_batch(connection, queries, record_error=None):
+    """
+    Run independent read queries in as few round trips as possible.
+
+    Returns one entry per query, in order: its rows, or the DatabaseError it
+    failed with. record_error is called with every driver error, e.g. to
+    count it in the pool metrics.
+    """
+    statements = [statement_of(query) for query in queries]
+    if not statements:
+        return []
+    record_error = record_error or (lambda error: None)
+    errors = _postgres_errors(connection)
+    pipelined = hasattr(connection, "pipeline")
+
+    # A savepoint protects an ongoing transaction of the caller from a failed
+    # batch, it's sent along with the batch so it costs no round trip
+    savepoint = pipelined and not connection.autocommit
+    try:
+        if pipelined:
+            return _pipelined(connection, statements)
+        with connection.cursor() as cursor:
+            savepoint = _in_transaction(connection)
+            prefix = "SAVEPOINT qb_batch_all; " if savepoint else ""
+            cursor.execute(prefix + _combined(cursor, statements))
+            return _results_of(cursor, len(statements))
+    except errors as postgres_error:
+        logger.info("Batch of %d queries failed (%s), running them one by one.", len(statements), postgres_error)
+        if savepoint:
+            with connection.cursor() as cursor:
+                cursor.execute("ROLLBACK TO SAVEPOINT qb_batch_all")
+        elif not connection.autocommit:
+            connection.rollback()
+    return _one_by_one(connection, statements, record_error)
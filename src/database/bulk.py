@@ -0,0 +1,311 @@
+"""
+Bulk loading of rows into a table.
+
+One INSERT per row costs a round trip and a statement parse per row, which
+makes nightly loads of millions of rows take hours. bulk_insert() streams rows
+from any iterable instead:
+
+- Small loads (fewer than copy_threshold rows) are sent as multi-row
+  INSERT ... VALUES statements of page_size rows each.
+- Larger loads are streamed with COPY ... FROM STDIN, in chunks of chunk_size
+  rows per COPY statement. The rows are encoded while psycopg2 reads them, so
+  no more than max_buffer_bytes of COPY data is held in memory at a time.
+
+COPY supports PostgreSQL's text format, which works for every column type,
+and its binary format, which skips parsing on the server but needs the column
+types of the table (looked up once per call) and only supports the types in
+BINARY_ENCODERS. In text format lists are written as array literals, like
+psycopg2 sends them to INSERT ... VALUES, so a load behaves the same on
+either side of copy_threshold; dicts and psycopg2 Json values as JSON.
+
+Example:
+    with PostgreSQLConnectionPool() as pool:
+        rows = ({"order_id": id, "product_id": product, "quantity": 1} for id, product in pairs)
+        inserted = bulk_insert(pool, "order_details", rows)
+"""
+
+import itertools
+import json
+import logging
+import struct
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+
+import psycopg2
+from psycopg2.extras import Json
+
+from .connection import checkout_connection
+from .exceptions import DatabaseError
+from .result_cache import tables_written
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1000  # Rows per INSERT ... VALUES statement
+DEFAULT_CHUNK_SIZE = 100_000  # Rows per COPY statement
+DEFAULT_COPY_THRESHOLD = 1000  # Loads with at least this many rows use COPY
+DEFAULT_MAX_BUFFER_BYTES = 1024 * 1024  # COPY data buffered at once
+
+COPY_FORMATS = ("text", "binary")
+
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_BINARY_TRAILER = struct.pack(">h", -1)
+_POSTGRES_EPOCH = date(2000, 1, 1)
+_POSTGRES_EPOCH_DATETIME = datetime(2000, 1, 1)
+_POSTGRES_EPOCH_UTC = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _encode_timestamptz(value):
+    if value.tzinfo is None:
+        raise ValueError("timestamp with time zone columns need timezone aware datetimes")
+    return struct.pack(">q", _microseconds(value - _POSTGRES_EPOCH_UTC))
+
+
+def _encode_json(value):
+    return (value if isinstance(value, str) else json.dumps(value)).encode()
+
+
+# Binary COPY encoders per column type, as named by regtype
+BINARY_ENCODERS = {
+    "boolean": lambda value: b"\x01" if value else b"\x00",
+    "smallint": struct.Struct(">h").pack,
+    "integer": struct.Struct(">i").pack,
+    "bigint": struct.Struct(">q").pack,
+    "real": struct.Struct(">f").pack,
+    "double precision": struct.Struct(">d").pack,
+    "text": lambda value: str(value).encode(),
+    "character varying": lambda value: str(value).encode(),
+    "character": lambda value: str(value).encode(),
+    "bytea": bytes,
+    "date": lambda value: struct.pack(">i", (value - _POSTGRES_EPOCH).days),
+    "timestamp without time zone": lambda value: struct.pack(">q", _microseconds(value - _POSTGRES_EPOCH_DATETIME)),
+    "timestamp with time zone": _encode_timestamptz,
+    "uuid": lambda value: (value if isinstance(value, uuid.UUID) else uuid.UUID(value)).bytes,
+    "json": _encode_json,
+    "jsonb": lambda value: b"\x01" + _encode_json(value),
+}
+
+
+def _literal(value):
+    """A non-null value as PostgreSQL parses it from text, before any COPY escaping."""
+    if value is True or value is False:
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\x" + bytes(value).hex()
+    if isinstance(value, list):
+        return array_literal(value)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    if isinstance(value, Json):
+        return value.dumps(value.adapted)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return f"{_microseconds(value)} microseconds"
+    return str(value)
+
+
+def array_literal(values):
+    """
+    A list as a PostgreSQL array literal, e.g. {"1","2",NULL}, the way
+    psycopg2 sends lists in INSERT ... VALUES. Nested lists are
+    multidimensional arrays, dicts are written as JSON.
+    """
+    elements = []
+    for value in values:
+        if value is None:
+            elements.append("NULL")
+        elif isinstance(value, list):
+            elements.append(array_literal(value))
+        else:
+            elements.append('"' + _literal(value).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(elements) + "}"
+
+
+def text_value(value):
+    """A value in COPY text format."""
+    if value is None:
+        return "\\N"
+    return _literal(value).translate(_TEXT_ESCAPES)
+
+
+def encode_text_row(values):
+    return ("\t".join(map(text_value, values)) + "\n").encode()
+
+
+def binary_row_encoder(column_types):
+    """Build an encoder of rows in COPY binary format for columns of the given types."""
+    unsupported = sorted({column_type for column_type in column_types if column_type not in BINARY_ENCODERS})
+    if unsupported:
+        raise ValueError(f"Binary COPY doesn't support columns of type {', '.join(unsupported)}, use format='text'")
+    encoders = [BINARY_ENCODERS[column_type] for column_type in column_types]
+    field_count = struct.pack(">h", len(encoders))
+
+    def encode(values):
+        parts = [field_count]
+        for encoder, value in zip(encoders, values):
+            if value is None:
+                parts.append(b"\xff\xff\xff\xff")
+            else:
+                data = encoder(value)
+                parts.append(struct.pack(">i", len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    return encode
+
+
+class CopyStream:
+    """
+    File-like reader that encodes rows for COPY ... FROM STDIN on demand.
+
+    copy_expert() calls read(size) until it gets nothing back, so only the
+    bytes of the rows needed to fill one read are ever encoded ahead.
+    """
+
+    def __init__(self, rows, encode_row, header=b"", trailer=b""):
+        self._rows = iter(rows)
+        self._encode_row = encode_row
+        self._buffer = bytearray(header)
+        self._trailer = trailer
+        self._exhausted = False
+        self.rows = 0
+
+    def read(self, size=-1):
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            row = next(self._rows, None)
+            if row is None:
+                self._exhausted = True
+                self._buffer += self._trailer
+            else:
+                self._buffer += self._encode_row(row)
+                self.rows += 1
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    readline = read
+
+
+def _values_of(rows, columns):
+    """Turn dict rows into value tuples in column order, sequences are passed as they are."""
+    for row in rows:
+        if isinstance(row, dict):
+            yield tuple(row[column] for column in columns)
+        else:
+            yield row
+
+
+def _insert_values(cursor, table, columns, rows, page_size):
+    """Multi-row INSERT ... VALUES statements of up to page_size rows each."""
+    row_placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    header = f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+    inserted = 0
+    rows = iter(rows)
+    while True:
+        page = list(itertools.islice(rows, page_size))
+        if not page:
+            return inserted
+        sql = header + ", ".join([row_placeholders] * len(page))
+        cursor.execute(sql, [value for row in page for value in row])
+        inserted += len(page)
+
+
+def _column_types(cursor, table, columns):
+    cursor.execute("SELECT attname, atttypid::regtype::text FROM pg_attribute "
+                   "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped", [table])
+    types = dict(cursor.fetchall())
+    missing = [column for column in columns if column not in types]
+    if missing:
+        raise ValueError(f"Table {table} has no column {', '.join(missing)}")
+    return [types[column] for column in columns]
+
+
+def _copy(cursor, table, columns, rows, copy_format, chunk_size, max_buffer_bytes):
+    """COPY the rows in statements of up to chunk_size rows each."""
+    if copy_format == "binary":
+        encode_row = binary_row_encoder(_column_types(cursor, table, columns))
+        header, trailer, options = _BINARY_HEADER, _BINARY_TRAILER, " WITH (FORMAT binary)"
+    else:
+        encode_row, header, trailer, options = encode_text_row, b"", b"", ""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN{options}"
+
+    inserted = 0
+    rows = iter(rows)
+    while True:
+        first = next(rows, None)
+        if first is None:
+            return inserted
+        stream = CopyStream(itertools.chain([first], itertools.islice(rows, chunk_size - 1)),
+                            encode_row, header, trailer)
+        cursor.copy_expert(sql, stream, size=max_buffer_bytes)
+        inserted += stream.rows
+        logger.debug("Copied %d rows into %s.", inserted, table)
+
+
+def bulk_insert(source, table, rows, columns=None, method="auto", copy_format="text",
+                page_size=DEFAULT_PAGE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                copy_threshold=DEFAULT_COPY_THRESHOLD, max_buffer_bytes=DEFAULT_MAX_BUFFER_BYTES):
+    """
+    Insert rows into table, returning the number of rows inserted.
+
+    Args:
+        source: A connection, or a pool to check one out of. On a pool
+            connection the load is committed as a whole.
+        rows: Iterable of dicts, or of sequences in the order of columns.
+        columns: The columns to insert, taken from the first row if it's a dict.
+        method: "values", "copy", or "auto" to pick by the number of rows.
+        copy_format: "text" or "binary".
+        page_size: Rows per INSERT ... VALUES statement.
+        chunk_size: Rows per COPY statement.
+        copy_threshold: With method="auto", loads of at least this many rows
+            use COPY. Up to this many rows are read ahead to decide.
+        max_buffer_bytes: COPY data encoded ahead of the server at most.
+    """
+    if method not in ("auto", "values", "copy"):
+        raise ValueError(f"Unknown bulk insert method {method!r}")
+    if copy_format not in COPY_FORMATS:
+        raise ValueError(f"Unknown COPY format {copy_format!r}")
+    if min(page_size, chunk_size, max_buffer_bytes) < 1:
+        raise ValueError("page_size, chunk_size and max_buffer_bytes must be positive")
+
+    rows = iter(rows)
+    read_ahead = copy_threshold if method == "auto" else 1
+    first_rows = list(itertools.islice(rows, read_ahead))
+    if not first_rows:
+        return 0
+    if columns is None:
+        if not isinstance(first_rows[0], dict):
+            raise ValueError("columns must be given for rows that aren't dicts")
+        columns = list(first_rows[0])
+    if method == "auto":
+        method = "copy" if len(first_rows) >= copy_threshold else "values"
+    values = _values_of(itertools.chain(first_rows, rows), columns)
+
+    connection, release = checkout_connection(source)
+    try:
+        with connection.cursor() as cursor:
+            if method == "values":
+                inserted = _insert_values(cursor, table, columns, values, page_size)
+            else:
+                inserted = _copy(cursor, table, columns, values, copy_format, chunk_size, max_buffer_bytes)
+    except psycopg2.Error as postgres_error:
+        if release is not None:
+            release(postgres_error)
+        custom_error = DatabaseError.from_postgres_exception(postgres_error, query=f"bulk insert into {table}")
+        raise custom_error from postgres_error
+    except BaseException as error:
+        if release is not None:
+            release(error)
+        raise
+    if release is not None:
+        release(None)
+    tables_written(table, connection=connection if release is None else None)
+    logger.info("Inserted %d rows into %s using %s.", inserted, table, method)
+    return inserted
@@ -0,0 +1,190 @@
+"""
+Fail fast and shed load while the database is struggling.
+
+When the database degrades, every worker that keeps trying to check out a
+connection adds to the pile: they queue up in the pool for pool_timeout
+seconds each, and whatever gets through makes the overload worse. Two guards
+around PooledDatabaseConnection checkouts prevent that:
+
+- CircuitBreaker counts consecutive checkouts that ended in a sign of an
+  unhealthy database (OutOfResourcesError, ConnectionError,
+  AdminInterventionError or a lost connection, but not a query running into
+  its own timeout). After failure_threshold of them it opens and checkouts
+  raise CircuitOpenError straight away. After reset_timeout seconds it lets
+  half_open_calls probe checkouts through (half-open); the first one to
+  succeed closes it, a failing one opens it again. Any other outcome, a
+  syntax error included, shows the database is answering and counts as a
+  success.
+
+- AdaptiveConcurrencyLimiter bounds the checkouts in flight, waiting ones
+  included, and adapts that bound to how long they wait for a connection
+  (AIMD). Time spent holding the connection is the application's own and
+  doesn't count. The recent wait is an exponential moving average compared
+  with a slow moving one, the baseline. When the recent wait exceeds
+  latency_tolerance times the baseline (and min_latency, below which waits
+  are noise), or a checkout fails, the limit shrinks by backoff. Otherwise it
+  grows by one per limit checkouts, back up to initial_limit whenever it's
+  below, beyond that only while the limit is in use. Checkouts beyond the
+  limit raise ConcurrencyLimitError instead of queueing in the pool.
+
+Example:
+    pool = ConnectionPool(1, 10, factory, circuit_breaker=CircuitBreaker(),
+                          concurrency_limiter=AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=20))
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2
+
+from .exceptions import (AdminInterventionError, CircuitOpenError, ConcurrencyLimitError, ConnectionError,
+                         DatabaseError, OutOfResourcesError, QueryTimeoutError)
+from .timeouts import is_timeout
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_TYPES = (OutOfResourcesError, ConnectionError, AdminInterventionError, psycopg2.OperationalError)
+
+
+def is_failure(error, failure_types=FAILURE_TYPES):
+    """Whether error points at an unhealthy database rather than at the query."""
+    if error is None or isinstance(error, QueryTimeoutError) or is_timeout(error):
+        return False  # The query's own deadline, not the database's health
+    if isinstance(error, failure_types):
+        return True
+    # Errors without a SQLSTATE, like a refused connection, map to plain DatabaseErrors
+    return isinstance(error, DatabaseError) and isinstance(error.__cause__, psycopg2.OperationalError)
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures, probes again after reset_timeout seconds."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, half_open_calls=1,
+                 failure_types=FAILURE_TYPES, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.failure_types = failure_types
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._clock = clock
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go to the database now."""
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self.reset_timeout - (self._clock() - self._opened_at)
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(
+                        "The database is failing, not trying it again for now.",
+                        {"retry_after": round(remaining, 3), "consecutive_failures": self.consecutive_failures})
+                self._state = HALF_OPEN
+                self._probes = 0
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError("The database is being probed, not trying it again for now.",
+                                           {"consecutive_failures": self.consecutive_failures})
+                self._probes += 1
+
+    def record(self, error):
+        """Record the outcome of a call allowed through, error being None for a success."""
+        failure = is_failure(error, self.failure_types)
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+            if not failure:
+                self.consecutive_failures = 0
+                if self._state == HALF_OPEN:
+                    self._state = CLOSED
+                    logger.info("Database calls succeed again, circuit breaker closed.")
+                return
+            self.consecutive_failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED
+                                            and self.consecutive_failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = self._clock()
+                self.times_opened += 1
+                logger.warning("Circuit breaker opened after %d consecutive failures, last one: %s",
+                               self.consecutive_failures, error)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on the calls in flight, lowered when their latency rises above its baseline."""
+
+    def __init__(self, initial_limit=10, min_limit=1, max_limit=100, latency_tolerance=2.0,
+                 backoff=0.9, smoothing=0.2, baseline_smoothing=0.01, min_latency=0.005):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Expected 1 <= min_limit <= initial_limit <= max_limit")
+        self.limit = float(initial_limit)
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing  # Weight of a new latency in the recent average
+        self.baseline_smoothing = baseline_smoothing  # Its weight in the baseline
+        self.min_latency = min_latency  # Seconds, latencies up to this are never too slow
+        self.latency = None  # Recent average, seconds
+        self.baseline = None
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def resize(self, max_limit):
+        """Change max_limit, moving the current and initial limit by as much, e.g. after the pool was resized."""
+        with self._lock:
+            change = max_limit - self.max_limit
+            self.limit = min(max(self.min_limit, self.limit + change), max_limit)
+            self.initial_limit = min(max(self.min_limit, self.initial_limit + change), max_limit)
+            self.max_limit = max(max_limit, self.min_limit)
+
+    def acquire(self):
+        """Take a slot, or raise ConcurrencyLimitError when all int(limit) slots are taken."""
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                raise ConcurrencyLimitError(
+                    "Too many database calls in flight, shedding load.",
+                    {"limit": int(self.limit), "in_flight": self.in_flight})
+            self.in_flight += 1
+
+    def release(self, latency=None, failed=False):
+        """Give a slot back, adapting the limit to the call's latency unless it is None."""
+        with self._lock:
+            was_in_flight = self.in_flight
+            self.in_flight -= 1
+            if latency is None and not failed:
+                return
+            if latency is not None:
+                if self.latency is None:
+                    self.latency = self.baseline = latency
+                else:
+                    self.latency += self.smoothing * (latency - self.latency)
+                    self.baseline += self.baseline_smoothing * (latency - self.baseline)
+            if failed or self.latency > self.latency_tolerance * max(self.baseline, self.min_latency):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif self.limit < self.initial_limit:
+                self.limit = min(self.initial_limit, self.limit + 1 / self.limit)
+            elif was_in_flight >= self.limit / 2:
+                # Only grow a limit beyond its initial value while it is being used
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
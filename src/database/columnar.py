@@ -0,0 +1,187 @@
+"""
+Columnar query results for Arrow and Polars.
+
+pl.read_database() and cursor.fetchall() turn every row into a Python tuple
+of Python objects before a DataFrame is built column by column. Here the
+server writes the result with COPY (query) TO STDOUT in CSV format instead,
+and Arrow's multithreaded CSV reader decodes it straight into columnar
+buffers, so no per-row Python objects are created at all.
+
+The column types are taken from the query itself (a LIMIT 0 run of it reports
+them without producing rows) rather than guessed from the data, so every batch
+of a streamed result has the same schema. COPY can't take bind parameters,
+the parameters are quoted into the query by psycopg2's mogrify().
+
+The COPY runs in a helper thread writing into a pipe that the CSV reader
+consumes, so stream_arrow() and stream_polars() hand out record batches of
+about block_size bytes of CSV while the rest of the result is still coming
+in, and results larger than memory can be processed batch by batch.
+
+pyarrow, and polars for the polars functions, have to be installed.
+"""
+
+import os
+import threading
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+from .connection import checkout_connection
+from .exceptions import DatabaseError
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024  # Bytes of CSV per record batch
+_COPY_READ_SIZE = 64 * 1024
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError as error:
+        raise ImportError("Columnar results need pyarrow, install it with 'pip install pyarrow'") from error
+    return pyarrow
+
+
+def _import_polars():
+    try:
+        import polars
+    except ImportError as error:
+        raise ImportError("Polars results need polars, install it with 'pip install polars'") from error
+    return polars
+
+
+def arrow_type(pa, column):
+    """The Arrow type for a column of cursor.description."""
+    simple_types = {
+        16: pa.bool_(),                        # boolean
+        20: pa.int64(),                        # bigint
+        21: pa.int16(),                        # smallint
+        23: pa.int32(),                        # integer
+        26: pa.int64(),                        # oid
+        700: pa.float32(),                     # real
+        701: pa.float64(),                     # double precision
+        1082: pa.date32(),                     # date
+        1083: pa.time64("us"),                 # time
+        1114: pa.timestamp("us"),              # timestamp
+        1184: pa.timestamp("us", tz="UTC"),    # timestamp with time zone
+    }
+    if column.type_code in simple_types:
+        return simple_types[column.type_code]
+    if column.type_code == 1700:  # numeric
+        if column.precision is not None and 0 < column.precision <= 38:
+            return pa.decimal128(column.precision, column.scale or 0)
+        # Unconstrained numeric has no fixed scale and allows up to 16383 digits after
+        # the point (and NaN), which no Arrow type holds: keep its exact text
+        return pa.string()
+    return pa.string()
+
+
+def _copy_sql(cursor, sql, params):
+    if params is not None:
+        encoding = psycopg2.extensions.encodings.get(cursor.connection.encoding, "utf-8")
+        sql = cursor.mogrify(sql, params).decode(encoding)
+    return f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+
+def _schema(pa, cursor, sql, params):
+    cursor.execute(f"SELECT * FROM ({sql}) AS columnar_query LIMIT 0", params)
+    return pa.schema([(column.name, arrow_type(pa, column)) for column in cursor.description])
+
+
+def stream_arrow(source, sql, params=None, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Yield the result of a query as pyarrow RecordBatches, at least one (empty)
+    batch for an empty result.
+
+    source is a connection, or a pool to check one out of until the batches
+    are exhausted or the generator is closed. Closing the generator early
+    cancels the COPY on the server.
+    """
+    pa = _import_pyarrow()
+    connection, release = checkout_connection(source)
+    error = None
+    try:
+        with connection.cursor() as cursor:
+            schema = _schema(pa, cursor, sql, params)
+            yield from _copy_batches(pa, connection, cursor, _copy_sql(cursor, sql, params), schema, block_size)
+    except psycopg2.Error as postgres_error:
+        error = postgres_error
+        custom_error = DatabaseError.from_postgres_exception(
+            postgres_error, params=params if isinstance(params, dict) else None, query=sql)
+        raise custom_error from postgres_error
+    except BaseException as other_error:
+        error = other_error
+        raise
+    finally:
+        if release is not None:
+            release(error)
+
+
+def _copy_batches(pa, connection, cursor, copy_sql, schema, block_size):
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, "rb")
+    writer = os.fdopen(write_fd, "wb")
+    failures = []
+
+    def copy():
+        try:
+            cursor.copy_expert(copy_sql, writer, size=_COPY_READ_SIZE)
+        except BaseException as copy_error:
+            failures.append(copy_error)
+        finally:
+            writer.close()
+
+    thread = threading.Thread(target=copy, name="columnar-copy", daemon=True)
+    thread.start()
+    produced = finished = False
+    parse_error = None
+    try:
+        batches = pa.csv.open_csv(
+            reader,
+            read_options=pa.csv.ReadOptions(block_size=block_size),
+            # COPY writes NULL as an unquoted empty field, anything else (like a "NaN") is a value
+            convert_options=pa.csv.ConvertOptions(
+                column_types=schema, true_values=["t"], false_values=["f"],
+                null_values=[""], strings_can_be_null=True, quoted_strings_can_be_null=False))
+        for batch in batches:
+            produced = True
+            yield batch
+        finished = True
+    except pa.ArrowInvalid as invalid:
+        parse_error = invalid
+    finally:
+        if not finished:
+            # Stopped early, cancel the COPY and let it run into the end of the pipe
+            connection.cancel()
+            while reader.read(_COPY_READ_SIZE):
+                pass
+        thread.join()
+        reader.close()
+
+    copy_error = failures[0] if failures else None
+    if copy_error is not None and not isinstance(copy_error, psycopg2.errors.QueryCanceled):
+        raise copy_error  # The CSV was cut short by a failed COPY, that error is the interesting one
+    if parse_error is not None:
+        raise parse_error
+    if not produced:
+        yield pa.RecordBatch.from_pylist([], schema=schema)
+
+
+def fetch_arrow(source, sql, params=None, block_size=DEFAULT_BLOCK_SIZE):
+    """The whole result of a query as a pyarrow Table."""
+    pa = _import_pyarrow()
+    return pa.Table.from_batches(list(stream_arrow(source, sql, params, block_size)))
+
+
+def stream_polars(source, sql, params=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield the result of a query as Polars DataFrames, one per record batch."""
+    pl = _import_polars()
+    for batch in stream_arrow(source, sql, params, block_size):
+        yield pl.from_arrow(batch)
+
+
+def fetch_polars(source, sql, params=None, block_size=DEFAULT_BLOCK_SIZE):
+    """The whole result of a query as a Polars DataFrame."""
+    pl = _import_polars()
+    return pl.from_arrow(fetch_arrow(source, sql, params, block_size))
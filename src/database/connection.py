@@ -1,71 +1,319 @@
+import functools
 import logging
+import os
+import signal
+import threading
+import time
 
 import psycopg2
-import psycopg2.pool
-from dotenv import load_dotenv
-from stamina import retry
+import psycopg2.extensions
 
-from config import DataBaseSettings
-from .exceptions import ConnectionError, ConfigurationError, OutOfResourcesError, DatabaseError, AdminInterventionError
+import config
+from . import result_cache
+from .batch import execute_batch
+from .circuit_breaker import AdaptiveConcurrencyLimiter, CircuitBreaker, is_failure
+from .exceptions import (ConnectionError, ConfigurationError, OutOfResourcesError, DatabaseError, AdminInterventionError,
+                         CircuitOpenError, QueryTimeoutError)
+from .metrics import ErrorRateLog
+from .pool import ConnectionPool, PoolMaintenance
+from .retrying import retry
+from .routing import ReplicaMonitor, ReplicaRouter
+from .timeouts import Deadline, connection_options, is_timeout, watch
+from .validation import AlwaysValidate, create_validation_policy
+from ..utils.logging_utils import RateLimitFilter
 
-load_dotenv() 
 logger = logging.getLogger(__name__)
-logging.basicConfig(filename='example.log', encoding='utf-8', 
-                    level=logging.DEBUG, format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+# Logged on every checkout: DEBUG only, and rate limited, see src/utils/logging_utils.py
+checkout_logger = logging.getLogger(__name__ + ".checkout")
+checkout_logger.addFilter(RateLimitFilter(rate=1.0, burst=10))
+# Checkouts fail the same way many times a second while the database is down
+_error_log = ErrorRateLog(logger)
 
 
 class Singleton(type):
     """
-    A metaclass that ensures only one instance of a class exists.
+    A metaclass that ensures only one instance of a class exists per name,
+    so several named pools (e.g. "primary" and "replica") can live side by side.
+
+    Creation is guarded by a lock, so concurrent threads always get the same
+    instance. After a fork the child starts with no instances at all: the
+    inherited ones are handed to their class's _after_fork hook and dropped,
+    and new ones are created lazily on first use.
     """
     def __init__(self, *args, **kwargs):
-        self.__instance = None
+        self._instances = {}
+        self._instances_lock = threading.Lock()
+        self._instances_pid = os.getpid()
         super().__init__(*args, **kwargs)
-    
-    def __call__(self, *args, **kwargs):
-        if self.__instance is None:
-            self.__instance = super().__call__(*args, **kwargs)
-        return self.__instance
+        os.register_at_fork(after_in_child=self._reset_lock_after_fork)
+
+    def __call__(self, name="primary", *args, **kwargs):
+        if self._instances_pid != os.getpid():
+            self._drop_inherited_instances()
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._instances_lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = super().__call__(name, *args, **kwargs)
+                    self._instances[name] = instance
+        return instance
+
+    def _reset_lock_after_fork(self):
+        # Another thread of the parent may have held the lock while forking
+        self._instances_lock = threading.Lock()
+
+    def _drop_inherited_instances(self):
+        with self._instances_lock:
+            if self._instances_pid == os.getpid():
+                return
+            for instance in self._instances.values():
+                instance._after_fork()
+            self._instances = {}
+            self._instances_pid = os.getpid()
 
 
-# Look at Python libraries like pybreaker or circuitbreaker.
 class PostgreSQLConnectionPool(metaclass=Singleton):
     """
-    Manages a pool of PostgreSQL database connections as a singleton.
+    Manages a pool of PostgreSQL database connections as a singleton per name.
     This class provides reuse of database connections through connection pooling.
+    The underlying ConnectionPool is safe to share between threads; when it is
+    exhausted, callers wait up to pool_timeout seconds for a connection.
+
+    The pool is opened by the first `with` block to enter and closed when the
+    last one exits, so threads can enter it concurrently. Named pools can be
+    given their own settings, otherwise DataBaseSettings.get_config() is used.
     
     Example:
         with PostgreSQLConnectionPool() as pool:
             # Use the connection pool
+
+        with PostgreSQLConnectionPool("replica", settings=replica_settings) as pool:
+            # Use the replica's connection pool
+
+    With REPLICA_HOSTS configured, the pool is a ReplicaRouter (see
+    routing.py) that sends read-only QueryBuilder SELECTs to the replicas and
+    everything else to the primary.
+
+    reload() applies changed settings to the open pool, see reload_pools()
+    and install_reload_signal() to do that for every pool on SIGHUP.
     """
-    def __init__(self):
+    def __init__(self, name="primary", settings=None):
+        self.name = name
+        self.settings = settings
+        self.config = None  # The settings the pool was opened or last reloaded with
         self.connection_pool = None
-        # Todo:
-        # self.checkout_times = {}  # Track when connections were checked out
-        # self.connection_ages = {}  # Track when connections were created
-        # self.wait_times = []      # Recent wait times for connection acquisition
-        # self.error_counts = {}    # Errors by connection
+        self.maintenance = None
+        self.replica_monitor = None
+        self._users = 0
+        self._lock = threading.Lock()
 
     def __enter__(self):
-        database_config = DataBaseSettings.get_config()
-        connection_parameters = {
-        "host": database_config.host,
-        "database": database_config.database,
-        "user": database_config.user,
-        "password": database_config.password.get_secret_value(),
-        }
-        try:
-            self.connection_pool = psycopg2.pool.SimpleConnectionPool(database_config.min_connections, 
-                                                             database_config.max_connections, **connection_parameters)
-            logger.info("Connection pool was succesfully created.")
+        with self._lock:
+            if self._users == 0:
+                self._open()
+            self._users += 1
             return self.connection_pool
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._lock:
+            self._users -= 1
+            if self._users == 0:
+                self._close()
+
+    def _open(self):
+        database_config = self.config = self.settings or config.DataBaseSettings.get_config()
+        connection_parameters = database_parameters(database_config)
+        try:
+            self.connection_pool = self._create_pool(database_config, connection_parameters)
+            if database_config.replica_hosts:
+                # Opened by the maintenance thread, so an unreachable replica doesn't keep the pool from opening
+                replicas = [self._create_pool(database_config, {**connection_parameters, **replica_address(host)},
+                                              lazy=True)
+                            for host in database_config.replica_hosts]
+                self.connection_pool = ReplicaRouter(self.connection_pool, replicas,
+                                                     strategy=database_config.routing_strategy,
+                                                     max_lag=database_config.max_replica_lag)
+                self.replica_monitor = ReplicaMonitor(database_config.replica_check_interval)
+                self.replica_monitor.start(self.connection_pool)
+            self.maintenance = PoolMaintenance(database_config.maintenance_interval)
+            self.maintenance.start(self.connection_pool)
+            logger.info("Connection pool %r was succesfully created.", self.name)
         except psycopg2.Error as postgres_error:
             custom_error = DatabaseError.from_postgres_exception(postgres_error)
             raise custom_error from postgres_error
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    @staticmethod
+    def _create_pool(database_config, connection_parameters, lazy=False):
+        """A pool for database_config, a lazy one opens its min_connections with the next maintain()."""
+        connection_pool = ConnectionPool(0 if lazy else database_config.min_connections,
+                                         database_config.max_connections,
+                                         functools.partial(psycopg2.connect, **connection_parameters),
+                                         timeout=database_config.pool_timeout,
+                                         validation_policy=create_validation_policy(database_config),
+                                         max_lifetime=database_config.max_lifetime,
+                                         max_idle_time=database_config.max_idle_time,
+                                         circuit_breaker=create_circuit_breaker(database_config),
+                                         concurrency_limiter=create_concurrency_limiter(database_config))
+        if lazy:
+            connection_pool.resize(database_config.min_connections, database_config.max_connections)
+        connection_pool.validation_policy.start(connection_pool)
+        return connection_pool
+
+    def _close(self):
         if self.connection_pool is not None:
+            self.maintenance.stop()
+            if self.replica_monitor is not None:
+                self.replica_monitor.stop()
+                self.replica_monitor = None
+            pools = getattr(self.connection_pool, "pools", [self.connection_pool])
+            for connection_pool in pools:
+                connection_pool.validation_policy.stop()
             self.connection_pool.closeall()
+            self.connection_pool = None
+            self.maintenance = None
+
+    def reload(self, settings=None):
+        """
+        Apply changed settings to the open pool, without taking connections
+        away from the callers holding them.
+
+        The pool's own settings are used if it was given any (settings
+        replaces them), otherwise the environment and .env are read again.
+        Returns the settings now in effect.
+        """
+        if settings is not None:
+            self.settings = settings
+        database_config = self.settings or config.DataBaseSettings.reload()
+        self._apply(database_config)
+        return database_config
+
+    def _apply(self, database_config):
+        """
+        Pool sizes, pool_timeout, connection lifetimes, maintenance and
+        replica check intervals, the replica lag limit, the circuit breaker's
+        thresholds and the load shedding limit change in place. When the
+        connection parameters changed (host, credentials, STATEMENT_TIMEOUT or
+        LOCK_TIMEOUT), connections are replaced as they come back to the pool.
+        Replica hosts, the routing strategy, the validation policy and turning
+        the circuit breaker or load shedding on or off need the pool reopened.
+        """
+        with self._lock:
+            previous, self.config = self.config, database_config
+            if self.connection_pool is None:
+                return  # Opened with the new settings next time
+            if database_config.replica_hosts != previous.replica_hosts:
+                logger.warning("REPLICA_HOSTS changed, the replicas of pool %r only change when it's reopened.",
+                               self.name)
+            parameters = database_parameters(database_config)
+            recycle = parameters != database_parameters(previous)
+            pools = getattr(self.connection_pool, "pools", [self.connection_pool])
+            addresses = [{}] + [replica_address(host) for host in previous.replica_hosts]
+            for connection_pool, address in zip(pools, addresses):
+                connection_pool.resize(database_config.min_connections, database_config.max_connections)
+                connection_pool.timeout = database_config.pool_timeout
+                connection_pool.max_lifetime = database_config.max_lifetime
+                connection_pool.max_idle_time = database_config.max_idle_time
+                if recycle:
+                    connection_pool.recycle(functools.partial(psycopg2.connect, **{**parameters, **address}))
+                if connection_pool.circuit_breaker is not None and database_config.circuit_failure_threshold:
+                    connection_pool.circuit_breaker.failure_threshold = database_config.circuit_failure_threshold
+                    connection_pool.circuit_breaker.reset_timeout = database_config.circuit_reset_timeout
+                if connection_pool.concurrency_limiter is not None:
+                    connection_pool.concurrency_limiter.resize(
+                        database_config.max_concurrency or 2 * database_config.max_connections)
+                    connection_pool.concurrency_limiter.latency_tolerance = database_config.latency_tolerance
+            self.maintenance.interval = database_config.maintenance_interval
+            if self.replica_monitor is not None:
+                self.replica_monitor.interval = database_config.replica_check_interval
+                self.connection_pool.max_lag = database_config.max_replica_lag
+        logger.info("Connection pool %r reloaded its settings: %d to %d connections%s.", self.name,
+                    database_config.min_connections, database_config.max_connections,
+                    ", replacing connections" if recycle else "")
+
+    def _after_fork(self):
+        """Called in a forked child, the inherited connections belong to the parent."""
+        if self.connection_pool is not None:
+            self.connection_pool.detach_after_fork()
+
+    def stats(self):
+        """
+        Snapshot of checkout wait and hold times, connection counts and errors,
+        see ConnectionPool.stats.
+        """
+        if self.connection_pool is None:
+            raise ConfigurationError("Connection pool is missing.")
+        return self.connection_pool.stats()
+
+
+def reload_pools():
+    """Read the settings again and apply them to every PostgreSQLConnectionPool, see PostgreSQLConnectionPool.reload()."""
+    database_config = config.DataBaseSettings.reload()
+    for pool in list(PostgreSQLConnectionPool._instances.values()):
+        pool._apply(pool.settings or database_config)
+
+
+def install_reload_signal(signum=signal.SIGHUP):
+    """
+    Call reload_pools() whenever the process receives signum, to retune the
+    pools of a running service with `kill -HUP <pid>`.
+
+    The reload runs on a thread of its own: the signal handler interrupts the
+    main thread anywhere, possibly while it holds a pool's lock. Returns the
+    previous handler.
+    """
+    def reload_in_background():
+        try:
+            reload_pools()
+        except Exception:
+            logger.exception("Reloading the database settings failed, keeping the current ones.")
+
+    def handler(signum, frame):
+        threading.Thread(target=reload_in_background, name="settings-reload", daemon=True).start()
+
+    return signal.signal(signum, handler)
+
+
+def database_parameters(database_config):
+    """psycopg2.connect() keyword arguments for the primary configured in DataBaseSettings."""
+    connection_parameters = {
+        "host": database_config.host,
+        "database": database_config.database,
+        "user": database_config.user,
+        "password": database_config.password.get_secret_value(),
+    }
+    options = connection_options(database_config.statement_timeout, database_config.lock_timeout)
+    if options is not None:
+        connection_parameters["options"] = options
+    return connection_parameters
+
+
+def create_circuit_breaker(database_config):
+    """The circuit breaker configured in DataBaseSettings, None when it's turned off."""
+    if not database_config.circuit_failure_threshold:
+        return None
+    return CircuitBreaker(database_config.circuit_failure_threshold, database_config.circuit_reset_timeout)
+
+
+def create_concurrency_limiter(database_config):
+    """The adaptive concurrency limiter configured in DataBaseSettings, None when load shedding is off."""
+    if not database_config.load_shedding:
+        return None
+    max_limit = database_config.max_concurrency or 2 * database_config.max_connections
+    return AdaptiveConcurrencyLimiter(initial_limit=max_limit, max_limit=max_limit,
+                                      latency_tolerance=database_config.latency_tolerance)
+
+
+def replica_address(host):
+    """Connection parameters for a replica given as "host" or "host:port"."""
+    host, _, port = host.partition(":")
+    return {"host": host, "port": int(port)} if port else {"host": host}
+
+
+_OPEN_TRANSACTION_STATUSES = (
+    psycopg2.extensions.TRANSACTION_STATUS_INTRANS,
+    psycopg2.extensions.TRANSACTION_STATUS_INERROR,
+)
 
 
 class PooledDatabaseConnection:
@@ -77,72 +325,201 @@ class PooledDatabaseConnection:
             with PooledDatabaseConnection(pool) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT * FROM users")
+
+    Checked out connections are validated with the pool's validation policy
+    (see validation.py), unless a different one is passed in. A pool with a
+    circuit breaker or concurrency limiter (see circuit_breaker.py) may turn
+    the checkout away with CircuitOpenError or ConcurrencyLimitError.
+
+    With a deadline (seconds from entering the block, or a timeouts.Deadline)
+    the query running when it passes is cancelled on the server, and the
+    block fails with QueryTimeoutError.
     """
-    def __init__(self, connection_pool):
+    def __init__(self, connection_pool, validation_policy=None, deadline=None):
         self.connection = None
+        self.deadline = deadline
+        self._watch = None
         self.connection_pool = connection_pool
+        if validation_policy is None:
+            validation_policy = getattr(connection_pool, "validation_policy", None) or AlwaysValidate()
+        self.validation_policy = validation_policy
+        self.circuit_breaker = getattr(connection_pool, "circuit_breaker", None)
+        self.concurrency_limiter = getattr(connection_pool, "concurrency_limiter", None)
+        self._admitted_at = None
+        self._acquired_after = None  # Seconds from admission to a usable connection
 
     def __enter__(self):
+        self._admit()
+        try:
+            self.connection = self._acquire()
+        except BaseException as error:
+            self._settle(error)
+            raise
+        self._acquired_after = time.perf_counter() - self._admitted_at
+        if self.deadline is not None:
+            self._watch = watch(self.connection, Deadline.of(self.deadline))
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if isinstance(exc_val, (psycopg2.Error, DatabaseError)):
+            self.connection_pool.metrics.record_error(exc_val)
+        cancelled = False
+        if self._watch is not None:
+            self._watch.stop()
+            cancelled = self._watch.fired
+            self._watch = None
+        timed_out = cancelled or (isinstance(exc_val, psycopg2.Error) and is_timeout(exc_val))
+        if self.connection is not None:
+            self._return_connection()
+        self._settle(exc_val)
+        if timed_out and isinstance(exc_val, psycopg2.Error):
+            custom_error = DatabaseError.from_postgres_exception(exc_val)
+            if not isinstance(custom_error, QueryTimeoutError):
+                custom_error = QueryTimeoutError(str(exc_val), custom_error.details)
+            raise custom_error from exc_val
+
+    def _return_connection(self):
+        """
+        Give the connection back. A transaction left open, or aborted by a
+        cancelled query, is rolled back first, so the next user of the
+        connection doesn't inherit it. Commit inside the block, or use
+        transaction.transaction(), to keep the changes.
+        """
+        connection, self.connection = self.connection, None
+        # Whatever was written is committed or about to be rolled back, neither needs the cached results
+        result_cache.transaction_ended(connection)
+        if not connection.closed and connection.get_transaction_status() in _OPEN_TRANSACTION_STATUSES:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                self.connection_pool.putconn(connection, close=True)
+                return
+        self.connection_pool.putconn(connection)
+
+    def _admit(self):
+        """Let the concurrency limiter and circuit breaker of the pool turn the checkout away."""
+        if self.concurrency_limiter is not None:
+            self.concurrency_limiter.acquire()
+        if self.circuit_breaker is not None:
+            try:
+                self.circuit_breaker.allow()
+            except CircuitOpenError:
+                if self.concurrency_limiter is not None:
+                    self.concurrency_limiter.release()
+                raise
+        self._admitted_at = time.perf_counter()
+
+    def _settle(self, error):
+        """
+        Report how the checkout ended to the circuit breaker, and how long it
+        waited for its connection to the concurrency limiter. How long the
+        connection was then held is up to the caller, not the database.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(error)
+        if self.concurrency_limiter is not None:
+            self.concurrency_limiter.release(self._acquired_after, failed=is_failure(error))
+            self._acquired_after = None
+
+    def _acquire(self):
         try:
-            self.connection = self.get_valid_connection()
-            return self.connection
-        except ConnectionError:
-            logger.warning("Failed to acquire connection from connection pool.")
+            return self.get_valid_connection()
+        except ConnectionError as error:
+            _error_log.report(error, "Failed to acquire connection from connection pool.")
             raise
-        except OutOfResourcesError:
-            logger.warning("Database is out of resources. Please try again later.")
-            # Maybe add implementation here for retry after a while?
+        except OutOfResourcesError as error:
+            _error_log.report(error, "Database is out of resources. Please try again later.")
             raise
-        except AdminInterventionError:
-            logger.warning("Admin has intervened.")
+        except AdminInterventionError as error:
+            _error_log.report(error, "Admin has intervened.")
             raise
         except ConfigurationError:
             logger.warning("Connection pool is missing")
             raise
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.connection is not None:
-            self.connection_pool.putconn(self.connection)
-
     @retry(on=psycopg2.OperationalError, attempts=5, timeout=30.0, wait_initial=0.1, wait_max=5.0)
     def get_valid_connection(self):
         """
         Get a connection from the pool and ensure it's valid, using
         stamina to make sure retrying does not clog up network traffic.
     
-        If the connection fails validation, it's discarded and a new one 
-        is created to replace it.
+        If the connection fails validation, it's discarded and the next one
+        is tried, until the pool has to open a new connection to replace it.
     
         Returns:
             A valid database connection
         """
-        connection = None
-        if self.connection_pool is not None:
-            logger.info("Acquiring connection from connection pool.")
-            try:
+        if self.connection_pool is None:
+            raise ConfigurationError("Connection pool is missing.")
+
+        checkout_logger.debug("Acquiring connection from connection pool.")
+        try:
+            # Every idle connection could be dead, after that the pool opens fresh ones
+            for _ in range(self.connection_pool.max_connections + 1):
                 connection = self.connection_pool.getconn()
                 if self.is_connection_alive(connection):
-                    logger.info("Connection acquired.")
+                    checkout_logger.debug("Connection acquired.")
                     return connection
-                else:
-                    self.connection_pool.putconn(connection, close=True)
-                    logger.info("Chosen connection was no longer active, retrying.")
-            except psycopg2.Error as postgres_error:
-                custom_error = DatabaseError.from_postgres_exception(postgres_error)
-                raise custom_error from postgres_error
-        else:
-            raise ConfigurationError("Connection pool is missing.")
-        
+                self.connection_pool.putconn(connection, close=True)
+                checkout_logger.info("Chosen connection was no longer active, retrying.")
+        except psycopg2.Error as postgres_error:
+            self.connection_pool.metrics.record_error(postgres_error)
+            custom_error = DatabaseError.from_postgres_exception(postgres_error)
+            raise custom_error from postgres_error
+        raise ConnectionError("Could not acquire a working connection from the pool.")
+
+    def batch(self, queries):
+        """
+        Run independent read queries in one round trip, see batch.py.
+
+        Returns one entry per query, in order: its rows, or the DatabaseError
+        it failed with. Runs on the checked out connection inside a with
+        block, otherwise a connection is checked out for the batch alone.
+        """
+        if self.connection is not None:
+            return execute_batch(self.connection, queries, self.connection_pool.metrics.record_error)
+        with self as connection:
+            results = execute_batch(connection, queries, self.connection_pool.metrics.record_error)
+            connection.commit()
+            return results
+
     def is_connection_alive(self, connection):
         """
-        Verify if a database connection is still active and usable.
+        Verify if a database connection is still active and usable, according
+        to the validation policy.
         """
+        idle_seconds = self.connection_pool.idle_seconds(connection)
+        return self.validation_policy.is_valid(connection, idle_seconds)
+
+
+def checkout_connection(source):
+    """
+    The connection to run a query on, given a connection or a pool, and how to
+    release it again.
+
+    A pool connection is released by calling release(error): its transaction
+    is committed, or rolled back if error is not None, and the connection goes
+    back to the pool. For a plain connection release is None, its transaction
+    belongs to the caller.
+    """
+    if not hasattr(source, "getconn"):
+        return source, None
+
+    checkout = PooledDatabaseConnection(source)
+    connection = checkout.__enter__()
+
+    def release(error):
         try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT 1")
-                result = cursor.fetchone()
-                return result[0] == 1
-        except psycopg2.Error as postgres_error:
-            custom_error = DatabaseError.from_postgres_exception(postgres_error)
-            raise custom_error from postgres_error
-        
\ No newline at end of file
+            if error is None:
+                connection.commit()
+            else:
+                connection.rollback()
+        except psycopg2.Error:
+            logger.warning("Ending the transaction of a pool connection failed.", exc_info=True)
+        finally:
+            try:
+                checkout.__exit__(type(error) if error is not None else None, error, None)
+            except QueryTimeoutError:
+                pass  # The caller maps the error of its query itself
+
+    return connection, release
@@ -6,8 +6,15 @@ providing more specific error types for different database failure scenarios.
 Each exception corresponds to a specific class of PostgreSQL error codes.
 """
 
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
+
+SENSITIVE_PARAM_NAMES = ('password', 'token', 'secret', 'key')
+
+# The diag fields copied into details, besides sqlstate
+_DIAG_FIELDS = ("message_detail", "constraint_name", "schema_name", "table_name", "column_name",
+                "statement_position")
 
 
 class DatabaseError(Exception):
@@ -16,16 +23,37 @@ class DatabaseError(Exception):
     Attributes:
         message (str): Human-readable error description
         details (Dict): Additional context about the error
-        timestamp (datetime): When the exception was created
+        sqlstate (str): The PostgreSQL error code, None if the error didn't come from the server
     """
 
+    sqlstate = None
+    _pending_details = None
+
     def __init__(self, message: str, details: Optional[Dict[str, Any]] = None):
         self.message = message
         self.details = details
 
         super().__init__(self, f"{self.message}")
+
+    @property
+    def details(self) -> Optional[Dict[str, Any]]:
+        # Errors created by from_postgres_exception only gather their details when they are looked at
+        if self._pending_details is not None:
+            pending, self._pending_details = self._pending_details, None
+            self._details = pending()
+        return self._details
+
+    @details.setter
+    def details(self, details):
+        self._pending_details = None
+        self._details = details
+
+    def _defer_details(self, gather: Callable[[], Dict[str, Any]]):
+        self._pending_details = gather
     
     def __str__(self):
+        if not self.details:
+            return self.message
         detail_items = [f"{key}={value}" for key, value in self.details.items() if value is not None]
         return f"{self.message} [{', '.join(detail_items)}]"
     
@@ -34,30 +62,31 @@ class DatabaseError(Exception):
         """Create the appropriate DatabaseError subclass from a PostgreSQL exception.
 
         Where postgres_exception is postgresql's error object given by psycopg2.
+
+        Only the SQLSTATE is read straight away. The rest of details (the diag
+        fields and the redacted params) is gathered the first time details is
+        used, errors that are only caught and counted never pay for it.
         """
         if params is not None and not isinstance(params, dict):
             raise ValueError("Database parameters must be provided as a dictionary for proper error handling")
     
-        sqlstate = getattr(postgres_exception.diag, "sqlstate", "")
-        error_class = sqlstate[:2] if sqlstate else "" # Grab the first 2 numbers of the postgreqsql object's error code
-
-        exception_class = PG_ERROR_MAPPING.get(error_class, DatabaseError)
-
-        message = str(postgres_exception)
-        details = {
-            "query": query,
-            "params": cls.remove_password_and_tokens_from_params(params),
-            "sqlstate": sqlstate,
-            "message_detail": getattr(postgres_exception.diag, "message_detail"),
-            "constraint_name": getattr(postgres_exception.diag, "constraint_name"),
-            "schema_name": getattr(postgres_exception.diag, "schema_name"),
-            "table_name": getattr(postgres_exception.diag, "table_name"),
-            "column_name": getattr(postgres_exception.diag, "column_name"),
-            "statement_position": getattr(postgres_exception.diag, "statement_position"),
-            "datetime": datetime.time(timezone.utc)
-        }
-        details = {key: value for key, value in details.items() if value is not None}
-        return exception_class(message, details)
+        sqlstate = getattr(postgres_exception.diag, "sqlstate", None) or ""
+        created_at = time.time()
+
+        def gather():
+            details = {
+                "query": query,
+                "params": cls.remove_password_and_tokens_from_params(params),
+                "sqlstate": sqlstate,
+                **{field: getattr(postgres_exception.diag, field, None) for field in _DIAG_FIELDS},
+                "datetime": datetime.fromtimestamp(created_at, timezone.utc)
+            }
+            return {key: value for key, value in details.items() if value is not None}
+
+        error = exception_class_for(sqlstate)(str(postgres_exception))
+        error.sqlstate = sqlstate or None
+        error._defer_details(gather)
+        return error
     
     @staticmethod
     def remove_password_and_tokens_from_params(params):
@@ -66,7 +95,7 @@ class DatabaseError(Exception):
         
         cleaned_params = params.copy()
         for key in cleaned_params:
-            if any(sensitive in key.lower() for sensitive in ['password', 'token', 'secret', 'key']):
+            if any(sensitive in key.lower() for sensitive in SENSITIVE_PARAM_NAMES):
                 cleaned_params[key] = "[REDACTED]"
         return cleaned_params
 
@@ -137,6 +166,54 @@ class OutOfResourcesError(DatabaseError):
     """
 
 
+class PoolTimeoutError(OutOfResourcesError):
+    """Connection pool exhaustion errors.
+
+    Raised when no pooled connection became available within the pool's
+    timeout, because every connection was checked out and the pool was
+    already at max_connections.
+    """
+
+
+class ConcurrencyLimitError(OutOfResourcesError):
+    """Load shedding errors.
+
+    Raised instead of queueing for a connection when the adaptive
+    concurrency limit of the pool is reached, see circuit_breaker.py.
+    """
+
+
+class CircuitOpenError(DatabaseError):
+    """Circuit breaker errors.
+
+    Raised without contacting the database while the circuit breaker is
+    open after repeated connection, resource or operator intervention
+    errors, see circuit_breaker.py.
+    """
+
+
+class QueryTimeoutError(DatabaseError):
+    """Query timeout errors.
+
+    Raised when a statement ran into its statement_timeout or lock_timeout,
+    or was cancelled on the server because its deadline passed, see
+    timeouts.py.
+
+    Maps to PostgreSQL errors 57014 (query_canceled) and 55P03 (lock_not_available).
+    """
+
+
+class ProgramLimitExceededError(DatabaseError):
+    """Server limit errors.
+
+    Raised when a statement goes past a fixed limit of PostgreSQL rather
+    than running out of a resource.
+
+    Maps to PostgreSQL Class 54 errors (Program Limit Exceeded).
+    Examples: statement too complex, too many columns, too many arguments.
+    """
+
+
 class AdminInterventionError(DatabaseError):
     """Admin database intervation errors.
     
@@ -156,6 +233,36 @@ class SystemError(DatabaseError):
     """
 
 
+class AuthorizationError(DatabaseError):
+    """Authentication errors.
+
+    Raised when the server rejects the credentials or role of a connection.
+
+    Maps to PostgreSQL Class 28 errors (Invalid Authorization Specification).
+    Examples: wrong password, role not permitted to log in.
+    """
+
+
+class InvalidTransactionStateError(QueryError):
+    """Statements not allowed in the current transaction state.
+
+    Maps to PostgreSQL Classes 0B, 25, 2D and 3B (Invalid Transaction
+    Initiation, Invalid Transaction State, Invalid Transaction Termination,
+    Savepoint Exception).
+    Examples: a query in an aborted transaction, a write in a read-only
+    transaction, rolling back to an unknown savepoint.
+    """
+
+
+class ObjectStateError(QueryError):
+    """Objects not in the state an operation requires.
+
+    Maps to PostgreSQL Class 55 errors (Object Not In Prerequisite State),
+    except lock_not_available, which is a QueryTimeoutError.
+    Examples: object in use, cannot change a runtime parameter.
+    """
+
+
 class IntegrityConstraintViolation(DatabaseError):
     """Constraint violation errors like unique, foreign key, or check constraints."""
 
@@ -168,19 +275,71 @@ class FeatureNotSupportedError(DatabaseError):
     """Errors when attempting to use features not supported by the PostgreSQL server."""
 
 
-# PostgreSQL-specific error codes mapped to exception classes
+# PostgreSQL error classes (the first two characters of a SQLSTATE) mapped to exception classes.
+# Classes 00, 01 and 02 are success, warning and no data, never raised as errors.
 PG_ERROR_MAPPING = {
+    '03': QueryError,
     '08': ConnectionError,
+    '09': QueryError,
+    '0A': FeatureNotSupportedError,
+    '0B': InvalidTransactionStateError,
+    '0F': QueryError,
+    '0L': SQLSyntaxError,
+    '0P': SQLSyntaxError,
+    '0Z': QueryError,
+    '20': QueryError,
+    '21': QueryError,
     '22': InputDataError,
     '23': IntegrityConstraintViolation,
+    '24': QueryError,
+    '25': InvalidTransactionStateError,
+    '26': QueryError,
+    '27': QueryError,
+    '28': AuthorizationError,
+    '2B': SQLSyntaxError,
+    '2D': InvalidTransactionStateError,
+    '2F': QueryError,
+    '34': QueryError,
+    '38': QueryError,
+    '39': QueryError,
+    '3B': InvalidTransactionStateError,
+    '3D': SQLSyntaxError,
+    '3F': SQLSyntaxError,
     '40': TransactionError,
     '42': SQLSyntaxError,
+    '44': IntegrityConstraintViolation,
     '53': OutOfResourcesError,
+    '54': ProgramLimitExceededError,
+    '55': ObjectStateError,
     '57': AdminInterventionError,
     '58': SystemError,
-    '0A': FeatureNotSupportedError,
+    'F0': SystemError,
+    'HV': QueryError,
+    'P0': QueryError,
+    'XX': SystemError,
 }
 
+# Single SQLSTATEs with a more specific exception class than their error class
+PG_SQLSTATE_MAPPING = {
+    '57014': QueryTimeoutError,
+    '55P03': QueryTimeoutError,
+}
+
+# Every SQLSTATE seen so far, resolved to its exception class once
+_EXCEPTION_CLASSES: Dict[str, type] = {}
+
+
+def exception_class_for(sqlstate: str) -> type:
+    """The DatabaseError subclass for a SQLSTATE, DatabaseError itself for unknown ones."""
+    try:
+        return _EXCEPTION_CLASSES[sqlstate]
+    except KeyError:
+        exception_class = PG_SQLSTATE_MAPPING.get(sqlstate) or PG_ERROR_MAPPING.get(sqlstate[:2], DatabaseError)
+        if len(_EXCEPTION_CLASSES) < 1024:  # SQLSTATEs come from the server, don't let them grow this unbounded
+            _EXCEPTION_CLASSES[sqlstate] = exception_class
+        return exception_class
+
+
 # SQL error codes
 # Class 00: Successful Completion
 # Class 01: Warning
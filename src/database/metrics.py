@@ -0,0 +1,291 @@
+"""
+Connection pool instrumentation.
+
+ConnectionPool records how long callers wait for a connection, how long they
+hold it, how many connections it opens and closes, and which classes of
+PostgreSQL errors its users run into. ConnectionPool.stats() turns that into
+a PoolStats snapshot, and render_prometheus() formats a snapshot in the
+Prometheus text exposition format.
+
+Recording has to stay out of the way of checkouts: latency samples go into
+bounded deques (append is atomic, no lock needed) and the counters the pool
+updates are bumped while it already holds its own lock. Percentiles are only
+computed when a snapshot is taken.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Dict
+
+from .exceptions import PG_ERROR_MAPPING, DatabaseError
+
+SAMPLE_SIZE = 1024  # Recent samples kept per latency reservoir
+
+
+class LatencyReservoir:
+    """Keeps the most recent samples and their all-time count and sum."""
+
+    def __init__(self, size=SAMPLE_SIZE):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        # Not atomic, but a lost update under contention only skews the totals by one sample
+        self.count += 1
+        self.total += seconds
+
+    def percentiles(self, *quantiles):
+        samples = sorted(self._samples)
+        if not samples:
+            return {quantile: 0.0 for quantile in quantiles}
+        last = len(samples) - 1
+        return {quantile: samples[round(quantile * last)] for quantile in quantiles}
+
+
+@dataclass(frozen=True)
+class LatencySummary:
+    count: int
+    total: float
+    p50: float
+    p95: float
+    p99: float
+
+    @classmethod
+    def from_reservoir(cls, reservoir):
+        percentiles = reservoir.percentiles(0.5, 0.95, 0.99)
+        return cls(reservoir.count, reservoir.total, percentiles[0.5], percentiles[0.95], percentiles[0.99])
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    """Point in time view of a ConnectionPool."""
+
+    size: int
+    idle: int
+    in_use: int
+    waiting: int
+    min_connections: int
+    max_connections: int
+    checkouts: int
+    timeouts: int
+    connections_opened: int
+    connections_closed: int
+    wait_time: LatencySummary
+    hold_time: LatencySummary
+    oldest_connection_age: float
+    errors: Dict[str, int] = field(default_factory=dict)  # SQLSTATE class -> count
+    transaction_retries: int = 0
+    serialization_failures: int = 0  # Transactions aborted with a SQLSTATE class 40 error
+
+
+class PoolMetrics:
+    """Counters and latency samples recorded by a ConnectionPool."""
+
+    def __init__(self):
+        self.wait_times = LatencyReservoir()
+        self.hold_times = LatencyReservoir()
+        # These are only updated while the pool holds its lock
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        # Updated by transaction.py, without the pool's lock
+        self.transaction_retries = 0
+        self.serialization_failures = 0
+
+        self._errors = Counter()
+        self._errors_lock = threading.Lock()
+
+    def record_error(self, error):
+        """Count an error by its SQLSTATE class, e.g. "08" for connection exceptions."""
+        error_class = sqlstate_class(error)
+        with self._errors_lock:
+            self._errors[error_class] += 1
+
+    def errors(self):
+        with self._errors_lock:
+            return dict(self._errors)
+
+    def record_transaction_retry(self):
+        with self._errors_lock:
+            self.transaction_retries += 1
+
+    def record_serialization_failure(self):
+        with self._errors_lock:
+            self.serialization_failures += 1
+
+
+class _NullReservoir(LatencyReservoir):
+
+    def record(self, seconds):
+        pass
+
+
+class NullPoolMetrics(PoolMetrics):
+    """Drop in replacement that records no samples or errors, used to switch instrumentation off."""
+
+    def __init__(self):
+        super().__init__()
+        self.wait_times = _NullReservoir()
+        self.hold_times = _NullReservoir()
+
+    def record_error(self, error):
+        pass
+
+    def record_transaction_retry(self):
+        pass
+
+    def record_serialization_failure(self):
+        pass
+
+
+def sqlstate_class(error):
+    """The two character SQLSTATE class of a psycopg2 or DatabaseError exception."""
+    sqlstate = getattr(error, "sqlstate", None) if isinstance(error, DatabaseError) else getattr(error, "pgcode", None)
+    return sqlstate[:2] if sqlstate else "unknown"
+
+
+class ErrorRateLog:
+    """
+    Logs an error once per interval for every kind of error, counting the rest.
+
+    When the database is down, every checkout fails the same way; logging
+    (and formatting) each of those errors adds work exactly when there is
+    least to spare. The first error of a kind, its exception class and
+    SQLSTATE, is logged, identical ones during the next interval seconds are
+    only counted, and the first one logged after that reports how many there
+    were.
+    """
+
+    def __init__(self, logger, interval=10.0, clock=time.monotonic):
+        self.logger = logger
+        self.interval = interval
+        self._clock = clock
+        self._kinds = {}  # (exception class name, SQLSTATE) -> [logged at, suppressed since, total]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def kind(error):
+        sqlstate = getattr(error, "sqlstate", None) if isinstance(error, DatabaseError) else getattr(error, "pgcode", None)
+        return type(error).__name__, sqlstate
+
+    def report(self, error, message):
+        """Log message with error, unless the same kind of error was logged less than interval seconds ago."""
+        kind = self.kind(error)
+        now = self._clock()
+        with self._lock:
+            entry = self._kinds.get(kind)
+            if entry is None:
+                entry = self._kinds[kind] = [None, 0, 0]
+            entry[2] += 1
+            if entry[0] is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return
+            suppressed, since = entry[1], entry[0]
+            entry[0], entry[1] = now, 0
+        if suppressed:
+            self.logger.warning("%s %s (and %d more like it in the last %.0f seconds)",
+                                message, error, suppressed, now - since)
+        else:
+            self.logger.warning("%s %s", message, error)
+
+    def counts(self):
+        """Errors reported so far by kind, logged or not."""
+        with self._lock:
+            return {kind: entry[2] for kind, entry in self._kinds.items()}
+
+    def rates(self):
+        """Errors per second by kind since each kind was last logged."""
+        now = self._clock()
+        with self._lock:
+            return {kind: (entry[1] + 1) / max(now - entry[0], self.interval)
+                    for kind, entry in self._kinds.items()}
+
+
+def oldest_age(created_at):
+    """Age in seconds of the oldest entry in a mapping of creation times."""
+    if not created_at:
+        return 0.0
+    return time.monotonic() - min(created_at.values())
+
+
+def render_prometheus(stats, namespace="pg_pool", labels=None):
+    """Format a PoolStats snapshot in the Prometheus text exposition format."""
+    label_text = ",".join(f'{key}="{value}"' for key, value in (labels or {}).items())
+
+    def sample(name, value, extra_labels=""):
+        all_labels = ",".join(part for part in (label_text, extra_labels) if part)
+        return f"{namespace}_{name}{{{all_labels}}} {value}" if all_labels else f"{namespace}_{name} {value}"
+
+    lines = []
+    gauges = [
+        ("connections", stats.size, "Open connections, including ones being opened."),
+        ("connections_idle", stats.idle, "Connections waiting in the pool."),
+        ("connections_in_use", stats.in_use, "Connections checked out of the pool."),
+        ("waiting_callers", stats.waiting, "Callers waiting for a connection."),
+        ("max_connections", stats.max_connections, "Configured maximum pool size."),
+        ("oldest_connection_age_seconds", stats.oldest_connection_age, "Age of the oldest open connection."),
+    ]
+    for name, value, help_text in gauges:
+        lines += [f"# HELP {namespace}_{name} {help_text}", f"# TYPE {namespace}_{name} gauge", sample(name, value)]
+
+    counters = [
+        ("checkouts_total", stats.checkouts, "Connections handed out."),
+        ("checkout_timeouts_total", stats.timeouts, "Checkouts that gave up waiting."),
+        ("connections_opened_total", stats.connections_opened, "Connections opened."),
+        ("connections_closed_total", stats.connections_closed, "Connections closed."),
+        ("transaction_retries_total", stats.transaction_retries, "Transactions run again after a serialization failure."),
+        ("serialization_failures_total", stats.serialization_failures,
+         "Transactions aborted by a serialization failure or deadlock."),
+    ]
+    for name, value, help_text in counters:
+        lines += [f"# HELP {namespace}_{name} {help_text}", f"# TYPE {namespace}_{name} counter", sample(name, value)]
+
+    summaries = [
+        ("wait_seconds", stats.wait_time, "Time spent waiting for a connection."),
+        ("hold_seconds", stats.hold_time, "Time a connection was checked out."),
+    ]
+    for name, summary, help_text in summaries:
+        lines += [f"# HELP {namespace}_{name} {help_text}", f"# TYPE {namespace}_{name} summary"]
+        for quantile, value in (("0.5", summary.p50), ("0.95", summary.p95), ("0.99", summary.p99)):
+            lines.append(sample(name, value, f'quantile="{quantile}"'))
+        lines += [sample(f"{name}_sum", summary.total), sample(f"{name}_count", summary.count)]
+
+    lines += [f"# HELP {namespace}_errors_total Errors by SQLSTATE class.", f"# TYPE {namespace}_errors_total counter"]
+    for error_class, count in sorted(stats.errors.items()):
+        exception_class = PG_ERROR_MAPPING.get(error_class, DatabaseError)
+        lines.append(sample("errors_total", count, f'sqlstate_class="{error_class}",error="{exception_class.__name__}"'))
+
+    return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(connection_pool, port=9187, host="0.0.0.0", namespace="pg_pool"):
+    """
+    Expose the pool's stats on http://host:port/metrics from a daemon thread.
+
+    Returns the server, call server.shutdown() to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus(connection_pool.stats(), namespace).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="pool-metrics", daemon=True).start()
+    return server
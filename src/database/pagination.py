@@ -0,0 +1,119 @@
+"""
+Keyset (seek) pagination.
+
+LIMIT n OFFSET m makes the server produce and throw away m rows before the
+page starts, so every page is slower than the one before it. Keyset
+pagination remembers the sort key of the last row instead and asks for the
+rows after it:
+
+    WHERE (order_date, order_id) > (%s, %s) ORDER BY order_date, order_id LIMIT 50
+
+which an index on (order_date, order_id) answers by seeking straight to the
+page. The sort key has to be unique, so end it with the primary key, and its
+columns must not be NULL.
+
+Mixed sort orders can't be written as one row comparison, those expand to
+"a > x OR (a = x AND b < y)", led by a plain bound on the first column so the
+index can still be used for a range scan.
+
+The key of the last row travels between requests as an opaque cursor token,
+see encode_cursor() and decode_cursor().
+"""
+
+import base64
+import binascii
+import json
+import uuid
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, List, Sequence, Tuple
+
+_DIRECTIONS = {"ASC": ">", "DESC": "<"}
+
+# Types that JSON can't represent, tagged so the token decodes to the same values
+_TAGGED_TYPES = {
+    "datetime": (datetime, datetime.isoformat, datetime.fromisoformat),
+    "date": (date, date.isoformat, date.fromisoformat),
+    "time": (time, time.isoformat, time.fromisoformat),
+    "decimal": (Decimal, str, Decimal),
+    "uuid": (uuid.UUID, str, uuid.UUID),
+}
+
+
+class InvalidCursorError(ValueError):
+    """A cursor token that is malformed or belongs to a different sort order."""
+
+
+def parse_order_by(order_by: Sequence[str]) -> List[Tuple[str, str]]:
+    """Split "column [ASC|DESC]" items into (column, direction) pairs."""
+    if not order_by:
+        raise ValueError("Keyset pagination needs at least one column to order by")
+    keys = []
+    for item in order_by:
+        parts = item.split()
+        direction = parts[1].upper() if len(parts) == 2 else "ASC"
+        if len(parts) not in (1, 2) or direction not in _DIRECTIONS:
+            raise ValueError(f"Keyset pagination can only order by 'column [ASC|DESC]', got {item!r}")
+        keys.append((parts[0], direction))
+    return keys
+
+
+def keyset_condition(keys: Sequence[Tuple[str, str]], values: Sequence[Any]) -> Tuple[str, List[Any]]:
+    """The condition selecting the rows after values in the order of keys, and its parameters."""
+    if len(values) != len(keys):
+        raise ValueError(f"Expected {len(keys)} values for the last row, got {len(values)}")
+    columns = [column for column, _ in keys]
+    directions = {direction for _, direction in keys}
+
+    if len(directions) == 1:
+        operator = _DIRECTIONS[directions.pop()]
+        if len(keys) == 1:
+            return f"{columns[0]} {operator} %s", list(values)
+        placeholders = ", ".join(["%s"] * len(keys))
+        return f"({', '.join(columns)}) {operator} ({placeholders})", list(values)
+
+    alternatives = []
+    params = []
+    for index, (column, direction) in enumerate(keys):
+        equal = [f"{previous} = %s" for previous in columns[:index]]
+        alternatives.append(" AND ".join(equal + [f"{column} {_DIRECTIONS[direction]} %s"]))
+        params.extend(values[:index + 1])
+    first_column, first_direction = keys[0]
+    leading_bound = f"{first_column} {_DIRECTIONS[first_direction]}= %s"
+    condition = f"{leading_bound} AND ({' OR '.join(f'({alternative})' for alternative in alternatives)})"
+    return condition, [values[0]] + params
+
+
+def _to_json(value):
+    for tag, (value_type, encode, _) in _TAGGED_TYPES.items():
+        if isinstance(value, value_type):
+            return {"$" + tag: encode(value)}
+    raise TypeError(f"Can't put a {type(value).__name__} into a cursor token")
+
+
+def _from_json(item):
+    if len(item) == 1:
+        key, value = next(iter(item.items()))
+        if key.startswith("$") and key[1:] in _TAGGED_TYPES:
+            return _TAGGED_TYPES[key[1:]][2](value)
+    return item
+
+
+def encode_cursor(keys: Sequence[Tuple[str, str]], values: Sequence[Any]) -> str:
+    """Opaque, URL safe token for the sort key values of the last row of a page."""
+    payload = json.dumps({"k": [list(key) for key in keys], "v": list(values)},
+                         default=_to_json, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(keys: Sequence[Tuple[str, str]], token: str) -> List[Any]:
+    """The sort key values in a token made by encode_cursor for the same sort order."""
+    try:
+        payload = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(payload, object_hook=_from_json)
+        token_keys, values = data["k"], data["v"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError) as error:
+        raise InvalidCursorError("Malformed pagination cursor") from error
+    if [tuple(key) for key in token_keys] != list(keys):
+        raise InvalidCursorError("Pagination cursor belongs to a different sort order")
+    return values
@@ -0,0 +1,515 @@
+"""
+Thread-safe connection pool with bounded waiting.
+
+psycopg2's SimpleConnectionPool is not safe to share between threads and raises
+PoolError as soon as it runs dry. ConnectionPool keeps the same getconn/putconn/
+closeall interface, but callers that find the pool exhausted queue up and wait
+(up to a timeout) for a connection to be returned. Waiters are served strictly
+in arrival order, and idle connections are handed out most-recently-returned
+first so the "warm" ones get reused while the rest can go stale.
+
+Connections older than max_lifetime are closed when they are returned, so
+long-lived backends don't keep growing their caches. ConnectionPool.maintain()
+(normally run by PoolMaintenance every few seconds) also closes idle ones that
+expired or sat unused for max_idle_time while the pool is above
+min_connections, and opens new ones until min_connections are available again.
+
+resize() changes min_connections and max_connections of a pool in use, and
+recycle() has every existing connection replaced, e.g. with new connection
+parameters, without taking a connection away from the caller that holds it.
+
+A pool inherited by a forked child (gunicorn or multiprocessing workers) must
+not touch the parent's connections: they share the parent's sockets. The
+first time the child uses the pool it detaches every inherited connection,
+without closing it on the server, and starts over with fresh ones.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .exceptions import ConfigurationError, PoolTimeoutError
+from .metrics import NullPoolMetrics, PoolMetrics, PoolStats, LatencySummary, oldest_age
+
+logger = logging.getLogger(__name__)
+
+
+# id(connection) -> connection inherited from a parent process. They are kept
+# referenced for the life of the process so they are never closed in the child.
+_inherited_connections = {}
+
+
+def detach_inherited_connection(connection):
+    """
+    Make a connection inherited from the parent process harmless in the child.
+
+    Closing it would send a Terminate message over the socket the parent is
+    still using, so the connection is parked in _inherited_connections, and
+    where possible the child's copy of the socket descriptor is pointed at
+    /dev/null so nothing the child does with it can reach the server.
+    """
+    _inherited_connections[id(connection)] = connection
+    try:
+        file_descriptor = connection.fileno()
+    except Exception:
+        return
+    null_descriptor = os.open(os.devnull, os.O_RDWR)
+    try:
+        os.dup2(null_descriptor, file_descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(null_descriptor)
+
+
+class _Waiter:
+    """A caller blocked in getconn, waiting for a connection or a free slot."""
+
+    __slots__ = ("event", "connection")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.connection = None
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of connections that can be shared between threads.
+
+    Connections are created through connection_factory, a callable taking no
+    arguments, so the pool itself does not depend on how connections are made.
+
+    Example:
+        pool = ConnectionPool(1, 10, lambda: psycopg2.connect(**parameters), timeout=5.0)
+        connection = pool.getconn()
+        try:
+            ...
+        finally:
+            pool.putconn(connection)
+    """
+    def __init__(self, min_connections, max_connections, connection_factory, timeout=30.0,
+                 validation_policy=None, record_metrics=True, max_lifetime=None, max_idle_time=None,
+                 circuit_breaker=None, concurrency_limiter=None):
+        self._check_size(min_connections, max_connections)
+
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle_time = max_idle_time
+        self.validation_policy = validation_policy
+        self.circuit_breaker = circuit_breaker  # Both used by PooledDatabaseConnection, see circuit_breaker.py
+        self.concurrency_limiter = concurrency_limiter
+        self.metrics = PoolMetrics() if record_metrics else NullPoolMetrics()
+        self.closed = False
+
+        self._connection_factory = connection_factory
+        self._recycle_before = None  # Connections opened before this monotonic time are replaced
+        self._reset_state()
+
+        for _ in range(min_connections):
+            self._size += 1
+            self._idle.append(self._create_connection())
+
+    def getconn(self, timeout=None):
+        """
+        Take a connection out of the pool.
+
+        If none is idle and the pool is at max_connections, wait until another
+        thread returns one. Raises PoolTimeoutError if nothing became available
+        within timeout seconds (defaults to the pool's timeout).
+        """
+        if self._pid != os.getpid():
+            self.detach_after_fork()
+        if timeout is None:
+            timeout = self.timeout
+        started = time.perf_counter()
+
+        with self._lock:
+            self._check_open()
+            if self._idle and not self._waiters:
+                return self._check_out(self._idle.pop(), started)
+            if self._size < self.max_connections and not self._waiters:
+                self._size += 1
+                create_new = True
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+                create_new = False
+
+        if create_new:
+            return self._check_out_new(started)
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.event.is_set():
+                self._waiters.remove(waiter)
+                self.metrics.timeouts += 1
+                raise PoolTimeoutError(
+                    f"Timed out after {timeout}s waiting for a connection from the pool.",
+                    {"max_connections": self.max_connections, "waiting": len(self._waiters)})
+            if waiter.connection is not None:
+                return self._check_out(waiter.connection, started)
+            self._check_open()
+        # The slot of a discarded connection was handed to us, open a fresh one
+        return self._check_out_new(started)
+
+    def putconn(self, connection, close=False):
+        """
+        Return a connection to the pool.
+
+        With close=True (or if the connection is already closed) the connection
+        is discarded and its slot is freed for a new one.
+        """
+        if self._pid != os.getpid():
+            self.detach_after_fork()
+        if id(connection) in _inherited_connections:
+            return  # Checked out before the fork, it belongs to the parent
+        with self._lock:
+            if self._in_use.pop(id(connection), None) is None:
+                raise ConfigurationError("Trying to return a connection that is not checked out from this pool.")
+            self.metrics.hold_times.record(time.perf_counter() - self._checked_out_at.pop(id(connection)))
+
+            now = time.monotonic()
+            if (close or self.closed or connection.closed or self._is_expired(connection, now)
+                    or self._size > self.max_connections):
+                self._discard(connection)
+                return
+
+            self._last_used[id(connection)] = now
+            self._make_available(connection)
+
+    def detach_after_fork(self):
+        """
+        Forget every connection inherited from the parent process, without
+        closing them on the server, so the child opens its own.
+        """
+        inherited = self._idle + list(self._in_use.values())
+        for connection in inherited:
+            detach_inherited_connection(connection)
+        self._reset_state()
+        logger.info("Detached %d connections inherited from the parent process.", len(inherited))
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts.
+
+        Connections still checked out are closed when they are returned.
+        """
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self.metrics.connections_closed += len(idle)
+            for connection in idle:
+                self._forget(connection)
+            waiters, self._waiters = self._waiters, deque()
+        for connection in idle:
+            self._close_quietly(connection)
+        for waiter in waiters:
+            # Wake them up so they see the pool is closed instead of timing out
+            waiter.event.set()
+
+    def maintain(self):
+        """
+        Close expired and surplus idle connections, then open new ones until
+        the pool holds min_connections again.
+
+        Idle connections past max_lifetime are always closed. Connections idle
+        for longer than max_idle_time are closed, coldest first, only while the
+        pool is above min_connections. Returns the number of connections
+        closed and opened.
+        """
+        now = time.monotonic()
+        with self._lock:
+            surplus = self._size - self.min_connections
+            keep, expired = [], []
+            for connection in self._idle:  # Coldest first
+                if self._is_expired(connection, now):
+                    expired.append(connection)
+                    surplus -= 1
+                elif surplus > 0 and self._is_idle_too_long(connection, now):
+                    expired.append(connection)
+                    surplus -= 1
+                else:
+                    keep.append(connection)
+            self._idle = keep
+            self._size -= len(expired)
+            self.metrics.connections_closed += len(expired)
+            for connection in expired:
+                self._forget(connection)
+
+            missing = 0 if self.closed else max(self.min_connections - self._size, 0)
+            self._size += missing
+
+        for connection in expired:
+            self._close_quietly(connection)
+        opened = self._prewarm(missing)
+        if expired or opened:
+            logger.debug("Pool maintenance closed %d and opened %d connections.", len(expired), opened)
+        return len(expired), opened
+
+    def resize(self, min_connections, max_connections):
+        """
+        Change the pool's size while it is in use.
+
+        A larger max_connections hands the new slots to waiting callers right
+        away. Above a smaller one, idle connections are closed now and
+        checked out ones when they are returned, nothing is taken away from
+        its user. New connections up to min_connections are opened by the
+        next maintain().
+        """
+        self._check_size(min_connections, max_connections)
+        with self._lock:
+            self.min_connections = min_connections
+            self.max_connections = max_connections
+            surplus = self._idle[:max(0, self._size - max_connections)]  # Coldest first
+            del self._idle[:len(surplus)]
+            self._size -= len(surplus)
+            self.metrics.connections_closed += len(surplus)
+            for connection in surplus:
+                self._forget(connection)
+            while self._waiters and self._size < self.max_connections:
+                self._wake_waiter_with_slot()
+        for connection in surplus:
+            self._close_quietly(connection)
+
+    def recycle(self, connection_factory=None):
+        """
+        Replace every connection opened until now, e.g. after their connection
+        parameters changed: idle ones are closed by the next maintain(),
+        checked out ones when they are returned. New connections are made
+        with connection_factory, if given.
+        """
+        with self._lock:
+            if connection_factory is not None:
+                self._connection_factory = connection_factory
+            self._recycle_before = time.monotonic()
+
+    def idle_seconds(self, connection):
+        """How long the connection sat unused in the pool before it was checked out."""
+        return time.monotonic() - self._last_used.get(id(connection), time.monotonic())
+
+    def check_idle_connections(self, is_alive):
+        """
+        Run is_alive on every idle connection and discard the ones that fail.
+
+        The connections are checked out while they are being checked, so other
+        threads never receive a connection that is in the middle of a check.
+        Returns the number of discarded connections.
+        """
+        with self._lock:
+            candidates, self._idle = self._idle, []
+            for connection in candidates:
+                self._in_use[id(connection)] = connection
+
+        discarded = 0
+        for connection in candidates:  # Coldest first, so putting them back restores the original order
+            try:
+                alive = is_alive(connection)
+            except Exception:
+                alive = False
+            if not alive:
+                discarded += 1
+            self._return_checked(connection, alive)
+        return discarded
+
+    def stats(self):
+        """Take a PoolStats snapshot of the pool's current state and its metrics."""
+        with self._lock:
+            size, idle, in_use, waiting = self._size, len(self._idle), len(self._in_use), len(self._waiters)
+            checkouts, timeouts = self.metrics.checkouts, self.metrics.timeouts
+            opened, closed = self.metrics.connections_opened, self.metrics.connections_closed
+            oldest = oldest_age(self._created_at)
+        return PoolStats(
+            size=size,
+            idle=idle,
+            in_use=in_use,
+            waiting=waiting,
+            min_connections=self.min_connections,
+            max_connections=self.max_connections,
+            checkouts=checkouts,
+            timeouts=timeouts,
+            connections_opened=opened,
+            connections_closed=closed,
+            wait_time=LatencySummary.from_reservoir(self.metrics.wait_times),
+            hold_time=LatencySummary.from_reservoir(self.metrics.hold_times),
+            oldest_connection_age=oldest,
+            errors=self.metrics.errors(),
+            transaction_retries=self.metrics.transaction_retries,
+            serialization_failures=self.metrics.serialization_failures,
+        )
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    @property
+    def in_use_count(self):
+        return len(self._in_use)
+
+    @property
+    def waiting_count(self):
+        return len(self._waiters)
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = []          # Used as a stack, the end of the list holds the warmest connection
+        self._in_use = {}        # id(connection) -> connection
+        self._waiters = deque()  # FIFO queue of _Waiter
+        self._size = 0           # Open connections plus slots reserved for connections being created
+        self._last_used = {}     # id(connection) -> monotonic time it was created or last returned
+        self._created_at = {}    # id(connection) -> monotonic time it was opened
+        self._checked_out_at = {}  # id(connection) -> perf_counter time of checkout
+
+    def _prewarm(self, reserved):
+        """Open connections for slots already reserved in _size, returns how many were opened."""
+        for opened in range(reserved):
+            try:
+                connection = self._create_connection()
+            except Exception:
+                logger.warning("Could not open a connection while pre-warming the pool.", exc_info=True)
+                with self._lock:
+                    self._size -= reserved - opened
+                return opened
+            with self._lock:
+                if self.closed:
+                    self._discard(connection)
+                    self._size -= reserved - opened - 1
+                    return opened
+                self._make_available(connection)
+        return reserved
+
+    def _is_expired(self, connection, now):
+        created_at = self._created_at[id(connection)]
+        if self._recycle_before is not None and created_at <= self._recycle_before:
+            return True
+        return self.max_lifetime is not None and now - created_at > self.max_lifetime
+
+    def _is_idle_too_long(self, connection, now):
+        return self.max_idle_time is not None and now - self._last_used[id(connection)] > self.max_idle_time
+
+    def _return_checked(self, connection, alive):
+        """Put back a connection taken by check_idle_connections without touching its idle time."""
+        with self._lock:
+            self._in_use.pop(id(connection), None)
+            if not alive or self.closed:
+                self._discard(connection)
+            else:
+                self._make_available(connection)
+
+    def _make_available(self, connection):
+        """Hand a connection to the longest waiting caller, or park it as idle. Caller holds the lock."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.connection = connection
+            waiter.event.set()
+        else:
+            self._idle.append(connection)
+
+    def _discard(self, connection):
+        """Close a connection and free its slot. Caller holds the lock."""
+        self._size -= 1
+        self.metrics.connections_closed += 1
+        self._forget(connection)
+        self._close_quietly(connection)
+        self._wake_waiter_with_slot()
+
+    def _forget(self, connection):
+        self._last_used.pop(id(connection), None)
+        self._created_at.pop(id(connection), None)
+
+    def _check_out(self, connection, started):
+        """Mark a connection as in use. Caller holds the lock."""
+        now = time.perf_counter()
+        self._in_use[id(connection)] = connection
+        self._checked_out_at[id(connection)] = now
+        self.metrics.checkouts += 1
+        self.metrics.wait_times.record(now - started)
+        return connection
+
+    def _check_out_new(self, started):
+        """Open a connection for a slot that was already reserved in _size."""
+        try:
+            connection = self._create_connection()
+        except BaseException:
+            with self._lock:
+                self._size -= 1
+                self._wake_waiter_with_slot()
+            raise
+        with self._lock:
+            if self.closed:
+                self._discard(connection)
+                self._check_open()
+            return self._check_out(connection, started)
+
+    def _create_connection(self):
+        connection = self._connection_factory()
+        self._last_used[id(connection)] = self._created_at[id(connection)] = time.monotonic()
+        self.metrics.connections_opened += 1
+        logger.debug("Opened a new pooled connection.")
+        return connection
+
+    def _wake_waiter_with_slot(self):
+        """Hand a freed slot to the longest waiting caller, if any. Caller holds the lock."""
+        if self._waiters and self._size < self.max_connections:
+            self._size += 1
+            self._waiters.popleft().event.set()
+
+    @staticmethod
+    def _check_size(min_connections, max_connections):
+        if min_connections < 0 or max_connections < 1 or min_connections > max_connections:
+            raise ConfigurationError(
+                f"Invalid pool size: min_connections={min_connections}, max_connections={max_connections}")
+
+    def _check_open(self):
+        if self.closed:
+            raise ConfigurationError("Connection pool is closed.")
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.debug("Ignoring error while closing a pooled connection.", exc_info=True)
+
+
+class PoolMaintenance:
+    """
+    Runs ConnectionPool.maintain() every interval seconds on a daemon thread.
+
+    Example:
+        maintenance = PoolMaintenance(interval=30.0)
+        maintenance.start(pool)
+        ...
+        maintenance.stop()
+    """
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, connection_pool):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(connection_pool,),
+                                        name="pool-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, connection_pool):
+        while not self._stopped.wait(self.interval):
+            try:
+                connection_pool.maintain()
+            except Exception:
+                logger.exception("Connection pool maintenance failed.")
@@ -0,0 +1,280 @@
+"""
+Query profiling and the slow-query log.
+
+While a QueryProfiler is enabled, every QueryBuilder query it sees is
+measured: wall time from execute() until its result is closed, time until
+the first result was available, rows fetched and an estimate of their size
+in bytes. The last max_records measurements are kept in memory.
+
+Queries slower than threshold seconds are written to the slow-query log, a
+file of JSON lines (and the "src.database.slow_queries" logger). A sample
+of them, explain_sample_rate, gets its plan captured with
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON). EXPLAIN ANALYZE runs the query
+again, so that happens on a background thread with a connection of its own
+from the pool, only for SELECTs, and never for queries run on a bare
+connection.
+
+load_query_log() turns a slow-query log into a Polars DataFrame, see
+notebooks/query_performance.ipynb.
+
+Example:
+    profiler = enable_profiling(threshold=0.5, explain_sample_rate=0.2, log_path="slow_queries.jsonl")
+    ...
+    print(profiler.to_frame().sort("duration_ms", descending=True).head(10))
+    disable_profiling()
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import psycopg2
+
+from .exceptions import DatabaseError
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("src.database.slow_queries")
+
+DEFAULT_THRESHOLD = 1.0  # Seconds
+DEFAULT_EXPLAIN_SAMPLE_RATE = 0.1
+DEFAULT_MAX_RECORDS = 10_000
+_EXPLAIN_QUEUE_SIZE = 100
+
+_active = None
+
+
+@dataclass(frozen=True)
+class QueryRecord:
+    """One profiled query."""
+
+    timestamp: str  # When the query was started, ISO 8601 in UTC
+    query: str
+    params: Any
+    duration_ms: float  # From execute() until the result was closed
+    first_result_ms: float  # Until execute() returned
+    rows: int
+    bytes: int  # Estimated size of the fetched rows in memory
+    error: Optional[str] = None  # SQLSTATE, or exception class name without one
+    plan: Any = None  # EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output
+
+    def to_json(self):
+        return json.dumps(asdict(self), default=str)
+
+
+class Measurement:
+    """A query being profiled, filled in by QueryBuilder and QueryResult."""
+
+    __slots__ = ("profiler", "source", "query", "params", "timestamp", "started", "first_result", "rows", "bytes")
+
+    def __init__(self, profiler, source, query, params):
+        self.profiler = profiler
+        self.source = source
+        self.query = query
+        self.params = params
+        self.timestamp = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.first_result = None
+        self.rows = 0
+        self.bytes = 0
+
+    def executed(self):
+        self.first_result = time.perf_counter()
+
+    def fetched(self, row):
+        self.rows += 1
+        self.bytes += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+    def finish(self, error=None):
+        self.profiler.record(self, error)
+
+
+def _error_code(error):
+    if error is None:
+        return None
+    if isinstance(error, DatabaseError):
+        return error.sqlstate or type(error).__name__
+    sqlstate = getattr(getattr(error, "diag", None), "sqlstate", None) or getattr(error, "pgcode", None)
+    return sqlstate or type(error).__name__
+
+
+def _loggable_params(params):
+    if isinstance(params, dict):
+        return DatabaseError.remove_password_and_tokens_from_params(params)
+    return params
+
+
+class QueryProfiler:
+    """Measures queries, logs the slow ones and samples their plans."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, explain_sample_rate=DEFAULT_EXPLAIN_SAMPLE_RATE,
+                 log_path=None, max_records=DEFAULT_MAX_RECORDS, sample=random.random):
+        self.threshold = threshold
+        self.explain_sample_rate = explain_sample_rate
+        self.log_path = log_path
+        self.records = deque(maxlen=max_records)
+        self.explains_dropped = 0
+        self._sample = sample
+        self._log_lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=_EXPLAIN_QUEUE_SIZE)
+        self._explainer = None
+
+    def start(self, source, query, params):
+        return Measurement(self, source, query, params)
+
+    def record(self, measurement, error=None):
+        finished = time.perf_counter()
+        first_result = measurement.first_result or finished
+        record = QueryRecord(
+            timestamp=measurement.timestamp.isoformat(),
+            query=measurement.query,
+            params=_loggable_params(measurement.params),
+            duration_ms=round((finished - measurement.started) * 1000, 3),
+            first_result_ms=round((first_result - measurement.started) * 1000, 3),
+            rows=measurement.rows,
+            bytes=measurement.bytes,
+            error=_error_code(error))
+        self.records.append(record)
+        if record.duration_ms < self.threshold * 1000:
+            return
+        if self._should_explain(measurement) and self._queue_explain(measurement, record):
+            return  # Logged once the plan is in
+        self._log_slow(record)
+
+    def to_frame(self):
+        """The records in memory as a Polars DataFrame."""
+        return records_frame(list(self.records))
+
+    def wait_for_explains(self, timeout=None):
+        """Block until every queued EXPLAIN has been run, mostly for tests and scripts."""
+        ends = None if timeout is None else time.monotonic() + timeout
+        while self._explain_queue.unfinished_tasks:
+            if ends is not None and time.monotonic() > ends:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _should_explain(self, measurement):
+        return (hasattr(measurement.source, "getconn")
+                and measurement.query.lstrip()[:6].upper() == "SELECT"
+                and self._sample() < self.explain_sample_rate)
+
+    def _queue_explain(self, measurement, record):
+        if self._explainer is None or not self._explainer.is_alive():
+            self._explainer = threading.Thread(target=self._explain_forever, name="query-explainer", daemon=True)
+            self._explainer.start()
+        try:
+            self._explain_queue.put_nowait((measurement.source, measurement.params, record))
+        except queue.Full:
+            self.explains_dropped += 1
+            return False
+        return True
+
+    def _explain_forever(self):
+        while True:
+            source, params, record = self._explain_queue.get()
+            try:
+                plan = explain_analyze(source, record.query, params)
+                self._log_slow(replace(record, plan=plan))
+            except Exception:
+                logger.warning("Capturing the plan of a slow query failed.", exc_info=True)
+                self._log_slow(record)
+            finally:
+                self._explain_queue.task_done()
+
+    def _log_slow(self, record):
+        line = record.to_json()
+        slow_query_logger.warning(line)
+        if self.log_path is not None:
+            with self._log_lock, open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(line + "\n")
+
+
+def explain_analyze(source, sql, params=None):
+    """
+    The EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan of a query, run on a
+    connection checked out of source. The query really runs, in a transaction
+    that is rolled back.
+    """
+    from .connection import checkout_connection
+
+    connection, release = checkout_connection(source)
+    error = None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        connection.rollback()
+    except psycopg2.Error as postgres_error:
+        error = postgres_error
+        raise
+    finally:
+        if release is not None:
+            release(error)
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def enable_profiling(profiler=None, **options):
+    """Profile every QueryBuilder query from now on, with profiler or a QueryProfiler(**options)."""
+    global _active
+    _active = profiler if profiler is not None else QueryProfiler(**options)
+    return _active
+
+
+def disable_profiling():
+    global _active
+    _active = None
+
+
+def active_profiler():
+    """The enabled QueryProfiler, or None."""
+    return _active
+
+
+def _plan_summary(plan):
+    """Headline numbers of an EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan."""
+    if not plan:
+        return {"execution_ms": None, "planning_ms": None, "shared_hit_blocks": None, "shared_read_blocks": None}
+    top = plan[0]
+    return {
+        "execution_ms": top.get("Execution Time"),
+        "planning_ms": top.get("Planning Time"),
+        "shared_hit_blocks": top["Plan"].get("Shared Hit Blocks"),
+        "shared_read_blocks": top["Plan"].get("Shared Read Blocks"),
+    }
+
+
+def records_frame(records):
+    """
+    A Polars DataFrame of QueryRecords, or of the dicts in a slow-query log,
+    with the headline numbers of their plans as columns and the plan itself
+    as a JSON string.
+    """
+    import polars as pl
+
+    rows = []
+    for record in records:
+        row = asdict(record) if isinstance(record, QueryRecord) else dict(record)
+        row.update(_plan_summary(row.get("plan")))
+        row["plan"] = json.dumps(row["plan"]) if row.get("plan") is not None else None
+        row["params"] = json.dumps(row.get("params"), default=str)
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+        rows.append(row)
+    schema = {"timestamp": pl.Datetime("us", "UTC"), "query": pl.String, "params": pl.String,
+              "duration_ms": pl.Float64, "first_result_ms": pl.Float64, "rows": pl.Int64, "bytes": pl.Int64,
+              "error": pl.String, "plan": pl.String, "execution_ms": pl.Float64, "planning_ms": pl.Float64,
+              "shared_hit_blocks": pl.Int64, "shared_read_blocks": pl.Int64}
+    return pl.DataFrame(rows, schema=schema)
+
+
+def load_query_log(path):
+    """The slow-query log at path as a Polars DataFrame, see records_frame()."""
+    with open(path, encoding="utf-8") as log_file:
+        return records_frame(json.loads(line) for line in log_file if line.strip())
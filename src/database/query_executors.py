@@ -1,7 +1,297 @@
-from typing import List, Optional
+import functools
+import itertools
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import psycopg2
+
+from . import columnar, pagination, profiling, result_cache, routing, statement_cache, timeouts
+from .connection import checkout_connection
+from .exceptions import DatabaseError, QueryTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# psycopg2 placeholders: %%, %s or %(name)s
+_PLACEHOLDER = re.compile(r"%%|%s|%\((\w+)\)s")
+
+Params = Union[List[Any], Dict[str, Any]]
+
+TEMPLATE_CACHE_SIZE = 256
+DEFAULT_ITERSIZE = 2000  # Rows fetched per round trip while iterating a server-side cursor
+
+_cursor_names = itertools.count(1)
+
+
+def count_placeholders(condition: str) -> Tuple[int, List[str]]:
+    """Count the positional (%s) and collect the named (%(name)s) placeholders in a SQL fragment."""
+    positional = 0
+    names = []
+    for match in _PLACEHOLDER.finditer(condition):
+        if match.group(1) is not None:
+            names.append(match.group(1))
+        elif match.group(0) == "%s":
+            positional += 1
+    return positional, names
+
+
+@dataclass(frozen=True)
+class CompiledQuery:
+    """
+    Immutable SQL template of one QueryBuilder shape.
+
+    The SQL text is built once, binding values only checks them against the
+    template's parameter slots:
+
+        template = QueryBuilder().select("*").from_table("users").where("id = %s", 0).compile()
+        cursor.execute(*template.bind([42]))
+    """
+
+    sql: str
+    param_count: int = 0
+    param_names: Tuple[str, ...] = ()
+
+    def bind(self, params: Optional[Params] = None) -> Tuple[str, Optional[Params]]:
+        """The SQL and params for one execution, like QueryBuilder.get_sql()."""
+        if self.param_names:
+            if not isinstance(params, dict):
+                raise ValueError("Named parameters must be given as a dict")
+            missing = [name for name in self.param_names if name not in params]
+            if missing:
+                raise ValueError(f"Missing named parameters: {', '.join(missing)}")
+            return self.sql, params
+        if isinstance(params, dict):
+            raise ValueError("Named parameters given for positional placeholders")
+        count = len(params) if params else 0
+        if count != self.param_count:
+            raise ValueError(f"Expected {self.param_count} parameters, got {count}")
+        return self.sql, (list(params) if params else None)
+
+
+def build_sql(table, columns, distinct, count, joins, where, and_where, or_where, keyset,
+              group_by, having, order_by, limit, offset, insert):
+    """Render the SQL text of a query shape, see QueryBuilder._shape()."""
+    if not table:
+        raise ValueError("Table must be specified")
+
+    if insert:
+        insert_columns, rows = insert
+        values_string = ",\n".join("(" + ", ".join(row) + ")" for row in rows)
+        return f"INSERT INTO {table} ({', '.join(insert_columns)})\nVALUES {values_string}"
+
+    sql_string = []
+    if columns:
+        columns_str = ",".join(columns)
+        if distinct:
+            sql_string.append(f"SELECT DISTINCT {columns_str}")
+        else:
+            sql_string.append(f"SELECT {columns_str}")
+    elif count:
+        sql_string.append(f"SELECT COUNT({count})")
+    else:
+        sql_string.append("SELECT *")
+
+    sql_string.append(f"FROM {table}")
+    sql_string.extend(joins)
+
+    if where or and_where or or_where or keyset:
+        sql_string.append(where_clause(where, and_where, or_where, keyset))
+
+    if group_by:
+        sql_string.append(f"GROUP BY {', '.join(group_by)}")
+        if having:
+            sql_string.append(f"HAVING {' AND '.join(having)}")
+
+    if order_by:
+        sql_string.append(f"ORDER BY {', '.join(order_by)}")
+
+    if limit:
+        sql_string.append(f"LIMIT {limit}")
+        if offset:
+            sql_string.append(f"OFFSET {offset}")
+
+    return "\n".join(sql_string)
+
+
+def where_clause(where, and_where, or_where, keyset=None):
+    # and_where()/or_where() without a where() still filter: their params are always passed
+    where_string = " AND ".join([*(where or ()), *and_where])
+    if or_where:
+        where_string = " OR ".join([where_string, *or_where] if where_string else or_where)
+    if keyset:
+        where_string = f"({where_string}) AND {keyset}" if where_string else keyset
+    return f"WHERE {where_string}"
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_shape(shape) -> CompiledQuery:
+    """
+    The template of a query shape, shared by every builder of that shape.
+
+    An LRU of the TEMPLATE_CACHE_SIZE most recently used shapes, see
+    compile_shape.cache_info() for its hit rate.
+    """
+    sql = build_sql(*shape)
+    positional, names = count_placeholders(sql)
+    return CompiledQuery(sql, positional, tuple(dict.fromkeys(names)))
+
+
+class QueryResult:
+    """
+    Rows of an executed query, streamed from a named server-side cursor.
+
+    Iterating fetches itersize rows per round trip, so only that many rows are
+    in memory at once no matter how big the result is. The cursor is closed,
+    and a connection taken from a pool is returned to it, once the rows are
+    exhausted or close() is called:
+
+        with builder.execute(pool) as result:
+            for batch in result.fetch_batches(10_000):
+                process(batch)
+    """
+
+    def __init__(self, cursor, query, release=None, watch=None, measurement=None):
+        self.cursor = cursor
+        self.query = query
+        self._release = release
+        self._watch = watch
+        self._measurement = measurement
+        self._rows = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(exc_val)
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self
+
+    def __next__(self) -> tuple:
+        if self._closed:
+            raise StopIteration
+        try:
+            if self._rows is None:
+                self._rows = iter(self.cursor)
+            row = next(self._rows)
+        except StopIteration:
+            self.close()
+            raise
+        except psycopg2.Error as postgres_error:
+            raise self._failed(postgres_error) from postgres_error
+        if self._measurement is not None:
+            self._measurement.fetched(row)
+        return row
+
+    @property
+    def rowcount(self) -> int:
+        """Rows affected by an INSERT, or fetched so far from a server-side cursor."""
+        return self.cursor.rowcount
+
+    def fetch_one(self) -> Optional[tuple]:
+        """The next row, or None if there are no more. Closes the result."""
+        try:
+            return next(self, None)
+        finally:
+            self.close()
+
+    def fetch_all(self) -> List[tuple]:
+        """All remaining rows as a list. Loads the whole result into memory."""
+        return list(self)
+
+    def fetch_batches(self, size: int) -> Iterator[List[tuple]]:
+        """Lists of up to size rows at a time, one round trip each."""
+        if size < 1:
+            raise ValueError("Batch size must be positive")
+        while not self._closed:
+            try:
+                rows = self.cursor.fetchmany(size)
+            except psycopg2.Error as postgres_error:
+                raise self._failed(postgres_error) from postgres_error
+            if not rows:
+                self.close()
+                return
+            if self._measurement is not None:
+                for row in rows:
+                    self._measurement.fetched(row)
+            yield rows
+
+    def close(self, error=None):
+        """Close the cursor and give back the connection. Safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._watch is not None:
+            self._watch.stop()
+            if self._watch.fired and error is None:
+                # The cancel may have hit the transaction after the last row, roll it back
+                error = QueryTimeoutError("Query passed its deadline.", {"query": self.query})
+        try:
+            if not self.cursor.closed:
+                self.cursor.close()
+        except psycopg2.Error:
+            logger.warning("Closing cursor of %r failed.", self.query, exc_info=True)
+        finally:
+            if self._release is not None:
+                self._release(error)
+            if self._measurement is not None:
+                self._measurement.finish(error)
+
+    def _failed(self, postgres_error):
+        self.close(postgres_error)
+        return DatabaseError.from_postgres_exception(postgres_error, query=self.query)
+
+
+class CachedQueryResult(QueryResult):
+    """Rows served from a ResultCache, with the same interface as a QueryResult."""
+
+    def __init__(self, rows, query):
+        super().__init__(None, query)
+        self._rows = iter(rows)
+        self._count = len(rows)
+
+    @property
+    def rowcount(self) -> int:
+        return self._count
+
+    def fetch_batches(self, size: int) -> Iterator[List[tuple]]:
+        if size < 1:
+            raise ValueError("Batch size must be positive")
+        while True:
+            rows = list(itertools.islice(self, size))
+            if not rows:
+                return
+            yield rows
+
+    def close(self, error=None):
+        self._closed = True
 
 
 class QueryBuilder:
+    """
+    Fluent builder for SQL statements.
+
+    Condition methods (where, and_where, or_where, having) take SQL fragments
+    with psycopg2 placeholders, each followed by the values for its
+    placeholders, so values never end up in the SQL text itself:
+
+        builder.where("active = %s", True, "city = %s", "Berlin")
+        builder.where("age > %s AND city = %s", [18, "Berlin"])
+        builder.where("city = %(city)s", {"city": "Berlin"})
+
+    A list or tuple right after a condition is taken as the whole parameter
+    sequence for it (like psycopg2's execute), so to bind a list as one value
+    wrap it: where("id = ANY(%s)", [[1, 2, 3]]). Positional and named
+    placeholders can't be mixed in one query.
+
+    get_sql() returns the SQL with its parameters in placeholder order, so
+    every query of the same shape produces the exact same SQL text. That text
+    is only rendered once per shape: compile() returns the template shared by
+    all builders of the same shape, and a compiled template only has to bind
+    the values of each execution.
+    """
 
     def __init__(self):
         self._table = None
@@ -22,71 +312,28 @@ class QueryBuilder:
 
         self._distinct = False
 
-    def __str__(self):
-        if not self._table:
-            raise ValueError("Table must be specified")
-        
-
-        
-        sql_string = []
-        if self._insert:
-            template = self._insert[0]
-            intermediary_string = ", ".join(template)
-            appending_string = "(" + intermediary_string + ")"
-            sql_string.append(f"INSERT INTO {self._table} {appending_string}")
-            sql_string.append(f"VALUES")
-            
-
-        if self._columns:
-            if self._distinct:
-                columns_str = ",".join(self._columns)
-                sql_string.append(f"SELECT DISTINCT {columns_str}")
-            else:
-                columns_str = ",".join(self._columns)
-                sql_string.append(f"SELECT {columns_str}")
-        elif self._count:
-            columns_str = f"COUNT({self._count})"
-            sql_string.append(f"SELECT {columns_str}")
-        else:
-            columns_str = "*"
-            sql_string.append(f"SELECT {columns_str}")
-
-        sql_string.append(f"FROM {self._table}")
+        self._param_style = None  # "positional" or "named", once the first parameter was added
+        self._where_params = []
+        self._and_where_params = []
+        self._or_where_params = []
+        self._having_params = []
+        self._keyset = None  # Condition selecting the rows after the previous page
+        self._keyset_keys = None
+        self._keyset_params = []
+        self._insert_params = []
+        self._named_params = {}
+
+        self._result_cache = None
+        self._cache_ttl = None
+        self._timeout = None
+        self._lock_timeout = None
+        self._prepared = False
 
-        if self._where:
-            sql_string.append(self.where_statement())
-
-        for join in self._joins:
-            sql_string.append(join)
-
-        if self._group_by:
-            group_by_string = ", ".join(self._group_by)
-            sql_string.append(f"GROUP BY {group_by_string}")
-
-            if self._having:
-                having_string = " AND ".join(self._having)
-                sql_string.append(f"HAVING {having_string}")
-        
-        if self._order_by:
-            order_by_string = ", ".join(self._order_by)
-            sql_string.append(f"ORDER BY {order_by_string}")
-
-        if self._limit:
-            sql_string.append(f"LIMIT {self._limit}")
-            if self._offset:
-                sql_string.append(f"OFFSET {self._offset}")
+    def __str__(self):
+        return self.get_sql()[0]
 
-        return "\n".join(sql_string)
-    
     def where_statement(self):
-        where_string = " AND ".join(self._where)
-        if self._and_where:
-            and_where_string = " AND ".join(self._and_where)
-            where_string += " AND " + and_where_string
-        if self._or_where:
-            or_where_string = " OR ".join(self._or_where)
-            where_string += " OR " + or_where_string
-        return f"WHERE {where_string}"
+        return where_clause(self._where, self._and_where, self._or_where)
 
     # # ______________________________Core Query Operations________________________________
     def count(self, column=None):
@@ -109,9 +356,40 @@ class QueryBuilder:
     def first(self):
         return self
 
-    def insert(self, table, *items):
+    def insert(self, table, *rows):
+        """
+        INSERT one or more rows, given as dicts of column -> value.
+
+        The values are sent as parameters. Rows can be passed one by one or as
+        a single list. Alternatively pass one dict of column -> SQL expression
+        followed by the parameter sequence for its placeholders:
+
+            insert("users", {"name": "John", "email": "john@example.com"})
+            insert("users", [{"name": "John"}, {"name": "Jane"}])
+            insert("users", {"name": "%s", "created_at": "NOW()"}, ["John"])
+        """
         self._table = table
-        self._insert = items
+        if len(rows) == 1 and isinstance(rows[0], (list, tuple)):
+            rows = tuple(rows[0])
+        if not rows:
+            raise ValueError("INSERT requires at least one row")
+
+        columns = list(rows[0])
+        if len(rows) == 2 and isinstance(rows[1], (list, tuple)):
+            template, params = rows
+            self._add_params(self._insert_params, list(template.values()), params)
+            self._insert = (columns, [list(template.values())])
+            return self
+
+        self._insert_params = []
+        placeholders = []
+        for row in rows:
+            if list(row) != columns:
+                raise ValueError("All inserted rows must have the same columns in the same order")
+            placeholders.append(["%s"] * len(columns))
+            self._use_param_style("positional")
+            self._insert_params.extend(row.values())
+        self._insert = (columns, placeholders)
         return self
 
     def select(self, *columns):
@@ -155,7 +433,7 @@ class QueryBuilder:
         return self
 
     def having(self, *having):
-        self._having = having
+        self._having, self._having_params = self._split_conditions(having)
         return self   
 
     def limit(self, limit):
@@ -170,6 +448,55 @@ class QueryBuilder:
         self._order_by = order_by
         return self
 
+    def paginate_after(self, order_by: Sequence[str], after=None, page_size: int = 50):
+        """
+        Keyset pagination: the page_size rows following after, in order_by order.
+
+        order_by items are "column", "column ASC" or "column DESC", and together
+        they must identify a row uniquely, so end them with the primary key.
+        after is the cursor token of the previous page (see next_cursor), the
+        sort key values of its last row, or None for the first page:
+
+            builder.paginate_after(["order_date DESC", "order_id DESC"], token, 50)
+        """
+        if not isinstance(page_size, int) or page_size < 1:
+            raise ValueError("Page size must be a positive integer")
+        keys = pagination.parse_order_by(order_by)
+        self._keyset_keys = keys
+        self._order_by = tuple(f"{column} {direction}" for column, direction in keys)
+        self._limit = page_size
+        self._offset = None
+
+        self._keyset, self._keyset_params = None, []
+        if after is not None:
+            values = pagination.decode_cursor(keys, after) if isinstance(after, str) else list(after)
+            self._use_param_style("positional")
+            self._keyset, self._keyset_params = pagination.keyset_condition(keys, values)
+        return self
+
+    def next_cursor(self, rows) -> Optional[str]:
+        """
+        The cursor token for the page after rows, or None if rows was the last page.
+
+        Rows can be mappings (e.g. from a RealDictCursor), looked up by column
+        name, or tuples, looked up by the position of the sort columns in the
+        select list.
+        """
+        if self._keyset_keys is None:
+            raise ValueError("next_cursor() needs paginate_after() first")
+        if len(rows) < self._limit:
+            return None
+        last_row = rows[-1]
+        values = []
+        for column, _ in self._keyset_keys:
+            if isinstance(last_row, dict):
+                values.append(last_row[column.rsplit(".", 1)[-1]])
+            elif self._columns and column in self._columns:
+                values.append(last_row[self._columns.index(column)])
+            else:
+                raise ValueError(f"Sort column {column} has to be in the select list to read it from tuple rows")
+        return pagination.encode_cursor(self._keyset_keys, values)
+
 # ______________________________Set operation________________________________
     def _except(self):
         return self
@@ -191,29 +518,258 @@ class QueryBuilder:
         return self
 
 # ______________________________Utility/Execution________________________________
-    def execute(self):
+    def cached(self, ttl: Optional[float] = None, cache=None):
+        """
+        Serve the results of execute() from a ResultCache, see result_cache.py.
+
+        Cached results are held in memory as a whole, so only use this for
+        small results. ttl defaults to the cache's default_ttl.
+        """
+        self._result_cache = cache if cache is not None else result_cache.default_cache
+        self._cache_ttl = ttl
         return self
 
-    def get_params(self):
+    def referenced_tables(self):
+        """The tables the query reads or writes."""
+        return result_cache.referenced_tables(self._table, self._joins)
+
+    def prepared(self, enabled: bool = True):
+        """
+        Run execute() through the connection's prepared statement cache, see
+        statement_cache.py: the first run PREPAREs the query on the server,
+        repeat runs on the same connection only send EXECUTE name(...).
+
+        The statement can't be DECLAREd as a server-side cursor, so the rows
+        are fetched all at once. Only use this for hot queries with small
+        results.
+        """
+        self._prepared = enabled
         return self
 
-    def get_sql(self):
+    def timeout(self, seconds: Optional[float] = None, lock_timeout: Optional[float] = None):
+        """
+        Bound how long execute() may take, see timeouts.py.
+
+        The query gets a statement_timeout of seconds, and is cancelled on the
+        server if its result isn't complete seconds after execute() was
+        called. lock_timeout bounds the time spent waiting for each lock.
+        Either way it fails with QueryTimeoutError.
+        """
+        self._timeout = seconds
+        self._lock_timeout = lock_timeout
         return self
 
+    def execute(self, source, itersize: int = DEFAULT_ITERSIZE, deadline=None) -> QueryResult:
+        """
+        Run the query on a connection, or on a connection checked out of a pool.
+
+        SELECTs run on a named server-side cursor fetching itersize rows per
+        round trip, see QueryResult, unless the builder is cached() or
+        prepared(). When the
+        query runs on a pool connection, its transaction is committed (or
+        rolled back after an error) before the connection goes back to the
+        pool. INSERTs are finished, and the cached results reading their
+        table invalidated, before execute() returns, and again when the
+        transaction of a connection passed in ends, see result_cache.py.
+
+        Given a ReplicaRouter, SELECTs run on a replica and INSERTs on the
+        primary, see routing.py.
+
+        deadline (seconds, or a timeouts.Deadline shared by several calls)
+        works like timeout(), whichever passes first applies.
+        """
+        sql, params = self.get_sql()
+        if not self._insert:
+            source = routing.read_source(source)
+        deadline = timeouts.Deadline.earliest(timeouts.Deadline.of(deadline), timeouts.Deadline.of(self._timeout))
+        if self._result_cache is not None and not self._insert:
+            key = (sql, result_cache.freeze_params(params))
+            rows = self._result_cache.get_or_load(
+                key, lambda: self._run(source, sql, params, itersize, deadline).fetch_all(),
+                self._cache_ttl, self.referenced_tables())
+            return CachedQueryResult(rows, sql)
+
+        result = self._run(source, sql, params, itersize, deadline)
+        if self._insert:
+            result.close()
+            # Checked out of a pool the INSERT is committed by now, on a connection it's up to the caller
+            result_cache.tables_written(self._table, connection=None if hasattr(source, "getconn") else source)
+        return result
+
+    def _run(self, source, sql, params, itersize, deadline=None):
+        connection, release = checkout_connection(source)
+        watch = None
+        profiler = profiling.active_profiler()
+        measurement = profiler.start(source, sql, params) if profiler is not None else None
+        try:
+            if deadline is not None and deadline.expired:
+                raise QueryTimeoutError("Query passed its deadline before it started.", {"query": sql})
+            if self._insert or self._prepared:
+                cursor = connection.cursor()
+            else:
+                # Outside a transaction the cursor has to survive the implicit commit
+                cursor = connection.cursor(name=f"qb_cursor_{next(_cursor_names)}",
+                                           withhold=bool(connection.autocommit))
+                cursor.itersize = itersize
+            statement_timeout = deadline.remaining() if deadline is not None else None
+            session_timeouts = timeouts.set_timeouts(connection, statement_timeout, self._lock_timeout)
+            if deadline is not None:
+                watch = timeouts.watch(connection, deadline)
+            try:
+                if self._prepared:
+                    statement_cache.get_statement_cache(connection).execute(cursor, sql, params)
+                else:
+                    cursor.execute(sql, params)
+            finally:
+                if session_timeouts:
+                    timeouts.reset_timeouts(connection)
+        except psycopg2.Error as postgres_error:
+            if watch is not None:
+                watch.stop()
+            if release is not None:
+                release(postgres_error)
+            custom_error = DatabaseError.from_postgres_exception(
+                postgres_error, params=params if isinstance(params, dict) else None, query=sql)
+            if measurement is not None:
+                measurement.finish(postgres_error)
+            raise custom_error from postgres_error
+        except BaseException as error:
+            if watch is not None:
+                watch.stop()
+            if release is not None:
+                release(error)
+            if measurement is not None:
+                measurement.finish(error)
+            raise
+        if measurement is not None:
+            measurement.executed()
+        return QueryResult(cursor, sql, release, watch, measurement)
+
+    def to_arrow(self, source, block_size: int = columnar.DEFAULT_BLOCK_SIZE):
+        """The result as a pyarrow Table, fetched through COPY without Python row tuples, see columnar.py."""
+        return columnar.fetch_arrow(routing.read_source(source), *self.get_sql(), block_size=block_size)
+
+    def to_polars(self, source, block_size: int = columnar.DEFAULT_BLOCK_SIZE):
+        """The result as a Polars DataFrame, fetched through COPY without Python row tuples, see columnar.py."""
+        return columnar.fetch_polars(routing.read_source(source), *self.get_sql(), block_size=block_size)
+
+    def stream_arrow(self, source, block_size: int = columnar.DEFAULT_BLOCK_SIZE):
+        """The result as pyarrow RecordBatches of about block_size bytes, for results larger than memory."""
+        return columnar.stream_arrow(routing.read_source(source), *self.get_sql(), block_size=block_size)
+
+    def stream_polars(self, source, block_size: int = columnar.DEFAULT_BLOCK_SIZE):
+        """The result as Polars DataFrames of about block_size bytes, for results larger than memory."""
+        return columnar.stream_polars(routing.read_source(source), *self.get_sql(), block_size=block_size)
+
+    def get_params(self) -> Params:
+        """The parameters of the query, in placeholder order (or a dict for named placeholders)."""
+        if self._param_style == "named":
+            return dict(self._named_params)
+        if self._insert:
+            return list(self._insert_params)
+        having_params = self._having_params if self._group_by else []  # HAVING is only emitted with GROUP BY
+        return (self._where_params + self._and_where_params + self._or_where_params
+                + self._keyset_params + having_params)
+
+    def get_sql(self) -> Tuple[str, Optional[Params]]:
+        """
+        The SQL text and its parameters, ready for cursor.execute(*builder.get_sql()).
+
+        The parameters are None when the query has none, because psycopg2
+        only treats % as special when parameters are passed.
+        """
+        params = self.get_params()
+        return self.compile().sql, (params or None)
+
+    def compile(self) -> CompiledQuery:
+        """Freeze the current shape of the query into a template, reusing a cached one if possible."""
+        return compile_shape(self._shape())
+
+    def _shape(self):
+        """Everything that goes into the SQL text, but none of the parameter values, in build_sql() order."""
+        insert = (tuple(self._insert[0]), tuple(map(tuple, self._insert[1]))) if self._insert else None
+        return (self._table, tuple(self._columns or ()), self._distinct, self._count, tuple(self._joins),
+                self._where, tuple(self._and_where), tuple(self._or_where), self._keyset, tuple(self._group_by),
+                tuple(self._having), tuple(self._order_by), self._limit, self._offset, insert)
+
+    # ______________________________Parameters________________________________
+    def _split_conditions(self, arguments) -> Tuple[Tuple[str, ...], List[Any]]:
+        """Separate condition strings from the values that follow them."""
+        conditions = []
+        params = []
+        arguments = list(arguments)
+        index = 0
+        while index < len(arguments):
+            condition = arguments[index]
+            if not isinstance(condition, str):
+                raise ValueError(f"Expected a SQL condition, got {condition!r}")
+            conditions.append(condition)
+            index += 1
+
+            positional, names = count_placeholders(condition)
+            if positional and names:
+                raise ValueError("Cannot mix parameter styles in one query")
+            if names:
+                if index >= len(arguments) or not isinstance(arguments[index], dict):
+                    raise ValueError(f"Condition {condition!r} needs a dict with its named parameters")
+                self._add_params(params, [condition], arguments[index])
+                index += 1
+            elif positional:
+                if index < len(arguments) and isinstance(arguments[index], (list, tuple)):
+                    values = arguments[index]
+                    index += 1
+                else:
+                    values = arguments[index:index + positional]
+                    index += positional
+                self._add_params(params, [condition], values)
+        return tuple(conditions), params
+
+    def _add_params(self, params, fragments, values):
+        """Check values against the placeholders in fragments and record them."""
+        positional, names = 0, []
+        for fragment in fragments:
+            fragment_positional, fragment_names = count_placeholders(fragment)
+            positional += fragment_positional
+            names += fragment_names
+        if positional and names:
+            raise ValueError("Cannot mix parameter styles in one query")
+
+        if names:
+            self._use_param_style("named")
+            missing = set(names) - set(values)
+            if missing:
+                raise ValueError(f"Missing named parameters: {', '.join(sorted(missing))}")
+            self._named_params.update(values)
+        else:
+            if isinstance(values, dict):
+                raise ValueError("Named parameters given for positional placeholders")
+            if len(values) != positional:
+                raise ValueError(f"Expected {positional} parameters, got {len(values)}")
+            if positional:
+                self._use_param_style("positional")
+            params.extend(values)
+
+    def _use_param_style(self, style):
+        if self._param_style is not None and self._param_style != style:
+            raise ValueError("Cannot mix parameter styles in one query")
+        self._param_style = style
+
 # ______________________________Where Conditions________________________________
     def and_where(self, *and_where):
-        for item in and_where:
-            self._and_where.append(item)
+        conditions, params = self._split_conditions(and_where)
+        self._and_where.extend(conditions)
+        self._and_where_params.extend(params)
         return self
 
     def or_where(self, *or_where):
-        for item in or_where:
-            self._or_where.append(item)
+        conditions, params = self._split_conditions(or_where)
+        self._or_where.extend(conditions)
+        self._or_where_params.extend(params)
         return self
     
     def case(self):
         return self
 
     def where(self, *where):
-        self._where = where
+        self._where, self._where_params = self._split_conditions(where)
         return self
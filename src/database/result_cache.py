@@ -0,0 +1,344 @@
+"""
+Opt-in cache of read query results.
+
+Report endpoints run the same SELECTs against lookup tables like categories,
+suppliers and shippers over and over, while those tables hardly ever change.
+ResultCache keeps the rows of such queries in memory, keyed by their SQL and
+parameters:
+
+- every entry lives for its ttl, at most,
+- the cache is an LRU bounded by the estimated size of the rows it holds,
+- concurrent misses on one key wait for a single fill instead of all running
+  the query (stampede protection),
+- an entry is dropped when a write through this library touches one of the
+  tables its query reads (QueryBuilder INSERTs and bulk_insert call
+  tables_written()). A write in a transaction is invalidated again once the
+  transaction ends, since until it commits concurrent readers may cache the
+  rows from before the write. transaction() and pool connections do that
+  themselves, code that commits a connection of its own calls
+  transaction_ended(connection) after the commit.
+
+Writes by other processes are only seen through the ttl, unless a
+TableChangeListener is running: install_notify_trigger() makes a table send a
+NOTIFY on every change, and the listener invalidates the cached queries
+reading that table.
+
+Example:
+    categories = QueryBuilder().select("*").from_table("categories").cached(ttl=300)
+    rows = categories.execute(pool).fetch_all()
+"""
+
+import logging
+import re
+import select
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 60.0
+NOTIFY_CHANNEL = "table_changes"
+
+_JOINED_TABLE = re.compile(r"\bJOIN\s+(\S+)", re.IGNORECASE)
+
+_caches = weakref.WeakSet()
+_caches_lock = threading.Lock()
+_pending = weakref.WeakKeyDictionary()  # connection -> tables written in its open transaction
+_pending_lock = threading.Lock()
+
+
+def table_name(reference):
+    """The bare, lower case table name of "schema.table alias"."""
+    return reference.split()[0].split(".")[-1].strip('"').lower()
+
+
+def referenced_tables(table, joins=()):
+    """The tables read by a query on table with the given JOIN clauses."""
+    tables = {table_name(table)}
+    for join in joins:
+        tables.update(table_name(match) for match in _JOINED_TABLE.findall(join))
+    return frozenset(tables)
+
+
+def freeze_params(params):
+    """A hashable form of query parameters, for use in cache keys."""
+    if isinstance(params, dict):
+        return tuple(sorted((key, freeze_params(value)) for key, value in params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(freeze_params(value) for value in params)
+    if isinstance(params, (set, frozenset)):
+        return frozenset(freeze_params(value) for value in params)
+    return params
+
+
+def estimate_size(rows):
+    """Rough number of bytes the rows take up in memory."""
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+def tables_written(*tables, connection=None):
+    """
+    Invalidate the cached results reading any of tables, in every ResultCache.
+
+    Pass the connection the write ran on unless it's committed already: when
+    it's in a transaction, the results are invalidated again by
+    transaction_ended().
+    """
+    names = {table_name(table) for table in tables}
+    _invalidate(names)
+    if connection is not None and (not connection.autocommit or
+                                   connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+        with _pending_lock:
+            _pending.setdefault(connection, set()).update(names)
+
+
+def transaction_ended(connection):
+    """Invalidate the cached results reading the tables written in the transaction connection just ended."""
+    with _pending_lock:
+        names = _pending.pop(connection, None)
+    if names:
+        _invalidate(names)
+
+
+def _invalidate(names):
+    with _caches_lock:
+        caches = list(_caches)
+    for cache in caches:
+        cache.invalidate_tables(*names)
+
+
+class _Entry:
+    __slots__ = ("rows", "expires_at", "size", "tables")
+
+    def __init__(self, rows, expires_at, size, tables):
+        self.rows = rows
+        self.expires_at = expires_at
+        self.size = size
+        self.tables = tables
+
+
+class _Fill:
+    """A query being run for a key, which other callers missing on it wait for."""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.done = threading.Event()
+        self.rows = None
+        self.error = None
+        self.invalidated = False
+
+
+class ResultCache:
+    """Size bounded LRU of query results with per entry expiry."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, default_ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Misses that waited for another caller's fill
+        self.evictions = 0
+        self.invalidations = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._by_table = {}  # table -> keys of entries reading it
+        self._fills = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        with _caches_lock:
+            _caches.add(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_load(self, key, load, ttl=None, tables=()):
+        """
+        The cached rows for key, or the rows returned by load(), which are
+        cached for ttl seconds unless one of tables is written meanwhile.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > self._clock():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry.rows
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            fill = self._fills.get(key)
+            leader = fill is None
+            if leader:
+                fill = self._fills[key] = _Fill(frozenset(tables))
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            fill.done.wait()
+            if fill.error is not None:
+                raise fill.error
+            return fill.rows
+
+        try:
+            fill.rows = tuple(load())
+        except BaseException as error:
+            fill.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._fills[key]
+                if fill.error is None and not fill.invalidated:
+                    self._store(key, fill, self.default_ttl if ttl is None else ttl)
+            fill.done.set()
+        return fill.rows
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_tables(self, *tables):
+        """Drop every entry, and discard every fill in progress, reading one of tables."""
+        tables = {table_name(table) for table in tables}
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys.update(self._by_table.get(table, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            for fill in self._fills.values():
+                if fill.tables & tables:
+                    fill.invalidated = True
+
+    def clear(self):
+        with self._lock:
+            for fill in self._fills.values():
+                fill.invalidated = True
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                    "coalesced": self.coalesced, "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def _store(self, key, fill, ttl):
+        size = estimate_size(fill.rows)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        self._entries[key] = _Entry(fill.rows, self._clock() + ttl, size, fill.tables)
+        self._bytes += size
+        for table in fill.tables:
+            self._by_table.setdefault(table, set()).add(key)
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+
+default_cache = ResultCache()
+
+
+def install_notify_trigger(connection, table, channel=NOTIFY_CHANNEL):
+    """
+    Make every INSERT, UPDATE, DELETE and TRUNCATE on table send a NOTIFY on
+    channel with the table name, for a TableChangeListener to pick up.
+    """
+    name = table_name(table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE OR REPLACE FUNCTION notify_table_change() RETURNS trigger AS $$ "
+            "BEGIN PERFORM pg_notify(TG_ARGV[0], TG_TABLE_NAME); RETURN NULL; END; "
+            "$$ LANGUAGE plpgsql")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}_notify_change ON {table}")
+        cursor.execute(f"CREATE TRIGGER {name}_notify_change AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE "
+                       f"ON {table} FOR EACH STATEMENT EXECUTE FUNCTION notify_table_change(%s)", [channel])
+
+
+class TableChangeListener:
+    """
+    Invalidates cached results on NOTIFYs sent by install_notify_trigger.
+
+    Listens on a dedicated connection from a daemon thread. Notifications
+    sent while the connection is down are lost, so after reconnecting every
+    cache is cleared.
+    """
+
+    def __init__(self, connection_factory, channel=NOTIFY_CHANNEL, poll_interval=1.0, retry_interval=5.0):
+        self.connection_factory = connection_factory
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="result-cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        reconnecting = False
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self.connection_factory()
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                if reconnecting:
+                    self._clear_caches()
+                self._listen(connection)
+            except (psycopg2.Error, OSError):
+                logger.warning("Result cache listener lost its connection, reconnecting.", exc_info=True)
+                reconnecting = True
+                self._stopped.wait(self.retry_interval)
+            finally:
+                if connection is not None and not connection.closed:
+                    connection.close()
+
+    def _listen(self, connection):
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([connection], [], [], self.poll_interval)
+            if not readable:
+                continue
+            connection.poll()
+            tables = {notify.payload for notify in connection.notifies}
+            connection.notifies.clear()
+            if tables:
+                logger.debug("Tables %s changed, invalidating cached results.", ", ".join(sorted(tables)))
+                tables_written(*tables)
+
+    @staticmethod
+    def _clear_caches():
+        with _caches_lock:
+            caches = list(_caches)
+        for cache in caches:
+            cache.clear()
@@ -0,0 +1,43 @@
+"""
+stamina's retry decorator, without importing stamina until it's first needed.
+
+stamina (and its dependencies) take longer to import than most of this
+package, and decorating a method at class definition would import it along
+with the module. retry() takes the same arguments as stamina.retry() and
+builds the real decorator on the first call of the decorated function, which
+may be a coroutine function.
+
+Example:
+    @retry(on=psycopg2.OperationalError, attempts=5, timeout=30.0)
+    def get_valid_connection(self):
+        ...
+"""
+
+import functools
+import inspect
+
+
+def retry(**options):
+    def decorate(function):
+        retrying = None
+
+        def retrying_function():
+            nonlocal retrying
+            if retrying is None:
+                import stamina
+
+                retrying = stamina.retry(**options)(function)
+            return retrying
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                return await retrying_function()(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return retrying_function()(*args, **kwargs)
+        return wrapper
+
+    return decorate
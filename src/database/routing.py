@@ -0,0 +1,191 @@
+"""
+Read/write splitting between a primary and its streaming replicas.
+
+ReplicaRouter stands in for the primary's ConnectionPool: getconn() and
+putconn() (and so PooledDatabaseConnection, checkout_connection, bulk_insert
+and transactions) always use the primary. Only callers that know their query
+is read-only ask for read_pool(), which picks a replica:
+
+- "least_outstanding" picks the replica with the fewest checked out and
+  waiting connections, relative to its size, ties taking turns,
+- "round_robin" takes the replicas in turn.
+
+check_replicas() (normally run by ReplicaMonitor every few seconds) measures
+how far every replica's replay is behind, using
+pg_last_xact_replay_timestamp(). Replicas that can't be reached, have no
+connection to spare, or are behind by more than max_lag seconds, get no
+reads until a later check finds them healthy again. Without a healthy
+replica, reads go to the primary. PostgreSQLConnectionPool opens replica
+pools without connecting, so a replica that is down at startup is only
+marked unreachable.
+
+A replica that has replayed everything it received reports no lag, however
+old its last replayed transaction is, so an idle primary doesn't make its
+replicas look stale.
+
+Example:
+    router = ReplicaRouter(primary_pool, [replica_pool], max_lag=5.0)
+    rows = QueryBuilder().select("*").from_table("orders").execute(router).fetch_all()
+"""
+
+import itertools
+import logging
+import threading
+
+import psycopg2
+
+from .exceptions import ConfigurationError, DatabaseError, PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+ROUTING_STRATEGIES = ("least_outstanding", "round_robin")
+
+REPLICA_LAG_QUERY = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def read_source(source):
+    """Where a read-only query on source should run: a replica pool for a router, source itself otherwise."""
+    if hasattr(source, "read_pool"):
+        return source.read_pool()
+    return source
+
+
+def replica_lag(connection):
+    """Seconds the replica on connection is behind its primary, 0 when it's caught up."""
+    with connection.cursor() as cursor:
+        cursor.execute(REPLICA_LAG_QUERY)
+        lag = cursor.fetchone()[0]
+    connection.commit()
+    return float(lag)
+
+
+class ReplicaRouter:
+    """
+    Routes read-only queries over replica pools, everything else to the primary pool.
+
+    Attributes of the primary pool that aren't defined here (metrics,
+    validation_policy, max_connections, stats() ...) are the router's own.
+    """
+
+    def __init__(self, primary, replicas, strategy="least_outstanding", max_lag=None):
+        if strategy not in ROUTING_STRATEGIES:
+            raise ConfigurationError(f"Unknown routing strategy {strategy!r}")
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.lags = [0.0] * len(self.replicas)  # None for a replica that couldn't be checked
+        self.reads = {"primary": 0, "replica": 0}
+        self._reads_lock = threading.Lock()
+        self._turns = itertools.count()
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    @property
+    def pools(self):
+        return [self.primary] + self.replicas
+
+    def getconn(self, timeout=None):
+        return self.primary.getconn(timeout)
+
+    def putconn(self, connection, close=False):
+        self.primary.putconn(connection, close)
+
+    def healthy_replicas(self):
+        """The replicas that may serve reads, going by the last check."""
+        return [replica for replica, lag in zip(self.replicas, self.lags)
+                if lag is not None and (self.max_lag is None or lag <= self.max_lag)]
+
+    def read_pool(self):
+        """The pool to run the next read-only query on."""
+        candidates = self.healthy_replicas()
+        with self._reads_lock:
+            self.reads["replica" if candidates else "primary"] += 1
+        if not candidates:
+            return self.primary
+        # Start at a different replica every time, so ties take turns
+        offset = next(self._turns) % len(candidates)
+        candidates = candidates[offset:] + candidates[:offset]
+        if self.strategy == "round_robin":
+            return candidates[0]
+        return min(candidates, key=lambda pool: (pool.in_use_count + pool.waiting_count) / pool.max_connections)
+
+    def check_replicas(self):
+        """
+        Measure the lag of every replica, marking the unreachable ones with None.
+
+        A replica without an idle connection or a free slot isn't waited for,
+        its lag is unknown (None) until a check finds a connection to spare.
+        """
+        for index, replica in enumerate(self.replicas):
+            connection = None
+            try:
+                connection = replica.getconn(timeout=0)
+                lag = replica_lag(connection)
+            except PoolTimeoutError:
+                logger.debug("Replica %d has no connection to spare, its lag is unknown.", index)
+                self.lags[index] = None
+                continue
+            except (psycopg2.Error, OSError, DatabaseError) as error:
+                if self.lags[index] is not None:
+                    logger.warning("Replica %d can't be reached, reading from the others: %s", index, error)
+                self.lags[index] = None
+                if connection is not None:
+                    replica.putconn(connection, close=True)
+                continue
+            replica.putconn(connection)
+            if self.max_lag is not None and lag > self.max_lag >= (self.lags[index] or 0):
+                logger.warning("Replica %d is %.1f seconds behind, reading from the others.", index, lag)
+            self.lags[index] = lag
+
+    def maintain(self):
+        for pool in self.pools:
+            pool.maintain()
+
+    def detach_after_fork(self):
+        for pool in self.pools:
+            pool.detach_after_fork()
+
+    def closeall(self):
+        for pool in self.pools:
+            pool.closeall()
+
+
+class ReplicaMonitor:
+    """
+    Runs ReplicaRouter.check_replicas() every interval seconds on a daemon thread.
+
+    Example:
+        monitor = ReplicaMonitor(interval=5.0)
+        monitor.start(router)
+        ...
+        monitor.stop()
+    """
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, router):
+        self._stopped.clear()
+        router.check_replicas()
+        self._thread = threading.Thread(target=self._run, args=(router,), name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, router):
+        while not self._stopped.wait(self.interval):
+            try:
+                router.check_replicas()
+            except Exception:
+                logger.exception("Checking the replicas failed.")
@@ -0,0 +1,265 @@
+"""
+Server-side prepared statement cache.
+
+The hot QueryBuilder queries are a handful of SQL shapes executed over and
+over, and without help the server parses and plans each one from scratch
+every time. PreparedStatementCache keeps, per connection, an LRU of statements
+that were PREPAREd on the server, keyed by their normalized SQL text. The
+first execution sends "PREPARE ...; EXECUTE ..." in one round trip, repeat
+executions only send "EXECUTE name(...)".
+
+psycopg2 placeholders are translated for PREPARE: every %s becomes $1, $2, ...
+in order, and every distinct %(name)s gets its own $n. The parameters are then
+passed to EXECUTE through psycopg2 as usual, so quoting stays psycopg2's job.
+
+When a table changes shape under a prepared statement, PostgreSQL refuses to
+run it with "cached plan must not change result type". The statement is then
+deallocated and, outside of a transaction, prepared again and retried once.
+Inside a transaction the transaction is already aborted, so the error is
+raised and the statement is prepared again on its next use.
+
+Example:
+    with PooledDatabaseConnection(pool) as conn:
+        cache = get_statement_cache(conn)
+        with conn.cursor() as cursor:
+            cache.execute(cursor, "SELECT * FROM orders WHERE customer_id = %s", ["ALFKI"])
+            rows = cursor.fetchall()
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import psycopg2
+import psycopg2.extensions
+
+from .exceptions import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 100
+CACHED_PLAN_CHANGED_MESSAGE = "cached plan must not change result type"
+
+# Quoted strings, identifiers and dollar-quoted bodies are kept as they are, runs of whitespace
+# and comments between them become one space
+_QUOTED_OR_WHITESPACE = re.compile(
+    r"(?P<quoted>(?<![\w$])[Ee]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\""
+    r"|(?P<tag>\$(?:[A-Za-z_]\w*)?\$).*?(?P=tag))"
+    r"|(?:\s|--[^\n]*|/\*.*?\*/)+",
+    re.DOTALL,
+)
+# psycopg2 placeholders: %%, %s or %(name)s
+_PLACEHOLDER = re.compile(r"%%|%s|%\((\w+)\)s")
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def normalize_sql(query):
+    """
+    Collapse whitespace and drop comments outside of quotes, so formatting
+    differences share one statement.
+
+    Nested block comments aren't parsed, a query with one is only stripped.
+    """
+    nested = False
+
+    def replace(match):
+        nonlocal nested
+        if match.group("quoted") is not None:
+            return match.group("quoted")
+        if any("/*" in comment[2:] for comment in re.findall(r"/\*.*?\*/", match.group(0), re.DOTALL)):
+            nested = True
+        return " "
+
+    normalized = _QUOTED_OR_WHITESPACE.sub(replace, query).strip()
+    return query.strip() if nested else normalized
+
+
+def to_server_placeholders(query):
+    """
+    Translate psycopg2 placeholders to PostgreSQL's $n style.
+
+    Returns the translated query and the placeholders to pass to EXECUTE,
+    either a number of positional %s or a list of parameter names.
+    """
+    positional = 0
+    names = []
+
+    def replace(match):
+        nonlocal positional
+        if match.group(0) == "%%":
+            return "%"
+        if match.group(1) is None:
+            positional += 1
+            return f"${positional}"
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+
+    translated = _PLACEHOLDER.sub(replace, query)
+    if positional and names:
+        raise ValueError("Cannot mix parameter styles in one query")
+    return translated, (names or positional)
+
+
+def statement_name(normalized_query, generation):
+    digest = hashlib.blake2b(normalized_query.encode(), digest_size=8).hexdigest()
+    return f"qb_{digest}_{generation}"
+
+
+class PreparedStatementCache:
+    """
+    LRU of the statements prepared on one connection.
+
+    Not thread-safe on its own, but neither is sharing a connection between
+    threads, and the cache is only ever used through its connection.
+    """
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._statements = OrderedDict()  # normalized query -> (name, EXECUTE statement)
+        self._to_deallocate = []
+        self._maybe_prepared = []  # Names of statements whose PREPARE may have gone through before an error
+        # Statement names are never reused, so a PREPARE that may or may not
+        # have happened before an error can't collide with a later one
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._statements)
+
+    def __contains__(self, query):
+        return normalize_sql(query) in self._statements
+
+    def execute(self, cursor, query, params=None):
+        """Execute query on cursor through a prepared statement, returning the cursor."""
+        normalized = normalize_sql(query)
+        entry = self._statements.get(normalized)
+        if entry is not None:
+            self.hits += 1
+            self._statements.move_to_end(normalized)
+        else:
+            self.misses += 1
+
+        try:
+            self._run(cursor, normalized, entry, params)
+        except psycopg2.errors.FeatureNotSupported as postgres_error:
+            if CACHED_PLAN_CHANGED_MESSAGE not in str(postgres_error):
+                raise
+            self._invalidate(normalized)
+            if cursor.connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                raise
+            logger.info("Prepared statement for %r went stale after a schema change, preparing it again.", query)
+            self._run(cursor, normalized, None, params)
+        return cursor
+
+    def stats(self):
+        return {"size": len(self._statements), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def clear(self, cursor=None):
+        """Forget every statement, deallocating them on the server if a cursor is given."""
+        if cursor is not None:
+            cursor.execute("DEALLOCATE ALL")
+            self._to_deallocate = []
+            self._maybe_prepared = []
+        else:
+            self._to_deallocate.extend(name for name, _ in self._statements.values())
+        self._statements.clear()
+
+    def _run(self, cursor, normalized, entry, params):
+        prefix = self._pending_deallocations(cursor)
+        if entry is not None:
+            cursor.execute(prefix + entry[1], params)
+            return
+
+        name, execute_statement = self._prepare(normalized, params)
+        if params is None:
+            translated = normalized  # psycopg2 leaves the text alone when there are no parameters
+        else:
+            translated = to_server_placeholders(normalized)[0].replace("%", "%%")
+        try:
+            cursor.execute(f"{prefix}PREPARE {name} AS {translated}; {execute_statement}", params)
+        except Exception:
+            # The PREPARE may or may not have gone through (an EXECUTE failing on a unique
+            # violation leaves the statement behind), prepare under a new name next time
+            self._statements.pop(normalized, None)
+            self._maybe_prepared.append(name)
+            raise
+
+    def _prepare(self, normalized, params):
+        self._generation += 1
+        name = statement_name(normalized, self._generation)
+        placeholders = to_server_placeholders(normalized)[1] if params is not None else 0
+        if isinstance(placeholders, list):
+            arguments = ", ".join(f"%({parameter})s" for parameter in placeholders)
+        else:
+            arguments = ", ".join(["%s"] * placeholders)
+        execute_statement = f"EXECUTE {name}({arguments})" if arguments else f"EXECUTE {name}"
+
+        entry = (name, execute_statement)
+        self._statements[normalized] = entry
+        if len(self._statements) > self.max_size:
+            _, (evicted_name, _) = self._statements.popitem(last=False)
+            self._to_deallocate.append(evicted_name)
+            self.evictions += 1
+        return entry
+
+    def _pending_deallocations(self, cursor):
+        """
+        DEALLOCATE statements for evicted entries, sent along with the next
+        statement. Statements that failed are looked up first, only the ones
+        that exist can be deallocated.
+        """
+        if not (self._to_deallocate or self._maybe_prepared):
+            return ""
+        if cursor.connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return ""
+        if self._maybe_prepared:
+            cursor.execute("SELECT name FROM pg_prepared_statements WHERE name = ANY(%s)", [self._maybe_prepared])
+            self._to_deallocate.extend(row[0] for row in cursor.fetchall())
+            self._maybe_prepared = []
+            if not self._to_deallocate:
+                return ""
+        prefix = "".join(f"DEALLOCATE {name}; " for name in self._to_deallocate)
+        self._to_deallocate = []
+        return prefix
+
+    def _invalidate(self, normalized):
+        entry = self._statements.pop(normalized, None)
+        if entry is not None:
+            self._to_deallocate.append(entry[0])
+            self.invalidations += 1
+
+
+def get_statement_cache(connection, max_size=DEFAULT_CACHE_SIZE):
+    """The PreparedStatementCache of a connection, created on first use."""
+    cache = _caches.get(connection)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(connection)
+            if cache is None:
+                cache = _caches[connection] = PreparedStatementCache(max_size)
+    return cache
+
+
+def execute_prepared(connection, query, params=None):
+    """
+    Run query on a new cursor of connection through its statement cache.
+
+    Returns the cursor, PostgreSQL errors are raised as DatabaseError subclasses.
+    """
+    cursor = connection.cursor()
+    try:
+        return get_statement_cache(connection).execute(cursor, query, params)
+    except psycopg2.Error as postgres_error:
+        cursor.close()
+        custom_error = DatabaseError.from_postgres_exception(
+            postgres_error, params=params if isinstance(params, dict) else None, query=query)
+        raise custom_error from postgres_error
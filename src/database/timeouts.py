@@ -0,0 +1,194 @@
+"""
+Statement timeouts, per-query deadlines and cancelling queries on the server.
+
+A runaway query holds its pool connection until the server is done with it.
+Queries are bounded in two ways:
+
+- statement_timeout and lock_timeout make the server give up by itself.
+  They are set for every connection of a pool through the STATEMENT_TIMEOUT
+  and LOCK_TIMEOUT settings (see connection_options()), or for the
+  transaction of a single query with set_timeouts().
+
+- A Deadline is a point in time a caller needs its answer by. watch() has
+  the watchdog thread call connection.cancel() when it passes, which stops
+  the query on the server even while the client is stuck waiting for it.
+
+Either way the query fails with SQLSTATE 57014 (query_canceled), or 55P03
+(lock_not_available) for a lock_timeout, which DatabaseError maps to
+QueryTimeoutError. The transaction of a cancelled query is aborted; pool
+connections are rolled back before they are returned, so the next user gets
+a clean connection.
+
+Example:
+    rows = QueryBuilder().select("*").from_table("orders").timeout(2.0).execute(pool).fetch_all()
+
+    deadline = Deadline(5.0)  # For the whole request
+    with PooledDatabaseConnection(pool, deadline=deadline) as conn:
+        ...
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_SQLSTATES = ("57014", "55P03")  # query_canceled, lock_not_available
+
+
+class Deadline:
+    """The moment by which a call has to be done, seconds from its creation."""
+
+    __slots__ = ("expires_at", "_clock")
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self._clock = clock
+        self.expires_at = clock() + seconds
+
+    @classmethod
+    def of(cls, timeout):
+        """A Deadline for timeout seconds, timeout itself if it's a Deadline already, or None for None."""
+        if timeout is None or isinstance(timeout, Deadline):
+            return timeout
+        return cls(timeout)
+
+    @staticmethod
+    def earliest(*deadlines):
+        """The deadline that passes first, ignoring None."""
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        return min(deadlines, key=lambda deadline: deadline.expires_at, default=None)
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self):
+        return self.remaining() == 0.0
+
+
+def _milliseconds(seconds):
+    return max(1, math.ceil(seconds * 1000))
+
+
+def connection_options(statement_timeout=None, lock_timeout=None):
+    """The libpq options parameter setting the timeouts (in seconds) for every session, or None."""
+    options = [f"-c {name}={_milliseconds(seconds)}"
+               for name, seconds in (("statement_timeout", statement_timeout), ("lock_timeout", lock_timeout))
+               if seconds is not None]
+    return " ".join(options) or None
+
+
+def set_timeouts(connection, statement_timeout=None, lock_timeout=None):
+    """
+    Set statement_timeout and lock_timeout (in seconds) in one round trip.
+
+    Inside a transaction they hold until it ends. Autocommit connections have
+    no transaction to scope them to, so they are set for the session and True
+    is returned: call reset_timeouts() once the query is done.
+    """
+    settings = [(name, f"{_milliseconds(seconds)}ms")
+                for name, seconds in (("statement_timeout", statement_timeout), ("lock_timeout", lock_timeout))
+                if seconds is not None]
+    if not settings:
+        return False
+    local = not connection.autocommit
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT " + ", ".join(["set_config(%s, %s, %s)"] * len(settings)),
+                       [value for name, setting in settings for value in (name, setting, local)])
+    return not local
+
+
+def reset_timeouts(connection):
+    """Go back to the session's configured timeouts after set_timeouts() on an autocommit connection."""
+    with connection.cursor() as cursor:
+        cursor.execute("RESET statement_timeout; RESET lock_timeout")
+
+
+def is_timeout(postgres_error):
+    """Whether a driver error is a cancelled statement or a lock_timeout."""
+    sqlstate = getattr(getattr(postgres_error, "diag", None), "sqlstate", None) or getattr(postgres_error, "pgcode", None)
+    return sqlstate in TIMEOUT_SQLSTATES
+
+
+class Watch:
+    """A deadline kept on a connection by the watchdog, until stop() is called."""
+
+    __slots__ = ("connection", "deadline", "fired", "stopped", "_lock")
+
+    def __init__(self, connection, deadline):
+        self.connection = connection
+        self.deadline = deadline
+        self.fired = False
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """Stop watching. Once this returns, the watchdog won't cancel anything on the connection anymore."""
+        with self._lock:
+            self.stopped = True
+
+    def _fire(self):
+        with self._lock:
+            if self.stopped:
+                return
+            self.fired = True
+            try:
+                self.connection.cancel()
+            except psycopg2.Error:
+                logger.warning("Cancelling a query past its deadline failed.", exc_info=True)
+
+
+class Watchdog:
+    """One daemon thread cancelling the queries whose deadline passed, however many are watched."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def watch(self, connection, deadline):
+        watch = Watch(connection, deadline)
+        with self._condition:
+            if self._thread is None or self._pid != os.getpid():
+                # Not started yet, or started by the parent of a forked process
+                self._heap = []
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="query-watchdog", daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (deadline.expires_at, next(self._order), watch))
+            if self._heap[0][2] is watch:
+                self._condition.notify()
+        return watch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._heap and self._heap[0][2].stopped:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                wait = self._heap[0][0] - self._clock()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                _, _, watch = heapq.heappop(self._heap)
+            # Outside the lock, cancel() is a round trip to the server
+            watch._fire()
+
+
+_watchdog = Watchdog()
+
+
+def watch(connection, deadline):
+    """Have the query running on connection cancelled on the server when deadline passes."""
+    return _watchdog.watch(connection, deadline)
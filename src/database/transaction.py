@@ -0,0 +1,239 @@
+"""
+Transactions as context managers, with savepoints and retries.
+
+transaction() runs a block in a transaction on a connection, or on a
+connection checked out of a pool for the block: it is committed when the
+block completes and rolled back when it raises. Entered on a connection that
+is already in a transaction, it becomes a savepoint instead, so a failing
+inner block only undoes its own work.
+
+The outermost transaction sets the isolation level, and can be made
+READ ONLY, plus DEFERRABLE at SERIALIZABLE, for snapshot reads that never
+fail with a serialization failure and take no predicate locks.
+
+Under REPEATABLE READ and SERIALIZABLE, and with deadlocks under any level,
+the server aborts transactions with SQLSTATE class 40 errors
+(TransactionError) that succeed when they are run again. A with block can't
+run itself twice, so retrying ones are written as a loop over attempts, with
+stamina's jittered exponential backoff between them:
+
+    for attempt in transaction_attempts(pool, isolation_level="serializable"):
+        with attempt as conn:
+            transfer(conn, source_account, target_account, amount)
+
+Retries and serialization failures are counted in the pool's metrics.
+"""
+
+import itertools
+import logging
+
+import psycopg2
+import psycopg2.extensions
+import stamina
+
+from . import result_cache
+from .connection import checkout_connection
+from .exceptions import TransactionError
+
+logger = logging.getLogger(__name__)
+
+ISOLATION_LEVELS = {
+    "read committed": "READ COMMITTED",
+    "repeatable read": "REPEATABLE READ",
+    "serializable": "SERIALIZABLE",
+}
+
+_savepoint_numbers = itertools.count(1)
+
+
+def is_retryable(error):
+    """Whether a transaction that failed with error may succeed when run again (SQLSTATE class 40)."""
+    if isinstance(error, TransactionError):
+        return True
+    if isinstance(error, psycopg2.Error):
+        sqlstate = getattr(error.diag, "sqlstate", None) or error.pgcode
+        return bool(sqlstate) and sqlstate.startswith("40")
+    return False
+
+
+def transaction_mode(isolation_level=None, read_only=False, deferrable=False):
+    """The transaction_mode clause of BEGIN and SET TRANSACTION, "" for the defaults."""
+    modes = []
+    if isolation_level is not None:
+        level = ISOLATION_LEVELS.get(isolation_level.lower().replace("_", " "))
+        if level is None:
+            raise ValueError(f"Unknown isolation level {isolation_level!r}")
+        modes.append(f"ISOLATION LEVEL {level}")
+    if read_only:
+        modes.append("READ ONLY")
+    if deferrable:
+        modes.append("DEFERRABLE")
+    return ", ".join(modes)
+
+
+class Transaction:
+    """
+    One transaction, or savepoint, around a with block. See transaction().
+    """
+
+    def __init__(self, source, isolation_level=None, read_only=False, deferrable=False):
+        self.source = source
+        self.mode = transaction_mode(isolation_level, read_only, deferrable)
+        self.connection = None
+        self.savepoint = None
+        self._release = None
+
+    def __enter__(self):
+        self.connection, self._release = checkout_connection(self.source)
+        try:
+            self._begin()
+        except BaseException as error:
+            self._finish(error)
+            raise
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_val is None:
+            try:
+                self._commit()
+            except BaseException as error:
+                self._abort(error)
+                raise
+            self._finish(None)
+        else:
+            self._abort(exc_val)
+        return False
+
+    @property
+    def nested(self):
+        return self.savepoint is not None
+
+    def _begin(self):
+        status = self.connection.get_transaction_status()
+        with self.connection.cursor() as cursor:
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                if self.mode:
+                    raise ValueError("Only the outermost transaction can set its isolation level and access mode")
+                self.savepoint = f"tx_savepoint_{next(_savepoint_numbers)}"
+                cursor.execute(f"SAVEPOINT {self.savepoint}")
+            elif self.connection.autocommit:
+                cursor.execute(f"BEGIN {self.mode}".rstrip())
+            elif self.mode:
+                # psycopg2 sends the BEGIN itself, SET TRANSACTION has to come before any query
+                cursor.execute(f"SET TRANSACTION {self.mode}")
+
+    def _commit(self):
+        if self.nested:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"RELEASE SAVEPOINT {self.savepoint}")
+        elif self.connection.autocommit:
+            with self.connection.cursor() as cursor:
+                cursor.execute("COMMIT")
+        else:
+            # Serialization failures of SERIALIZABLE transactions may only show up here
+            self.connection.commit()
+
+    def _abort(self, error):
+        if not self.nested and is_retryable(error):
+            metrics = getattr(self.source, "metrics", None)
+            if metrics is not None:
+                metrics.record_serialization_failure()
+        try:
+            if self.nested:
+                with self.connection.cursor() as cursor:
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {self.savepoint}")
+                    cursor.execute(f"RELEASE SAVEPOINT {self.savepoint}")
+            elif self.connection.autocommit:
+                with self.connection.cursor() as cursor:
+                    cursor.execute("ROLLBACK")
+            else:
+                self.connection.rollback()
+        except psycopg2.Error:
+            logger.warning("Rolling back a failed transaction failed.", exc_info=True)
+        self._finish(error)
+
+    def _finish(self, error):
+        if not self.nested:
+            result_cache.transaction_ended(self.connection)
+        if self._release is not None:
+            self._release(error)
+            self._release = None
+
+
+def transaction(source, isolation_level=None, read_only=False, deferrable=False):
+    """
+    Run a with block in a transaction, committed when the block completes and
+    rolled back when it raises.
+
+    Args:
+        source: A connection, or a pool to check one out of for the block.
+            On a connection already in a transaction, the block runs in a
+            savepoint of that transaction.
+        isolation_level: "read committed", "repeatable read" or
+            "serializable", the connection's default if None.
+        read_only: Make the transaction READ ONLY.
+        deferrable: Make a SERIALIZABLE READ ONLY transaction DEFERRABLE: it
+            may wait for a safe snapshot when it starts, but then can't fail
+            with a serialization failure.
+
+    Example:
+        with transaction(pool, isolation_level="repeatable read") as conn:
+            ...
+    """
+    return Transaction(source, isolation_level, read_only, deferrable)
+
+
+class TransactionAttempt:
+    """One try of transaction_attempts(), the block is retried when it fails with a TransactionError."""
+
+    def __init__(self, retry_attempt, transaction):
+        self.transaction = transaction
+        self._retry_attempt = retry_attempt
+
+    @property
+    def number(self):
+        return self._retry_attempt.num if self._retry_attempt is not None else 1
+
+    def __enter__(self):
+        if self._retry_attempt is not None:
+            self._retry_attempt.__enter__()
+        return self.transaction.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.transaction.__exit__(exc_type, exc_val, exc_tb)
+        except BaseException as commit_error:
+            exc_type, exc_val, exc_tb = type(commit_error), commit_error, commit_error.__traceback__
+            if self._retry_attempt is not None and self._retry_attempt.__exit__(exc_type, exc_val, exc_tb):
+                return True
+            raise
+        if self._retry_attempt is None:
+            return False
+        return self._retry_attempt.__exit__(exc_type, exc_val, exc_tb)
+
+
+def transaction_attempts(source, attempts=5, wait_initial=0.05, wait_max=2.0, wait_jitter=0.1, timeout=None,
+                         **options):
+    """
+    Attempts at a transaction, for a loop that retries its body on serialization
+    failures and deadlocks, see the module docstring.
+
+    Every attempt is a transaction() with the given options on a freshly
+    checked out connection. The last attempt's error is raised. On a
+    connection that is already in a transaction nothing is retried, a
+    serialization failure dooms the enclosing transaction too.
+    """
+    if hasattr(source, "get_transaction_status") and \
+            source.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        yield TransactionAttempt(None, Transaction(source, **options))
+        return
+
+    metrics = getattr(source, "metrics", None)
+    retries = stamina.retry_context(on=is_retryable, attempts=attempts, timeout=timeout,
+                                    wait_initial=wait_initial, wait_max=wait_max, wait_jitter=wait_jitter)
+    for retry_attempt in retries:
+        if retry_attempt.num > 1:
+            logger.info("Retrying a transaction after a serialization failure, attempt %d.", retry_attempt.num)
+            if metrics is not None:
+                metrics.record_transaction_retry()
+        yield TransactionAttempt(retry_attempt, Transaction(source, **options))
@@ -0,0 +1,137 @@
+"""
+Connection validation policies used when a connection is checked out of the pool.
+
+Running "SELECT 1" before every checkout costs a full network round trip, which
+roughly doubles the latency of short queries. These policies trade a bit of
+certainty for speed:
+
+- AlwaysValidate:     ping the server on every checkout (the old behaviour).
+- PassiveValidate:    only look at connection.closed and the libpq transaction
+                      status, no round trip at all.
+- IdleValidate:       passive check, plus a ping if the connection sat idle in
+                      the pool for longer than idle_threshold seconds.
+- BackgroundValidate: passive check on checkout, while a background thread
+                      pings idle connections every interval seconds.
+"""
+
+import logging
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+_UNUSABLE_STATUSES = (
+    psycopg2.extensions.TRANSACTION_STATUS_ACTIVE,
+    psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN,
+)
+
+
+def ping(connection):
+    """Run "SELECT 1" on the connection, returning False if the server can't be reached."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            result = cursor.fetchone()
+            return result[0] == 1
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def looks_alive(connection):
+    """Check the client-side state of the connection without talking to the server."""
+    if connection.closed:
+        return False
+    return connection.get_transaction_status() not in _UNUSABLE_STATUSES
+
+
+class ValidationPolicy:
+    """Decides whether a connection taken from the pool is still usable."""
+
+    name = None
+
+    def is_valid(self, connection, idle_seconds):
+        raise NotImplementedError
+
+    def start(self, connection_pool):
+        """Hook for policies that need to run alongside the pool."""
+
+    def stop(self):
+        """Counterpart of start, called when the pool is closed."""
+
+
+class AlwaysValidate(ValidationPolicy):
+    name = "always"
+
+    def is_valid(self, connection, idle_seconds):
+        return ping(connection)
+
+
+class PassiveValidate(ValidationPolicy):
+    name = "passive"
+
+    def is_valid(self, connection, idle_seconds):
+        return looks_alive(connection)
+
+
+class IdleValidate(ValidationPolicy):
+    name = "idle"
+
+    def __init__(self, idle_threshold=5.0):
+        self.idle_threshold = idle_threshold
+
+    def is_valid(self, connection, idle_seconds):
+        if not looks_alive(connection):
+            return False
+        if idle_seconds > self.idle_threshold:
+            return ping(connection)
+        return True
+
+
+class BackgroundValidate(ValidationPolicy):
+    name = "background"
+
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def is_valid(self, connection, idle_seconds):
+        return looks_alive(connection)
+
+    def start(self, connection_pool):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(connection_pool,),
+                                        name="pool-validator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, connection_pool):
+        while not self._stopped.wait(self.interval):
+            try:
+                discarded = connection_pool.check_idle_connections(ping)
+                if discarded:
+                    logger.info("Background validation discarded %d dead connections.", discarded)
+            except Exception:
+                logger.exception("Background connection validation failed.")
+
+
+VALIDATION_POLICIES = {
+    policy.name: policy for policy in (AlwaysValidate, PassiveValidate, IdleValidate, BackgroundValidate)
+}
+
+
+def create_validation_policy(database_config):
+    """Build the validation policy selected in DataBaseSettings."""
+    policy_class = VALIDATION_POLICIES[database_config.validation_policy]
+    if policy_class is IdleValidate:
+        return IdleValidate(database_config.validation_idle_threshold)
+    if policy_class is BackgroundValidate:
+        return BackgroundValidate(database_config.validation_interval)
+    return policy_class()
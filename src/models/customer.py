@@ -1 +1,16 @@
-# Customer data model
\ No newline at end of file
+# Customer data model
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Customer:
+    """A row of the Northwind customers table."""
+
+    customer_id: str
+    company_name: str
+    contact_name: Optional[str] = None
+    contact_title: Optional[str] = None
+    city: Optional[str] = None
+    country: Optional[str] = None
+    phone: Optional[str] = None
@@ -1 +1,18 @@
-# Order data model
\ No newline at end of file
+# Order data model
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Order:
+    """A row of the Northwind orders table."""
+
+    order_id: int
+    customer_id: Optional[str]
+    employee_id: Optional[int] = None
+    order_date: Optional[date] = None
+    shipped_date: Optional[date] = None
+    freight: Optional[Decimal] = None
+    ship_country: Optional[str] = None
@@ -1 +1,17 @@
-# Product data model
\ No newline at end of file
+# Product data model
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Product:
+    """A row of the Northwind products table."""
+
+    product_id: int
+    product_name: str
+    supplier_id: Optional[int] = None
+    category_id: Optional[int] = None
+    unit_price: Optional[Decimal] = None
+    units_in_stock: Optional[int] = None
+    discontinued: bool = False
@@ -0,0 +1,5 @@
+from .customer_repository import CustomerRepository
+from .loader import DataLoader, Deferred
+from .order_repository import OrderRepository
+from .product_repository import ProductRepository
+from .scope import RequestScope
@@ -0,0 +1,62 @@
+"""
+Repositories reading model rows through batching DataLoaders.
+
+Each repository instance caches what it loaded, so one is made per request,
+usually by a RequestScope. Single rows are loaded by primary key with one
+`WHERE key = ANY(%s)` query per batch, see loader.py.
+"""
+
+import dataclasses
+from typing import Hashable, Iterable, List
+
+from src.database.query_executors import QueryBuilder
+
+from .loader import DataLoader, Deferred
+
+
+class Repository:
+    """Loads rows of table, keyed by key, as instances of the dataclass model."""
+
+    table: str
+    key: str
+    model: type
+
+    def __init__(self, source):
+        self.source = source
+        self.by_id = DataLoader(self._fetch_by_ids)
+
+    @classmethod
+    def columns(cls, alias=None) -> List[str]:
+        prefix = f"{alias}." if alias else ""
+        return [prefix + field.name for field in dataclasses.fields(cls.model)]
+
+    def load(self, key: Hashable) -> Deferred:
+        """The row with key, fetched together with every other row asked for before result() is called."""
+        return self.by_id.load(key)
+
+    def get_by_id(self, key: Hashable):
+        """The row with key, or None."""
+        return self.by_id.load(key).result()
+
+    def get_by_ids(self, keys: Iterable[Hashable]) -> list:
+        """The rows with keys, in order, None for missing ones."""
+        return self.by_id.load_many(keys)
+
+    def _fetch_by_ids(self, keys):
+        rows = (QueryBuilder()
+                .select(*self.columns())
+                .from_table(self.table)
+                .where(f"{self.key} = ANY(%s)", [list(keys)])
+                .execute(self.source)
+                .fetch_all())
+        return {getattr(instance, self.key): instance for instance in map(self._instance, rows)}
+
+    def _instance(self, row):
+        return self.model(*row)
+
+    def _group(self, keys, rows, key_of):
+        """Rows grouped into lists by key_of(row), every key getting a list of its own."""
+        groups = {key: [] for key in keys}
+        for row in rows:
+            groups[key_of(row)].append(row)
+        return groups
@@ -0,0 +1,17 @@
+from src.models.customer import Customer
+
+from .base import Repository
+
+
+class CustomerRepository(Repository):
+    """
+    Customers by customer_id.
+
+    Example:
+        customers = CustomerRepository(pool)
+        alfki, anatr = customers.get_by_ids(["ALFKI", "ANATR"])  # One query
+    """
+
+    table = "customers"
+    key = "customer_id"
+    model = Customer
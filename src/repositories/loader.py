@@ -0,0 +1,122 @@
+"""
+Batching and caching of repository loads, after the DataLoader pattern.
+
+Fetching a customer, then each of its orders, then the products of every
+order one at a time takes one round trip per row (the N+1 problem). A
+DataLoader collects the keys asked for and fetches them in one query:
+
+    first = customers.load("ALFKI")    # Nothing fetched yet
+    second = customers.load("ANATR")
+    first.result()                     # One query for both keys
+    second.result()                    # Already there
+
+A Deferred's result() fetches every key queued so far, load_many() fetches
+its keys straight away. Every key is fetched at most once per loader:
+results are cached, so asking for the same row twice within a request costs
+nothing. Loaders are meant to live as long as a request, see RequestScope,
+their cache is never invalidated by writes.
+"""
+
+from typing import Any, Callable, Dict, Hashable, Iterable, List
+
+DEFAULT_MAX_BATCH_SIZE = 1000
+
+
+class Deferred:
+    """The value a DataLoader will load for a key."""
+
+    __slots__ = ("loader", "key", "done", "_value", "_error")
+
+    def __init__(self, loader, key):
+        self.loader = loader
+        self.key = key
+        self.done = False
+        self._value = None
+        self._error = None
+
+    def result(self):
+        """The loaded value, fetching it along with every other queued key if need be."""
+        if not self.done:
+            self.loader.dispatch()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _resolve(self, value):
+        self.done = True
+        self._value = value
+
+    def _fail(self, error):
+        self.done = True
+        self._error = error
+
+
+class DataLoader:
+    """
+    Coalesces loads of single keys into calls of batch_load.
+
+    batch_load takes a list of distinct keys and returns a dict from key to
+    value, keys it has no value for get default. It is called with at most
+    max_batch_size keys at a time. A failing batch fails every key in it, and
+    those keys are fetched again by the next load.
+    """
+
+    def __init__(self, batch_load: Callable[[List[Hashable]], Dict[Hashable, Any]], default=None,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        self.batch_load = batch_load
+        self.default = default
+        self.max_batch_size = max_batch_size
+        self.batches = 0  # Calls of batch_load so far
+        self._cache = {}  # key -> Deferred
+        self._queue = []  # Keys of unresolved Deferreds, in order
+
+    def load(self, key) -> Deferred:
+        """A Deferred for key's value, fetched with the next dispatch()."""
+        deferred = self._cache.get(key)
+        if deferred is None:
+            deferred = self._cache[key] = Deferred(self, key)
+            self._queue.append(key)
+        return deferred
+
+    def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        """The values of keys, in order, fetched in as few batches as possible."""
+        deferreds = [self.load(key) for key in keys]
+        if any(not deferred.done for deferred in deferreds):
+            self.dispatch()
+        return [deferred.result() for deferred in deferreds]
+
+    def prime(self, key, value):
+        """Cache value for key, e.g. a row fetched by another query, unless it's loaded already."""
+        deferred = self._cache.get(key)
+        if deferred is None:
+            deferred = self._cache[key] = Deferred(self, key)
+        elif deferred.done:
+            return
+        else:
+            self._queue.remove(key)
+        deferred._resolve(value)
+
+    def clear(self, key=None):
+        """Forget the cached value of key, or of every key. Keys still queued stay queued."""
+        if key is None:
+            self._cache = {key: deferred for key, deferred in self._cache.items() if not deferred.done}
+        else:
+            deferred = self._cache.pop(key, None)
+            if deferred is not None and not deferred.done:
+                self._queue.remove(key)
+
+    def dispatch(self):
+        """Fetch every queued key, max_batch_size keys per call of batch_load."""
+        while self._queue:
+            keys, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            deferreds = [self._cache[key] for key in keys]
+            self.batches += 1
+            try:
+                values = self.batch_load([deferred.key for deferred in deferreds])
+            except Exception as error:
+                for deferred in deferreds:
+                    deferred._fail(error)
+                    self._cache.pop(deferred.key, None)
+                raise
+            for deferred in deferreds:
+                deferred._resolve(values.get(deferred.key, self.default))
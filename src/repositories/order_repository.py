@@ -0,0 +1,49 @@
+from src.database.query_executors import QueryBuilder
+from src.models.order import Order
+
+from .base import Repository
+from .loader import DataLoader, Deferred
+
+
+class OrderRepository(Repository):
+    """
+    Orders by order_id, and the orders of customers.
+
+    Example:
+        orders = OrderRepository(pool)
+        by_customer = orders.for_customers(["ALFKI", "ANATR"])  # One query, {customer_id: [Order, ...]}
+    """
+
+    table = "orders"
+    key = "order_id"
+    model = Order
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.by_customer = DataLoader(self._fetch_for_customers)
+
+    def load_for_customer(self, customer_id) -> Deferred:
+        """The orders of a customer, fetched together with those of every other customer asked for."""
+        return self.by_customer.load(customer_id)
+
+    def for_customer(self, customer_id):
+        """The orders of a customer, oldest first."""
+        return self.by_customer.load(customer_id).result()
+
+    def for_customers(self, customer_ids):
+        """The orders of each customer, {customer_id: [Order, ...]}, in one query."""
+        customer_ids = list(customer_ids)
+        return dict(zip(customer_ids, self.by_customer.load_many(customer_ids)))
+
+    def _fetch_for_customers(self, customer_ids):
+        rows = (QueryBuilder()
+                .select(*self.columns())
+                .from_table(self.table)
+                .where("customer_id = ANY(%s)", [list(customer_ids)])
+                .order_by("order_date", "order_id")
+                .execute(self.source)
+                .fetch_all())
+        orders = [self._instance(row) for row in rows]
+        for order in orders:
+            self.by_id.prime(order.order_id, order)
+        return self._group(customer_ids, orders, lambda order: order.customer_id)
@@ -0,0 +1,53 @@
+from src.database.query_executors import QueryBuilder
+from src.models.product import Product
+
+from .base import Repository
+from .loader import DataLoader, Deferred
+
+
+class ProductRepository(Repository):
+    """
+    Products by product_id, and the products of orders (through order_details).
+
+    Example:
+        products = ProductRepository(pool)
+        by_order = products.for_orders([10248, 10249])  # One query, {order_id: [Product, ...]}
+    """
+
+    table = "products"
+    key = "product_id"
+    model = Product
+
+    def __init__(self, source):
+        super().__init__(source)
+        self.by_order = DataLoader(self._fetch_for_orders)
+
+    def load_for_order(self, order_id) -> Deferred:
+        """The products of an order, fetched together with those of every other order asked for."""
+        return self.by_order.load(order_id)
+
+    def for_order(self, order_id):
+        """The products of an order."""
+        return self.by_order.load(order_id).result()
+
+    def for_orders(self, order_ids):
+        """The products of each order, {order_id: [Product, ...]}, in one query."""
+        order_ids = list(order_ids)
+        return dict(zip(order_ids, self.by_order.load_many(order_ids)))
+
+    def _fetch_for_orders(self, order_ids):
+        rows = (QueryBuilder()
+                .select("od.order_id", *self.columns("p"))
+                .from_table("order_details od")
+                .inner_join("products p", "p.product_id = od.product_id")
+                .where("od.order_id = ANY(%s)", [list(order_ids)])
+                .order_by("od.order_id", "p.product_id")
+                .execute(self.source)
+                .fetch_all())
+        lines = []
+        for order_id, *product_row in rows:
+            # Products shared by several orders come back once per order, keep one instance of each
+            self.by_id.prime(product_row[0], self._instance(product_row))
+            lines.append((order_id, self.by_id.load(product_row[0]).result()))
+        groups = self._group(order_ids, lines, lambda line: line[0])
+        return {order_id: [product for _, product in group] for order_id, group in groups.items()}
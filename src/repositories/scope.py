@@ -0,0 +1,52 @@
+"""
+The repositories of one request.
+
+A RequestScope hands out one instance of each repository, so everything
+loaded during the request is shared between the code handling it and every
+row is fetched once. Make a new one for every request, its caches are never
+invalidated.
+
+Example:
+    scope = RequestScope(pool)
+    customer = scope.customers.get_by_id("ALFKI")
+    orders = scope.orders.for_customer(customer.customer_id)  # One query
+    products = scope.products.for_orders(order.order_id for order in orders)  # One query
+"""
+
+import functools
+
+from .customer_repository import CustomerRepository
+from .order_repository import OrderRepository
+from .product_repository import ProductRepository
+
+
+class RequestScope:
+    """Repositories sharing a source (a pool, router or connection) for the length of a request."""
+
+    def __init__(self, source):
+        self.source = source
+
+    @functools.cached_property
+    def customers(self) -> CustomerRepository:
+        return CustomerRepository(self.source)
+
+    @functools.cached_property
+    def orders(self) -> OrderRepository:
+        return OrderRepository(self.source)
+
+    @functools.cached_property
+    def products(self) -> ProductRepository:
+        return ProductRepository(self.source)
+
+    def customer_orders_with_products(self, customer_ids):
+        """
+        Customers with their orders and each order's products, in three
+        queries however many customers and orders there are:
+        {customer_id: (Customer, [(Order, [Product, ...]), ...])}.
+        """
+        customer_ids = list(customer_ids)
+        customers = self.customers.get_by_ids(customer_ids)
+        orders = self.orders.for_customers(customer_ids)
+        products = self.products.for_orders(order.order_id for group in orders.values() for order in group)
+        return {customer_id: (customer, [(order, products[order.order_id]) for order in orders[customer_id]])
+                for customer_id, customer in zip(customer_ids, customers)}
@@ -0,0 +1,142 @@
+"""
+Logging that stays off the request thread.
+
+The library itself never configures logging, applications call
+configure_logging() once at startup. It puts a QueueHandler on the root
+logger: a log call only appends the record to a queue, and a QueueListener
+thread formats it and does the file or console I/O. Unlike the standard
+QueueHandler, records are queued as they are, so their message is formatted
+on the listener thread too. The listener runs in the same process, the
+arguments of a record are only formatted once it gets there.
+
+Messages logged on every checkout or query go through a RateLimitFilter,
+which lets burst records per message through and then rate records per
+second, counting the rest. The next record that passes carries that count in
+its suppressed attribute.
+
+Example:
+    listener = configure_logging(level="INFO", filename="app.log")
+    ...
+    listener.stop()  # Also done at exit
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has, anything else was passed through extra=
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed through extra= as keys of their own."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves formatting to the listener, for a listener thread in the same process."""
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message template: burst records at once, then rate per second.
+
+    Dropped records are counted, and the next record of the same message that
+    passes gets the count as its suppressed attribute.
+    """
+
+    def __init__(self, rate=1.0, burst=10, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._buckets = {}  # (logger name, message template) -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+def configure_logging(level=logging.INFO, filename=None, structured=True, handlers=None):
+    """
+    Send every record through a queue to a listener thread that formats and writes it.
+
+    Args:
+        level: Level of the root logger.
+        filename: File to append to, stderr if None.
+        structured: Write JSON lines (JsonFormatter) instead of plain text.
+        handlers: Handlers to write to instead of the file or stderr.
+
+    Returns the started QueueListener. Calling configure_logging() again
+    replaces it.
+    """
+    global _listener
+    stop_logging()
+    if handlers is None:
+        handlers = [logging.FileHandler(filename, encoding="utf-8") if filename else logging.StreamHandler()]
+        formatter = JsonFormatter() if structured else logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s %(message)s")
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [handler for handler in root.handlers if not isinstance(handler, DeferredQueueHandler)]
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener thread of configure_logging()."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -7,9 +7,6 @@ with PostgreSQLConnectionPool() as pool:
         query = QueryBuilder().select("table_name").from_table("information_schema.tables").where("table_schema = 'public'")
         #query = QueryBuilder().select("name", "email").from_table("users").where("active = %s", [True])
         
-        tables = pl.read_database(
-            query=str(query),
-            connection=conn
-        )
+        tables = query.to_polars(conn)
         print("Available tables:")
         print(tables)
@@ -1 +1,156 @@
-# pytest shared test configurations and fixtures
\ No newline at end of file
+# pytest shared test configurations and fixtures
+import itertools
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+
+
+class FakeCursor:
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.itersize = 2000
+        self.rowcount = -1
+        self.closed = False
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def execute(self, query, params=None):
+        if self.connection.unreachable:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.connection.executed.append((query, params))
+        if self.connection.errors:
+            raise self.connection.errors.pop(0)
+        self._result = list(self.connection.results.pop(0) if self.connection.results else [(1,)])
+        self.rowcount = len(self._result)
+
+    @property
+    def description(self):
+        return self.connection.description
+
+    def mogrify(self, query, params=None):
+        quoted = [psycopg2.extensions.adapt(value).getquoted().decode() for value in params]
+        return (query % tuple(quoted)).encode()
+
+    def copy_expert(self, sql, file, size=8192):
+        if self.connection.errors:
+            raise self.connection.errors.pop(0)
+        if "TO STDOUT" in sql:
+            self.connection.executed.append((sql, None))
+            data = self.connection.copy_out
+            for start in range(0, len(data), size):
+                file.write(data[start:start + size])
+            return
+        chunks = []
+        while True:
+            chunk = file.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.connection.copied.append((sql, b"".join(chunks), max(map(len, chunks), default=0)))
+
+    def fetchone(self):
+        return self._result.pop(0) if self._result else None
+
+    def fetchmany(self, size):
+        rows, self._result = self._result[:size], self._result[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._result = self._result, []
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """Stand-in for a psycopg2 connection that never talks to a server.
+
+    Every executed query is recorded in executed. Queries return the next
+    entry of results, or a single (1,) row when there is none queued, unless
+    an exception is queued in errors, then that is raised instead.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self._ids)
+        self.closed = 0
+        self.unreachable = False
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.autocommit = False
+        self.executed = []
+        self.copied = []  # (sql, data, largest read) per COPY FROM STDIN
+        self.copy_out = b""  # Data written by COPY ... TO STDOUT
+        self.description = None
+        self.encoding = "UTF8"
+        self.cancelled = False
+        self.results = []
+        self.errors = []
+        self.cursors = []
+        self.transactions = []  # "commit" or "rollback", in order
+
+    def cursor(self, name=None, **kwargs):
+        cursor = FakeCursor(self, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def cancel(self):
+        self.cancelled = True
+
+    def commit(self):
+        self.transactions.append("commit")
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.transactions.append("rollback")
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.transaction_status
+
+    def isexecuting(self):
+        return False
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connection_factory():
+    """A connection factory that records every FakeConnection it creates."""
+    created = []
+
+    def factory():
+        connection = FakeConnection()
+        created.append(connection)
+        return connection
+
+    factory.created = created
+    return factory
+
+
+@pytest.fixture
+def make_postgres_error():
+    """Build psycopg2 exceptions carrying a SQLSTATE, as if raised by the server."""
+    def make(sqlstate, message="error raised by the fake server"):
+        error_class = psycopg2.errors.lookup(sqlstate)
+        return type(error_class.__name__, (error_class,), {"pgcode": sqlstate})(message)
+
+    return make
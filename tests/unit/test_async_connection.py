@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+from src.database.async_connection import AsyncConnectionPool, AsyncPooledDatabaseConnection
+from src.database.exceptions import ConfigurationError, PoolTimeoutError
+
+
+@pytest.fixture
+def async_connection_factory(connection_factory):
+    async def factory():
+        return connection_factory()
+
+    factory.created = connection_factory.created
+    return factory
+
+
+class TestAsyncConnectionPool:
+
+    @pytest.mark.unit
+    def test_open_creates_min_connections(self, async_connection_factory):
+        async def scenario():
+            pool = await AsyncConnectionPool(2, 4, async_connection_factory).open()
+            return pool.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert stats.idle == 2
+        assert len(async_connection_factory.created) == 2
+
+    @pytest.mark.unit
+    def test_warm_connection_is_reused_first(self, async_connection_factory):
+        async def scenario():
+            pool = AsyncConnectionPool(0, 2, async_connection_factory)
+            first, second = await pool.getconn(), await pool.getconn()
+            pool.putconn(first)
+            pool.putconn(second)
+            return second, await pool.getconn()
+
+        returned_last, checked_out = asyncio.run(scenario())
+
+        assert checked_out is returned_last
+
+    @pytest.mark.unit
+    def test_exhausted_pool_times_out(self, async_connection_factory):
+        async def scenario():
+            pool = AsyncConnectionPool(0, 1, async_connection_factory)
+            await pool.getconn()
+            await pool.getconn(timeout=0.01)
+
+        with pytest.raises(PoolTimeoutError):
+            asyncio.run(scenario())
+
+    @pytest.mark.unit
+    def test_many_coroutines_share_a_small_pool_in_order(self, async_connection_factory):
+        order = []
+
+        async def worker(pool, number):
+            async with AsyncPooledDatabaseConnection(pool):
+                order.append(number)
+                await asyncio.sleep(0)
+
+        async def scenario():
+            pool = AsyncConnectionPool(0, 3, async_connection_factory)
+            await asyncio.gather(*(worker(pool, number) for number in range(1000)))
+            return pool.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert order == list(range(1000))
+        assert len(async_connection_factory.created) == 3
+        assert stats.checkouts == 1000
+        assert stats.in_use == 0
+
+    @pytest.mark.unit
+    def test_cancelled_waiter_does_not_lose_connection(self, async_connection_factory):
+        async def scenario():
+            pool = AsyncConnectionPool(0, 1, async_connection_factory)
+            connection = await pool.getconn()
+            waiting = asyncio.ensure_future(pool.getconn(timeout=5))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            pool.putconn(connection)
+            return pool, await pool.getconn(timeout=0.1)
+
+        pool, connection = asyncio.run(scenario())
+
+        assert connection is async_connection_factory.created[0]
+        assert pool.stats().size == 1
+
+    @pytest.mark.unit
+    def test_closeall_wakes_waiters(self, async_connection_factory):
+        async def scenario():
+            pool = AsyncConnectionPool(0, 1, async_connection_factory)
+            await pool.getconn()
+            waiting = asyncio.ensure_future(pool.getconn(timeout=5))
+            await asyncio.sleep(0)
+            await pool.closeall()
+            await waiting
+
+        with pytest.raises(ConfigurationError, match="closed"):
+            asyncio.run(scenario())
+
+    @pytest.mark.unit
+    def test_connections_idle_too_long_are_closed_down_to_min(self, async_connection_factory):
+        async def scenario():
+            pool = AsyncConnectionPool(1, 3, async_connection_factory, max_idle_time=0.01)
+            first, second, third = await pool.getconn(), await pool.getconn(), await pool.getconn()
+            pool.putconn(first)
+            pool.putconn(second)
+            await asyncio.sleep(0.02)
+            pool.putconn(third)
+            return pool.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert (stats.size, stats.idle) == (1, 1)
+        assert [connection.closed for connection in async_connection_factory.created] == [True, True, False]
+
+    @pytest.mark.unit
+    def test_dead_connection_is_replaced(self, async_connection_factory):
+        async def scenario():
+            pool = await AsyncConnectionPool(1, 2, async_connection_factory).open()
+            async_connection_factory.created[0].close()
+            async with AsyncPooledDatabaseConnection(pool) as connection:
+                return connection
+
+        connection = asyncio.run(scenario())
+
+        assert connection is async_connection_factory.created[1]
+
+    @pytest.mark.unit
+    def test_failed_ping_does_not_lose_connection(self, async_connection_factory, monkeypatch):
+        async def interrupted_ping(self, connection):
+            raise asyncio.CancelledError
+
+        monkeypatch.setattr(AsyncPooledDatabaseConnection, "is_connection_alive", interrupted_ping)
+
+        async def scenario():
+            pool = await AsyncConnectionPool(1, 1, async_connection_factory).open()
+            with pytest.raises(asyncio.CancelledError):
+                async with AsyncPooledDatabaseConnection(pool):
+                    pass
+            return pool.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert stats.in_use == 0
+        assert stats.size == 0
+        assert async_connection_factory.created[0].closed
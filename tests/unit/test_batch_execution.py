@@ -0,0 +1,241 @@
+import json
+from datetime import date
+from decimal import Decimal
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from src.database.batch import execute_batch, statement_of
+from src.database.connection import PooledDatabaseConnection
+from src.database.exceptions import DatabaseError
+from src.database.pool import ConnectionPool
+from src.database.query_executors import QueryBuilder
+from src.database.validation import PassiveValidate
+from tests.conftest import FakeConnection, FakeCursor
+
+INTEGER, TEXT, NUMERIC, DATE = 23, 25, 1700, 1082
+
+CATEGORIES = ([("category_id", INTEGER), ("name", TEXT)], [(1, "Beverages"), (2, "Condiments")])
+SHIPPERS = ([("shipper_id", INTEGER), ("company_name", TEXT)], [(1, "Speedy Express")])
+# SELECT o.id, d.id, d.unit_price, o.order_date FROM orders o JOIN order_details d ...
+ORDER_LINES = ([("id", INTEGER), ("id", INTEGER), ("unit_price", NUMERIC), ("order_date", DATE)],
+               [(10248, 1, Decimal("14.00"), date(1996, 7, 4)), (10248, 2, Decimal("9.80"), date(1996, 7, 4))])
+
+
+def json_value(value):
+    """A value the way json_agg renders it."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return json.dumps(value.isoformat())
+    return json.dumps(value)
+
+
+def json_agg(columns, rows):
+    """json_agg output, with duplicate column names as duplicate keys like row_to_json writes them."""
+    objects = ("{" + ", ".join(f"{json.dumps(name)}: {json_value(value)}" for (name, _), value in zip(columns, row))
+               + "}" for row in rows)
+    return "[" + ", ".join(objects) + "]"
+
+
+class ScriptedCursor(FakeCursor):
+    """Answers queries from connection.tables, failing the ones reading connection.broken tables."""
+
+    def __init__(self, connection, name=None):
+        super().__init__(connection, name)
+        self._description = None
+
+    @property
+    def description(self):
+        return self._description
+
+    def execute(self, query, params=None):
+        self.connection.executed.append((query, params))
+        if any(f"FROM {table}" in query for table in self.connection.broken):
+            raise self.connection.broken_error
+        if "SELECT" not in query:
+            self._result = []
+            return
+        read = sorted((table for table in self.connection.tables if f"FROM {table}" in query), key=query.index)
+        if "json_agg" not in query:
+            [table] = read
+            columns, self._result = self.connection.tables[table][0], list(self.connection.tables[table][1])
+            self._description = [(name, type_code) for name, type_code in columns]
+            return
+        self._result = [tuple(json_agg(*self.connection.tables[table]) for table in read)]
+        self._description = [(f"result_{index}", TEXT) for index in range(1, len(read) + 1)]
+        for index, table in enumerate(read, 1):
+            self._description.append((f"qb_batch_columns_{index}", TEXT))
+            self._description += self.connection.tables[table][0]
+
+
+class ScriptedConnection(FakeConnection):
+
+    def __init__(self, tables, broken=(), broken_error=None):
+        super().__init__()
+        self.tables = tables
+        self.broken = broken
+        self.broken_error = broken_error
+
+    def cursor(self, name=None, **kwargs):
+        return ScriptedCursor(self, name)
+
+    def mogrify(self, query, params):
+        return FakeCursor(self).mogrify(query, params)
+
+
+def categories_query():
+    return QueryBuilder().select("*").from_table("categories")
+
+
+def shippers_query():
+    return QueryBuilder().select("*").from_table("shippers").where("shipper_id = %s", 1)
+
+
+@pytest.fixture
+def connection():
+    return ScriptedConnection({"categories": CATEGORIES, "shippers": SHIPPERS})
+
+
+class TestStatements:
+
+    @pytest.mark.unit
+    def test_statement_of(self):
+        assert statement_of("SELECT 1") == ("SELECT 1", None)
+        assert statement_of(("SELECT %s", [1])) == ("SELECT %s", [1])
+        assert statement_of(shippers_query()) == ("SELECT *\nFROM shippers\nWHERE shipper_id = %s", [1])
+
+
+class TestExecuteBatch:
+
+    @pytest.mark.unit
+    def test_queries_share_one_round_trip(self, connection):
+        results = execute_batch(connection, [categories_query(), shippers_query()])
+
+        assert results == [[(1, "Beverages"), (2, "Condiments")], [(1, "Speedy Express")]]
+        assert len(connection.executed) == 1
+        sql, params = connection.executed[0]
+        assert "(SELECT coalesce(json_agg(batch_row), '[]') FROM (SELECT *\nFROM categories) AS batch_row)::text AS result_1" in sql
+        assert "WHERE shipper_id = 1) AS batch_row)::text AS result_2" in sql
+        assert "LEFT JOIN (SELECT * FROM (SELECT *\nFROM categories) AS batch_row LIMIT 0) AS qb_batch_columns_1 ON true" in sql
+        assert params is None
+
+    @pytest.mark.unit
+    def test_rows_equal_those_of_execute(self):
+        connection = ScriptedConnection({"order_lines": ORDER_LINES, "categories": CATEGORIES})
+        order_lines = QueryBuilder().select("*").from_table("order_lines")
+
+        lines, categories = execute_batch(connection, [order_lines, categories_query()])
+
+        assert lines == order_lines.execute(connection).fetch_all() == ORDER_LINES[1]
+        assert isinstance(lines[0][2], Decimal) and isinstance(lines[0][3], date)
+        assert categories == CATEGORIES[1]
+
+    @pytest.mark.unit
+    def test_empty_batch(self, connection):
+        assert execute_batch(connection, []) == []
+        assert connection.executed == []
+
+    @pytest.mark.unit
+    def test_open_transaction_is_protected_by_savepoint(self, connection):
+        connection.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        execute_batch(connection, [categories_query()])
+
+        assert connection.executed[0][0].startswith("SAVEPOINT qb_batch_all; SELECT")
+
+    @pytest.mark.unit
+    def test_failure_falls_back_to_one_by_one(self, make_postgres_error):
+        error = make_postgres_error("42P01", 'relation "shippers" does not exist')
+        connection = ScriptedConnection({"categories": CATEGORIES}, broken=("shippers",), broken_error=error)
+        recorded = []
+
+        results = execute_batch(connection, [categories_query(), shippers_query()], recorded.append)
+
+        assert results[0] == [(1, "Beverages"), (2, "Condiments")]
+        assert isinstance(results[1], DatabaseError)
+        assert results[1].details["query"].startswith("SELECT *\nFROM shippers")
+        assert recorded == [error]
+        assert connection.transactions == ["rollback"]
+        assert ("ROLLBACK TO SAVEPOINT qb_batch", None) in connection.executed
+
+    @pytest.mark.unit
+    def test_autocommit_needs_no_savepoints(self, make_postgres_error):
+        connection = ScriptedConnection({"categories": CATEGORIES}, broken=("shippers",),
+                                        broken_error=make_postgres_error("42P01"))
+        connection.autocommit = True
+
+        execute_batch(connection, [categories_query(), shippers_query()])
+
+        assert not any("SAVEPOINT" in sql for sql, _ in connection.executed)
+        assert connection.transactions == []
+
+
+class PipelineConnection(FakeConnection):
+    """Stand-in for a psycopg 3 connection."""
+
+    def __init__(self):
+        super().__init__()
+        self.pipelines = 0
+
+    class _Pipeline:
+        def __init__(self, connection):
+            self.connection = connection
+
+        def __enter__(self):
+            self.connection.pipelines += 1
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            return False
+
+    def pipeline(self):
+        return self._Pipeline(self)
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+
+class TestPipelineMode:
+
+    @pytest.mark.unit
+    def test_psycopg3_connections_use_pipeline(self, monkeypatch):
+        pytest.importorskip("psycopg")
+        connection = PipelineConnection()
+        connection.results += [[(1, "Beverages")], [(1, "Speedy Express")]]
+
+        results = execute_batch(connection, [categories_query(), shippers_query()])
+
+        assert connection.pipelines == 1
+        assert results == [[(1, "Beverages")], [(1, "Speedy Express")]]
+
+
+class TestPooledBatch:
+
+    @pytest.mark.unit
+    def test_batch_checks_out_connection(self):
+        connections = []
+
+        def factory():
+            connections.append(ScriptedConnection({"categories": CATEGORIES, "shippers": SHIPPERS}))
+            return connections[-1]
+
+        pool = ConnectionPool(1, 1, factory, validation_policy=PassiveValidate())
+        categories, shippers = PooledDatabaseConnection(pool).batch([categories_query(), shippers_query()])
+
+        assert categories == [(1, "Beverages"), (2, "Condiments")]
+        assert pool.in_use_count == 0
+        assert connections[0].transactions == ["commit"]
+
+    @pytest.mark.unit
+    def test_batch_inside_with_block_uses_checked_out_connection(self, make_postgres_error):
+        error = make_postgres_error("42P01")
+        pool = ConnectionPool(1, 1, lambda: ScriptedConnection({}, broken=("shippers",), broken_error=error),
+                              validation_policy=PassiveValidate())
+        pooled = PooledDatabaseConnection(pool)
+
+        with pooled:
+            results = pooled.batch([shippers_query()])
+            assert pool.in_use_count == 1
+
+        assert isinstance(results[0], DatabaseError)
+        assert pool.stats().errors == {"42": 1}
@@ -0,0 +1,180 @@
+import struct
+import uuid
+from datetime import date, datetime, timezone
+
+import psycopg2.extensions
+import pytest
+
+from src.database.bulk import CopyStream, binary_row_encoder, bulk_insert, encode_text_row, text_value
+from src.database.exceptions import DatabaseError
+from src.database.pool import ConnectionPool
+from src.database.validation import PassiveValidate
+
+
+def customers(count):
+    return ({"id": index, "name": f"customer {index}"} for index in range(count))
+
+
+class TestTextFormat:
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("value, expected", [
+        (None, "\\N"),
+        (True, "t"),
+        (False, "f"),
+        (42, "42"),
+        ("tab\there", "tab\\there"),
+        ("line\nbreak\r", "line\\nbreak\\r"),
+        ("back\\slash", "back\\\\slash"),
+        (b"\x00\xff", "\\\\x00ff"),
+        (date(2024, 2, 29), "2024-02-29"),
+        ({"a": 1}, '{"a": 1}'),
+        ([1, None, 3], '{"1",NULL,"3"}'),
+        (["a b", 'say "hi"', "back\\slash"], '{"a b","say \\\\"hi\\\\"","back\\\\\\\\slash"}'),
+        ([[1, 2], [3, 4]], '{{"1","2"},{"3","4"}}'),
+        ([], "{}"),
+    ])
+    def test_text_value(self, value, expected):
+        assert text_value(value) == expected
+
+    @pytest.mark.unit
+    def test_encode_text_row(self):
+        assert encode_text_row((1, None, "x")) == b"1\t\\N\tx\n"
+
+
+class TestBinaryFormat:
+
+    @pytest.mark.unit
+    def test_encodes_fields_with_lengths(self):
+        encode = binary_row_encoder(["integer", "text", "boolean"])
+
+        assert encode((7, "ab", None)) == (struct.pack(">h", 3) + struct.pack(">i", 4) + struct.pack(">i", 7)
+                                           + struct.pack(">i", 2) + b"ab" + b"\xff\xff\xff\xff")
+
+    @pytest.mark.unit
+    def test_dates_and_timestamps_count_from_2000(self):
+        encode = binary_row_encoder(["date", "timestamp with time zone"])
+        row = encode((date(2000, 1, 2), datetime(2000, 1, 1, 0, 0, 1, tzinfo=timezone.utc)))
+
+        assert row[6:10] == struct.pack(">i", 1)
+        assert row[14:] == struct.pack(">q", 1_000_000)
+
+    @pytest.mark.unit
+    def test_uuid(self):
+        value = uuid.uuid4()
+        assert binary_row_encoder(["uuid"])((str(value),))[6:] == value.bytes
+
+    @pytest.mark.unit
+    def test_unsupported_type_raises_error(self):
+        with pytest.raises(ValueError, match="numeric"):
+            binary_row_encoder(["integer", "numeric"])
+
+
+class TestCopyStream:
+
+    @pytest.mark.unit
+    def test_encodes_rows_only_as_needed(self):
+        encoded = []
+
+        def encode(row):
+            encoded.append(row)
+            return b"x" * 10
+
+        stream = CopyStream(range(100), encode)
+        assert stream.read(25) == b"x" * 25
+        assert len(encoded) == 3
+        assert len(stream.read(1000)) == 975
+        assert stream.read(1000) == b""
+        assert stream.rows == 100
+
+    @pytest.mark.unit
+    def test_header_and_trailer(self):
+        stream = CopyStream([1], lambda row: b"row", header=b"H", trailer=b"T")
+        assert stream.read() == b"HrowT"
+
+
+class TestBulkInsert:
+
+    @pytest.mark.unit
+    def test_small_load_uses_multi_row_values(self, connection_factory):
+        connection = connection_factory()
+
+        assert bulk_insert(connection, "customers", customers(5), page_size=2) == 5
+        assert [sql for sql, _ in connection.executed] == [
+            "INSERT INTO customers (id, name) VALUES (%s, %s), (%s, %s)",
+            "INSERT INTO customers (id, name) VALUES (%s, %s), (%s, %s)",
+            "INSERT INTO customers (id, name) VALUES (%s, %s)",
+        ]
+        assert connection.executed[2][1] == [4, "customer 4"]
+        assert connection.copied == []
+
+    @pytest.mark.unit
+    def test_large_load_uses_copy_in_chunks(self, connection_factory):
+        connection = connection_factory()
+
+        assert bulk_insert(connection, "customers", customers(25), copy_threshold=10, chunk_size=10) == 25
+        assert [sql for sql, _, _ in connection.copied] == ["COPY customers (id, name) FROM STDIN"] * 3
+        assert connection.copied[2][1] == b"".join(b"%d\tcustomer %d\n" % (index, index) for index in range(20, 25))
+
+    @pytest.mark.unit
+    def test_array_columns_are_arrays_on_both_sides_of_the_threshold(self, connection_factory):
+        connection = connection_factory()
+        rows = [{"id": 1, "tags": ["new", "vip"]}, {"id": 2, "tags": [7, None]}]
+
+        bulk_insert(connection, "customers", rows, copy_threshold=3)
+        bulk_insert(connection, "customers", rows * 2, copy_threshold=3)
+
+        values = connection.executed[0][1]
+        assert psycopg2.extensions.adapt(values[1]).getquoted() == b"ARRAY['new','vip']"
+        assert connection.copied[0][1].splitlines()[:2] == [b'1\t{"new","vip"}', b'2\t{"7",NULL}']
+
+    @pytest.mark.unit
+    def test_copy_reads_are_bounded_by_buffer_size(self, connection_factory):
+        connection = connection_factory()
+
+        bulk_insert(connection, "customers", customers(1000), method="copy", max_buffer_bytes=256)
+        assert connection.copied[0][2] == 256
+
+    @pytest.mark.unit
+    def test_binary_copy_looks_up_column_types(self, connection_factory):
+        connection = connection_factory()
+        connection.results.append([("id", "integer"), ("name", "text"), ("email", "text")])
+
+        bulk_insert(connection, "customers", [(1, "Alfreds")], columns=["id", "name"],
+                    method="copy", copy_format="binary")
+
+        sql, data, _ = connection.copied[0]
+        assert sql == "COPY customers (id, name) FROM STDIN WITH (FORMAT binary)"
+        assert data.startswith(b"PGCOPY\n\xff\r\n\x00") and data.endswith(b"\xff\xff")
+
+    @pytest.mark.unit
+    def test_sequence_rows_need_columns(self, connection_factory):
+        with pytest.raises(ValueError, match="columns must be given"):
+            bulk_insert(connection_factory(), "customers", [(1, "Alfreds")])
+
+    @pytest.mark.unit
+    def test_empty_load_does_nothing(self, connection_factory):
+        connection = connection_factory()
+
+        assert bulk_insert(connection, "customers", []) == 0
+        assert connection.executed == []
+
+    @pytest.mark.unit
+    def test_pool_load_is_committed(self, connection_factory):
+        pool = ConnectionPool(1, 1, connection_factory, validation_policy=PassiveValidate())
+
+        bulk_insert(pool, "customers", customers(3))
+
+        assert connection_factory.created[0].transactions == ["commit"]
+        assert pool.in_use_count == 0
+
+    @pytest.mark.unit
+    def test_failed_pool_load_is_rolled_back(self, connection_factory, make_postgres_error):
+        pool = ConnectionPool(1, 1, connection_factory, validation_policy=PassiveValidate())
+        connection_factory.created[0].errors.append(make_postgres_error("23505"))
+
+        with pytest.raises(DatabaseError):
+            bulk_insert(pool, "customers", customers(3))
+
+        assert connection_factory.created[0].transactions == ["rollback"]
+        assert pool.in_use_count == 0
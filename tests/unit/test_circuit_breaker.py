@@ -0,0 +1,282 @@
+import random
+import time
+
+import psycopg2
+import pytest
+
+from src.database.circuit_breaker import (CLOSED, HALF_OPEN, OPEN, AdaptiveConcurrencyLimiter, CircuitBreaker,
+                                          is_failure)
+from src.database.connection import PooledDatabaseConnection
+from src.database.exceptions import (AdminInterventionError, CircuitOpenError, ConcurrencyLimitError,
+                                     ConnectionError, DatabaseError, OutOfResourcesError, PoolTimeoutError,
+                                     SQLSyntaxError)
+from src.database.pool import ConnectionPool
+from src.database.validation import PassiveValidate
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def mapped_connect_error():
+    try:
+        raise DatabaseError("could not connect to server") from psycopg2.OperationalError("could not connect")
+    except DatabaseError as error:
+        return error
+
+
+class TestIsFailure:
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("error", [OutOfResourcesError("full"), PoolTimeoutError("timed out"),
+                                       ConnectionError("lost"), AdminInterventionError("shutdown"),
+                                       psycopg2.OperationalError("server closed the connection")])
+    def test_unhealthy_database(self, error):
+        assert is_failure(error)
+
+    @pytest.mark.unit
+    def test_connect_errors_without_sqlstate(self):
+        assert is_failure(mapped_connect_error())
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("error", [None, SQLSyntaxError("bad sql"), DatabaseError("other"), ValueError()])
+    def test_query_errors(self, error):
+        assert not is_failure(error)
+
+
+class TestCircuitBreaker:
+
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def breaker(self, clock):
+        return CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=clock)
+
+    def fail(self, breaker, times=1):
+        for _ in range(times):
+            breaker.allow()
+            breaker.record(ConnectionError("lost"))
+
+    @pytest.mark.unit
+    def test_opens_after_consecutive_failures(self, breaker):
+        self.fail(breaker, 2)
+        breaker.allow()
+        breaker.record(None)
+        self.fail(breaker, 2)
+        assert breaker.state == CLOSED
+
+        self.fail(breaker)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError) as error:
+            breaker.allow()
+        assert error.value.details["retry_after"] == 10.0
+        assert breaker.rejected == 1 and breaker.times_opened == 1
+
+    @pytest.mark.unit
+    def test_query_errors_keep_it_closed(self, breaker):
+        for _ in range(10):
+            breaker.allow()
+            breaker.record(SQLSyntaxError("bad sql"))
+        assert breaker.state == CLOSED
+
+    @pytest.mark.unit
+    def test_half_open_probe_closes_it(self, breaker, clock):
+        self.fail(breaker, 3)
+        clock.now = 10.0
+        assert breaker.state == HALF_OPEN
+
+        breaker.allow()
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()  # Only one probe at a time
+        breaker.record(None)
+
+        assert breaker.state == CLOSED
+        breaker.allow()
+
+    @pytest.mark.unit
+    def test_failed_probe_opens_it_again(self, breaker, clock):
+        self.fail(breaker, 3)
+        clock.now = 10.0
+        self.fail(breaker)
+
+        assert breaker.state == OPEN
+        clock.now = 19.0
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()
+        assert breaker.times_opened == 2
+
+
+class TestAdaptiveConcurrencyLimiter:
+
+    @pytest.mark.unit
+    def test_sheds_calls_over_the_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        limiter.acquire()
+        limiter.acquire()
+
+        with pytest.raises(ConcurrencyLimitError):
+            limiter.acquire()
+        limiter.release()
+        limiter.acquire()
+        assert limiter.rejected == 1 and limiter.in_flight == 2
+
+    @pytest.mark.unit
+    def test_slow_calls_lower_the_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, min_limit=2, backoff=0.5)
+        limiter.acquire()
+        limiter.release(0.01)
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(0.5)
+
+        assert limiter.limit == 2
+
+    @pytest.mark.unit
+    def test_failures_lower_the_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, backoff=0.5)
+        limiter.acquire()
+        limiter.release(None, failed=True)
+        assert limiter.limit == 5
+
+    @pytest.mark.unit
+    def test_fast_calls_grow_a_used_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+        limiter.acquire()
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(0.01)
+        assert limiter.limit == 3
+
+    @pytest.mark.unit
+    def test_idle_limit_does_not_grow(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=10)
+        for _ in range(10):
+            limiter.acquire()
+            limiter.release(0.01)
+        assert limiter.limit == 4
+
+    @pytest.mark.unit
+    def test_slower_waits_than_the_baseline_lower_the_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=20, max_limit=20)
+        for _ in range(200):
+            limiter.acquire()
+            limiter.release(0.001)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(0.02)
+
+        assert limiter.limit < 10
+
+    @pytest.mark.unit
+    def test_healthy_workload_keeps_its_limit(self):
+        waits = random.Random(17)
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=20, max_limit=20)
+        for call in range(5000):
+            limiter.acquire()
+            # Mostly idle connections, sometimes a validation ping, now and then a new connection
+            wait = 0.03 if call % 500 == 499 else waits.choice([waits.uniform(0.00001, 0.0002),
+                                                                 waits.uniform(0.0005, 0.002)])
+            limiter.release(wait)
+
+        assert limiter.limit >= 19
+        for _ in range(4):
+            limiter.acquire()
+
+    @pytest.mark.unit
+    def test_lowered_limit_recovers_while_idle(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, max_limit=20, backoff=0.5)
+        limiter.acquire()
+        limiter.release(None, failed=True)
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release(0.001)
+
+        assert limiter.limit == 10
+
+    @pytest.mark.unit
+    def test_invalid_limits(self):
+        with pytest.raises(ValueError):
+            AdaptiveConcurrencyLimiter(initial_limit=20, max_limit=10)
+
+
+class TestGuardedCheckout:
+
+    def make_pool(self, connection_factory, clock, **kwargs):
+        return ConnectionPool(0, 1, connection_factory, timeout=0.01, validation_policy=PassiveValidate(),
+                              circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=5.0, clock=clock),
+                              **kwargs)
+
+    @pytest.mark.unit
+    def test_exhausted_pool_opens_the_circuit(self, connection_factory):
+        clock = FakeClock()
+        pool = self.make_pool(connection_factory, clock)
+        held = pool.getconn()
+
+        for _ in range(2):
+            with pytest.raises(PoolTimeoutError):
+                with PooledDatabaseConnection(pool):
+                    pass
+        with pytest.raises(CircuitOpenError):
+            with PooledDatabaseConnection(pool):
+                pass
+        assert pool.metrics.timeouts == 2  # The third checkout never reached the pool
+
+        pool.putconn(held)
+        clock.now = 5.0
+        with PooledDatabaseConnection(pool):
+            pass
+        assert pool.circuit_breaker.state == CLOSED
+
+    @pytest.mark.unit
+    def test_errors_inside_the_block_count(self, connection_factory, make_postgres_error):
+        pool = self.make_pool(connection_factory, FakeClock())
+
+        for _ in range(2):
+            with pytest.raises(psycopg2.Error):
+                with PooledDatabaseConnection(pool):
+                    raise make_postgres_error("57P01", "terminating connection due to administrator command")
+
+        assert pool.circuit_breaker.state == OPEN
+        assert pool.idle_count == 1
+
+    @pytest.mark.unit
+    def test_limiter_sees_the_wait_for_a_connection_not_how_long_it_was_held(self, connection_factory):
+        latencies = []
+
+        class RecordingLimiter(AdaptiveConcurrencyLimiter):
+            def release(self, latency=None, failed=False):
+                latencies.append(latency)
+                super().release(latency, failed)
+
+        pool = self.make_pool(connection_factory, FakeClock(), concurrency_limiter=RecordingLimiter())
+        with PooledDatabaseConnection(pool):
+            time.sleep(0.05)
+
+        [latency] = latencies
+        assert 0 <= latency < 0.05
+
+    @pytest.mark.unit
+    def test_limiter_slots_are_released(self, connection_factory):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+        clock = FakeClock()
+        pool = self.make_pool(connection_factory, clock, concurrency_limiter=limiter)
+
+        with PooledDatabaseConnection(pool):
+            with pytest.raises(ConcurrencyLimitError):
+                with PooledDatabaseConnection(pool):
+                    pass
+        assert limiter.in_flight == 0
+
+        pool.circuit_breaker.record(ConnectionError("lost"))
+        pool.circuit_breaker.record(ConnectionError("lost"))
+        with pytest.raises(CircuitOpenError):
+            with PooledDatabaseConnection(pool):
+                pass
+        assert limiter.in_flight == 0
@@ -0,0 +1,137 @@
+from collections import namedtuple
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from src.database.pool import ConnectionPool
+from src.database.query_executors import QueryBuilder
+from src.database.validation import PassiveValidate
+
+pa = pytest.importorskip("pyarrow")
+
+Column = namedtuple("Column", "name type_code display_size internal_size precision scale null_ok")
+
+DESCRIPTION = [
+    Column("order_id", 23, None, 4, None, None, None),
+    Column("customer_id", 1042, None, -1, None, None, None),
+    Column("order_date", 1082, None, 4, None, None, None),
+    Column("shipped_at", 1184, None, 8, None, None, None),
+    Column("freight", 1700, None, -1, 10, 2, None),
+    Column("shipped", 16, None, 1, None, None, None),
+]
+
+CSV = (b"order_id,customer_id,order_date,shipped_at,freight,shipped\n"
+       b"10248,VINET,1996-07-04,1996-07-16 00:00:00+00,32.38,t\n"
+       b'10249,"",1996-07-05,,11.61,f\n')
+
+
+def orders_query():
+    return QueryBuilder().select("*").from_table("orders").where("employee_id = %s", 5)
+
+
+@pytest.fixture
+def connection(connection_factory):
+    connection = connection_factory()
+    connection.description = DESCRIPTION
+    connection.copy_out = CSV
+    return connection
+
+
+class TestToArrow:
+
+    @pytest.mark.unit
+    def test_types_come_from_the_query(self, connection):
+        table = orders_query().to_arrow(connection)
+
+        assert table.schema.types == [pa.int32(), pa.string(), pa.date32(), pa.timestamp("us", tz="UTC"),
+                                      pa.decimal128(10, 2), pa.bool_()]
+        assert table.to_pylist()[0] == {
+            "order_id": 10248, "customer_id": "VINET", "order_date": date(1996, 7, 4),
+            "shipped_at": datetime(1996, 7, 16, tzinfo=timezone.utc), "freight": Decimal("32.38"), "shipped": True}
+
+    @pytest.mark.unit
+    def test_unconstrained_numeric_keeps_its_digits(self, connection):
+        connection.description = [Column("ratio", 1700, None, -1, None, None, None)]
+        connection.copy_out = b"ratio\n0.1234567890123456789012345\nNaN\n"
+        table = QueryBuilder().select("ratio").from_table("stats").to_arrow(connection)
+
+        assert table.schema.types == [pa.string()]
+        assert table.column("ratio").to_pylist() == ["0.1234567890123456789012345", "NaN"]
+
+    @pytest.mark.unit
+    def test_null_and_empty_string_differ(self, connection):
+        row = orders_query().to_arrow(connection).to_pylist()[1]
+
+        assert row["customer_id"] == ""
+        assert row["shipped_at"] is None
+
+    @pytest.mark.unit
+    def test_parameters_are_quoted_into_copy(self, connection):
+        orders_query().to_arrow(connection)
+
+        schema_query, copy_query = (sql for sql, _ in connection.executed)
+        assert schema_query.startswith("SELECT * FROM (SELECT *\nFROM orders\nWHERE employee_id = %s) AS columnar_query")
+        assert copy_query == ("COPY (SELECT *\nFROM orders\nWHERE employee_id = 5) "
+                              "TO STDOUT WITH (FORMAT csv, HEADER true)")
+
+    @pytest.mark.unit
+    def test_empty_result_keeps_schema(self, connection):
+        connection.copy_out = CSV.split(b"\n")[0] + b"\n"
+        table = orders_query().to_arrow(connection)
+
+        assert table.num_rows == 0
+        assert table.schema.names == [column.name for column in DESCRIPTION]
+
+    @pytest.mark.unit
+    def test_stream_yields_batches(self, connection):
+        rows = b"".join(b"%d,C%d,1996-07-04,,1.00,t\n" % (index, index) for index in range(20_000))
+        connection.copy_out = CSV.split(b"\n")[0] + b"\n" + rows
+
+        batches = list(orders_query().stream_arrow(connection, block_size=64 * 1024))
+
+        assert len(batches) > 1
+        assert sum(batch.num_rows for batch in batches) == 20_000
+        assert {batch.schema for batch in batches} == {batches[0].schema}
+
+    @pytest.mark.unit
+    def test_closing_stream_early_cancels_copy(self, connection):
+        rows = b"".join(b"%d,C%d,1996-07-04,,1.00,t\n" % (index, index) for index in range(20_000))
+        connection.copy_out = CSV.split(b"\n")[0] + b"\n" + rows
+
+        stream = orders_query().stream_arrow(connection, block_size=64 * 1024)
+        next(stream)
+        stream.close()
+
+        assert connection.cancelled
+
+    @pytest.mark.unit
+    def test_pool_connection_is_released(self, connection_factory):
+        pool = ConnectionPool(1, 1, connection_factory, validation_policy=PassiveValidate())
+        connection_factory.created[0].description = DESCRIPTION
+        connection_factory.created[0].copy_out = CSV
+
+        orders_query().to_arrow(pool)
+
+        assert pool.in_use_count == 0
+        assert connection_factory.created[0].transactions == ["commit"]
+
+
+class TestToPolars:
+
+    @pytest.mark.unit
+    def test_to_polars(self, connection):
+        pl = pytest.importorskip("polars")
+        frame = orders_query().to_polars(connection)
+
+        assert isinstance(frame, pl.DataFrame)
+        assert frame.shape == (2, 6)
+        assert frame["order_id"].to_list() == [10248, 10249]
+
+    @pytest.mark.unit
+    def test_stream_polars(self, connection):
+        pl = pytest.importorskip("polars")
+        frames = list(orders_query().stream_polars(connection))
+
+        assert all(isinstance(frame, pl.DataFrame) for frame in frames)
+        assert sum(frame.height for frame in frames) == 2
@@ -0,0 +1,61 @@
+import pytest
+
+from config import DataBaseSettings, settings
+
+
+@pytest.fixture
+def fresh_config(monkeypatch):
+    monkeypatch.setenv("DB_ENVIRONMENT", "test")
+    monkeypatch.setattr(settings, "_config", None)
+
+
+class TestCachedSettings:
+
+    @pytest.mark.unit
+    def test_settings_are_read_once(self, fresh_config, monkeypatch):
+        config = DataBaseSettings.get_config()
+        monkeypatch.setenv("MAX_CONNECTIONS", "7")
+
+        assert DataBaseSettings.get_config() is config
+        assert config.max_connections == 10
+
+    @pytest.mark.unit
+    def test_reload_reads_the_environment_again(self, fresh_config, monkeypatch):
+        config = DataBaseSettings.get_config()
+        monkeypatch.setenv("MAX_CONNECTIONS", "7")
+
+        reloaded = DataBaseSettings.reload()
+
+        assert reloaded is not config
+        assert reloaded.max_connections == 7
+        assert DataBaseSettings.get_config() is reloaded
+
+    @pytest.mark.unit
+    def test_reload_reads_an_edited_env_file(self, fresh_config, monkeypatch, tmp_path):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(settings, "_from_dotenv", {})
+        for name in ("MAX_CONNECTIONS", "POOL_TIMEOUT"):
+            monkeypatch.setenv(name, "")
+            monkeypatch.delenv(name)  # Removed again after the test, whatever .env set
+        monkeypatch.setenv("MIN_CONNECTIONS", "2")
+        env_file = tmp_path / ".env"
+        env_file.write_text("MAX_CONNECTIONS=7\nPOOL_TIMEOUT=5\nMIN_CONNECTIONS=3\n")
+        assert DataBaseSettings.get_config().max_connections == 7
+
+        env_file.write_text("MAX_CONNECTIONS=20\nMIN_CONNECTIONS=3\n")
+        reloaded = DataBaseSettings.reload()
+
+        assert reloaded.max_connections == 20
+        assert reloaded.pool_timeout == 30.0  # Removed from .env
+        assert reloaded.min_connections == 2  # The environment still wins over .env
+
+    @pytest.mark.unit
+    def test_environment_can_be_chosen_in_env_file(self, monkeypatch, tmp_path):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(settings, "_config", None)
+        monkeypatch.setattr(settings, "_from_dotenv", {})
+        monkeypatch.setenv("DB_ENVIRONMENT", "")
+        monkeypatch.delenv("DB_ENVIRONMENT")  # Removed again after the test, whatever .env set
+        (tmp_path / ".env").write_text("DB_ENVIRONMENT=test\n")
+
+        assert DataBaseSettings.get_config().database == "test_db"
@@ -0,0 +1,233 @@
+import threading
+import time
+
+import pytest
+from src.database.exceptions import ConfigurationError, OutOfResourcesError, PoolTimeoutError
+from src.database.pool import ConnectionPool
+
+
+class TestConnectionPoolCheckout:
+
+    @pytest.mark.unit
+    def test_min_connections_are_opened_up_front(self, connection_factory):
+        pool = ConnectionPool(2, 5, connection_factory)
+
+        assert len(connection_factory.created) == 2
+        assert pool.idle_count == 2
+        assert pool.size == 2
+
+    @pytest.mark.unit
+    def test_grows_up_to_max_connections(self, connection_factory):
+        pool = ConnectionPool(0, 3, connection_factory)
+
+        connections = [pool.getconn() for _ in range(3)]
+
+        assert len(set(map(id, connections))) == 3
+        assert pool.in_use_count == 3
+
+    @pytest.mark.unit
+    def test_most_recently_returned_connection_is_reused_first(self, connection_factory):
+        pool = ConnectionPool(0, 3, connection_factory)
+        first, second = pool.getconn(), pool.getconn()
+
+        pool.putconn(first)
+        pool.putconn(second)
+
+        assert pool.getconn() is second
+
+    @pytest.mark.unit
+    def test_closed_connection_frees_its_slot(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        connection = pool.getconn()
+
+        pool.putconn(connection, close=True)
+
+        assert connection.closed
+        assert pool.size == 0
+        assert pool.getconn() is not connection
+
+    @pytest.mark.unit
+    def test_returning_foreign_connection_raises(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+
+        with pytest.raises(ConfigurationError, match="not checked out"):
+            pool.putconn(connection_factory())
+
+    @pytest.mark.unit
+    def test_invalid_pool_size_raises(self, connection_factory):
+        with pytest.raises(ConfigurationError, match="Invalid pool size"):
+            ConnectionPool(5, 2, connection_factory)
+
+
+class TestConnectionPoolWaiting:
+
+    @pytest.mark.unit
+    def test_exhausted_pool_times_out(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        pool.getconn()
+
+        with pytest.raises(PoolTimeoutError, match="Timed out"):
+            pool.getconn(timeout=0.05)
+        assert pool.waiting_count == 0
+
+    @pytest.mark.unit
+    def test_timeout_is_an_out_of_resources_error(self):
+        assert issubclass(PoolTimeoutError, OutOfResourcesError)
+
+    @pytest.mark.unit
+    def test_waiter_receives_returned_connection(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        connection = pool.getconn()
+        received = []
+
+        thread = threading.Thread(target=lambda: received.append(pool.getconn(timeout=5)))
+        thread.start()
+        time.sleep(0.05)
+        pool.putconn(connection)
+        thread.join()
+
+        assert received == [connection]
+
+    @pytest.mark.unit
+    def test_waiters_are_served_in_arrival_order(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        connection = pool.getconn()
+        order = []
+
+        def wait_for_connection(name):
+            conn = pool.getconn(timeout=5)
+            order.append(name)
+            pool.putconn(conn)
+
+        threads = []
+        for name in range(5):
+            thread = threading.Thread(target=wait_for_connection, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while pool.waiting_count != name + 1:
+                time.sleep(0.001)
+
+        pool.putconn(connection)
+        for thread in threads:
+            thread.join()
+
+        assert order == [0, 1, 2, 3, 4]
+
+    @pytest.mark.unit
+    def test_waiter_gets_slot_of_discarded_connection(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        connection = pool.getconn()
+        received = []
+
+        thread = threading.Thread(target=lambda: received.append(pool.getconn(timeout=5)))
+        thread.start()
+        time.sleep(0.05)
+        pool.putconn(connection, close=True)
+        thread.join()
+
+        assert received[0] is not connection
+        assert pool.size == 1
+
+    @pytest.mark.unit
+    def test_concurrent_checkouts_never_exceed_max(self, connection_factory):
+        pool = ConnectionPool(0, 4, connection_factory)
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(50):
+                    conn = pool.getconn(timeout=5)
+                    assert pool.in_use_count <= 4
+                    pool.putconn(conn)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(connection_factory.created) <= 4
+        assert pool.in_use_count == 0
+
+    @pytest.mark.unit
+    def test_closeall_wakes_waiters(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        pool.getconn()
+        errors = []
+
+        def wait_for_connection():
+            try:
+                pool.getconn(timeout=5)
+            except ConfigurationError as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=wait_for_connection)
+        thread.start()
+        time.sleep(0.05)
+        pool.closeall()
+        thread.join(timeout=1)
+
+        assert len(errors) == 1
+
+
+class TestConnectionPoolResizing:
+
+    @pytest.mark.unit
+    def test_growing_serves_waiters(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory, timeout=5.0)
+        held = pool.getconn()
+        received = []
+        waiter = threading.Thread(target=lambda: received.append(pool.getconn()))
+        waiter.start()
+        while pool.waiting_count == 0:
+            time.sleep(0.001)
+
+        pool.resize(0, 2)
+        waiter.join(timeout=5.0)
+
+        assert received and received[0] is not held
+        assert pool.size == 2
+
+    @pytest.mark.unit
+    def test_shrinking_keeps_checked_out_connections(self, connection_factory):
+        pool = ConnectionPool(0, 4, connection_factory)
+        connections = [pool.getconn() for _ in range(4)]
+        pool.putconn(connections.pop())
+
+        pool.resize(0, 2)
+
+        assert pool.size == 3 and pool.idle_count == 0
+        assert not any(connection.closed for connection in connections)
+        pool.putconn(connections.pop())
+        pool.putconn(connections.pop())
+        assert pool.size == 2 and pool.idle_count == 1
+        assert pool.max_connections == 2
+
+    @pytest.mark.unit
+    def test_invalid_resize_raises(self, connection_factory):
+        pool = ConnectionPool(1, 2, connection_factory)
+        with pytest.raises(ConfigurationError):
+            pool.resize(3, 2)
+        assert (pool.min_connections, pool.max_connections) == (1, 2)
+
+    @pytest.mark.unit
+    def test_recycle_replaces_connections_as_they_come_back(self, connection_factory):
+        pool = ConnectionPool(2, 3, connection_factory)
+        held = pool.getconn()
+        new_connections = []
+
+        def new_factory():
+            new_connections.append(connection_factory())
+            return new_connections[-1]
+
+        pool.recycle(new_factory)
+        assert not held.closed
+        pool.putconn(held)
+        pool.maintain()
+
+        assert all(connection.closed for connection in connection_factory.created[:2])
+        assert len(new_connections) == 2 and pool.idle_count == 2
+        assert pool.getconn() in new_connections
@@ -0,0 +1,185 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+from config import DataBaseSettings
+from src.database.connection import PostgreSQLConnectionPool, Singleton, install_reload_signal, reload_pools
+from src.database.exceptions import ConfigurationError
+from src.database.pool import ConnectionPool
+
+
+def lazy_settings():
+    return DataBaseSettings(HOST="localhost", NAME="test_db", USERNAME="test_user", PASSWORD="test_password",
+                            MIN_CONNECTIONS=0)
+
+
+def run_in_child(function):
+    """Run function in a forked child and return what it returned (an int)."""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write_end, str(function()).encode())
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_end) as reader:
+        return int(reader.read())
+
+
+class TestSingleton:
+
+    @pytest.mark.unit
+    def test_one_instance_per_name(self):
+        class Registry(metaclass=Singleton):
+            def __init__(self, name):
+                self.name = name
+
+        assert Registry() is Registry()
+        assert Registry("replica") is Registry("replica")
+        assert Registry("replica") is not Registry()
+        assert Registry("replica").name == "replica"
+
+    @pytest.mark.unit
+    def test_concurrent_creation_builds_one_instance(self):
+        created = []
+
+        class SlowToBuild(metaclass=Singleton):
+            def __init__(self, name):
+                time.sleep(0.01)
+                created.append(self)
+
+        instances = []
+        threads = [threading.Thread(target=lambda: instances.append(SlowToBuild())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(created) == 1
+        assert all(instance is created[0] for instance in instances)
+
+    @pytest.mark.unit
+    def test_forked_child_gets_a_new_instance(self):
+        class Registry(metaclass=Singleton):
+            def __init__(self, name):
+                self.pid = os.getpid()
+
+            def _after_fork(self):
+                pass
+
+        parent_instance = Registry()
+
+        child_pid_in_instance = run_in_child(lambda: Registry().pid)
+
+        assert child_pid_in_instance != os.getpid()
+        assert Registry() is parent_instance
+
+
+class TestPostgreSQLConnectionPoolSharing:
+
+    @pytest.mark.unit
+    def test_pool_stays_open_until_last_user_exits(self):
+        singleton = PostgreSQLConnectionPool("test-sharing", settings=lazy_settings())
+
+        with singleton as outer:
+            with PostgreSQLConnectionPool("test-sharing") as inner:
+                assert inner is outer
+            assert not outer.closed
+        assert outer.closed
+
+    @pytest.mark.unit
+    def test_closed_pool_is_not_kept(self):
+        singleton = PostgreSQLConnectionPool("test-closed", settings=lazy_settings())
+
+        with singleton:
+            assert singleton.stats().max_connections == singleton.config.max_connections
+        assert singleton.connection_pool is None and singleton.maintenance is None
+        with pytest.raises(ConfigurationError):
+            singleton.stats()
+
+    @pytest.mark.unit
+    def test_named_pools_are_independent(self):
+        primary = PostgreSQLConnectionPool("test-primary", settings=lazy_settings())
+        replica = PostgreSQLConnectionPool("test-replica", settings=lazy_settings())
+
+        with primary as primary_pool, replica as replica_pool:
+            assert primary_pool is not replica_pool
+
+
+class TestForkSafety:
+
+    @pytest.mark.unit
+    def test_child_detaches_inherited_connections(self, connection_factory):
+        pool = ConnectionPool(2, 2, connection_factory)
+        inherited = list(connection_factory.created)
+
+        def child():
+            connection = pool.getconn()
+            closed_inherited = sum(c.closed for c in inherited)
+            return int(connection not in inherited and closed_inherited == 0 and pool.size == 1)
+
+        assert run_in_child(child) == 1
+        assert pool.idle_count == 2
+
+    @pytest.mark.unit
+    def test_child_returning_a_parent_connection_does_not_close_it(self, connection_factory):
+        pool = ConnectionPool(1, 1, connection_factory)
+        connection = pool.getconn()
+
+        def child():
+            pool.putconn(connection)
+            return int(not connection.closed and pool.size == 0)
+
+        assert run_in_child(child) == 1
+
+
+class TestReload:
+
+    @pytest.mark.unit
+    def test_reload_resizes_the_open_pool(self):
+        singleton = PostgreSQLConnectionPool("test-reload", settings=lazy_settings())
+
+        with singleton as pool:
+            factory = pool._connection_factory
+            retuned = DataBaseSettings(HOST="localhost", NAME="test_db", USERNAME="test_user",
+                                       PASSWORD="test_password", MIN_CONNECTIONS=0, MAX_CONNECTIONS=25,
+                                       POOL_TIMEOUT=2.0, MAINTENANCE_INTERVAL=5.0)
+            assert singleton.reload(retuned) is retuned
+            assert (pool.max_connections, pool.timeout) == (25, 2.0)
+            assert pool.concurrency_limiter.max_limit == 50
+            assert singleton.maintenance.interval == 5.0
+            assert pool._connection_factory is factory  # Same connection parameters, nothing to replace
+
+            singleton.reload(DataBaseSettings(HOST="localhost", NAME="test_db", USERNAME="test_user",
+                                              PASSWORD="test_password", MIN_CONNECTIONS=0, STATEMENT_TIMEOUT=5.0))
+            assert pool._connection_factory.keywords["options"] == "-c statement_timeout=5000"
+
+    @pytest.mark.unit
+    def test_reload_leaves_closed_pools_alone(self, monkeypatch):
+        singleton = PostgreSQLConnectionPool("test-reload-closed", settings=lazy_settings())
+        with singleton as closed:
+            pass
+        retuned = DataBaseSettings(HOST="localhost", NAME="test_db", USERNAME="test_user",
+                                   PASSWORD="test_password", MIN_CONNECTIONS=0, MAX_CONNECTIONS=25)
+        monkeypatch.setattr(DataBaseSettings, "reload", classmethod(lambda cls: retuned))
+        singleton.settings = None
+
+        reload_pools()
+
+        assert closed.max_connections == lazy_settings().max_connections
+        assert singleton.connection_pool is None and singleton.config is retuned
+
+    @pytest.mark.unit
+    def test_sighup_reloads_every_pool(self, monkeypatch):
+        reloaded = threading.Event()
+        monkeypatch.setattr("src.database.connection.reload_pools", reloaded.set)
+        previous = install_reload_signal()
+        try:
+            os.kill(os.getpid(), signal.SIGHUP)
+            assert reloaded.wait(5.0)
+        finally:
+            signal.signal(signal.SIGHUP, previous)
@@ -0,0 +1,118 @@
+import time
+
+import psycopg2.extensions
+import pytest
+from src.database.connection import PooledDatabaseConnection
+from src.database.pool import ConnectionPool
+from src.database.validation import (AlwaysValidate, BackgroundValidate, IdleValidate, PassiveValidate,
+                                     create_validation_policy, ping)
+
+
+class TestValidationPolicies:
+
+    @pytest.mark.unit
+    def test_always_validate_pings_the_server(self, connection_factory):
+        connection = connection_factory()
+
+        assert AlwaysValidate().is_valid(connection, idle_seconds=0)
+        assert connection.executed == [("SELECT 1", None)]
+
+    @pytest.mark.unit
+    def test_always_validate_rejects_unreachable_connection(self, connection_factory):
+        connection = connection_factory()
+        connection.unreachable = True
+
+        assert not AlwaysValidate().is_valid(connection, idle_seconds=0)
+
+    @pytest.mark.unit
+    def test_passive_validate_never_touches_the_server(self, connection_factory):
+        connection = connection_factory()
+
+        assert PassiveValidate().is_valid(connection, idle_seconds=3600)
+        assert connection.executed == []
+
+    @pytest.mark.unit
+    def test_passive_validate_rejects_closed_or_broken_connections(self, connection_factory):
+        closed, broken = connection_factory(), connection_factory()
+        closed.close()
+        broken.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
+        assert not PassiveValidate().is_valid(closed, idle_seconds=0)
+        assert not PassiveValidate().is_valid(broken, idle_seconds=0)
+
+    @pytest.mark.unit
+    def test_idle_validate_only_pings_after_threshold(self, connection_factory):
+        connection = connection_factory()
+        policy = IdleValidate(idle_threshold=10)
+
+        assert policy.is_valid(connection, idle_seconds=1)
+        assert connection.executed == []
+
+        assert policy.is_valid(connection, idle_seconds=11)
+        assert connection.executed == [("SELECT 1", None)]
+
+    @pytest.mark.unit
+    def test_policy_is_built_from_settings(self):
+        class Settings:
+            validation_policy = "idle"
+            validation_idle_threshold = 2.5
+            validation_interval = 30.0
+
+        policy = create_validation_policy(Settings)
+
+        assert isinstance(policy, IdleValidate)
+        assert policy.idle_threshold == 2.5
+
+
+class TestBackgroundValidation:
+
+    @pytest.mark.unit
+    def test_check_idle_connections_discards_dead_ones(self, connection_factory):
+        pool = ConnectionPool(3, 3, connection_factory)
+        dead = connection_factory.created[1]
+        dead.unreachable = True
+
+        discarded = pool.check_idle_connections(ping)
+
+        assert discarded == 1
+        assert dead.closed
+        assert pool.size == 2
+        assert pool.idle_count == 2
+
+    @pytest.mark.unit
+    def test_background_thread_validates_idle_connections(self, connection_factory):
+        pool = ConnectionPool(2, 2, connection_factory)
+        connection_factory.created[0].unreachable = True
+        policy = BackgroundValidate(interval=0.01)
+
+        policy.start(pool)
+        try:
+            deadline = time.monotonic() + 2
+            while pool.size != 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            policy.stop()
+
+        assert pool.size == 1
+
+
+class TestPooledConnectionValidation:
+
+    @pytest.mark.unit
+    def test_checkout_uses_pool_policy(self, connection_factory):
+        pool = ConnectionPool(1, 1, connection_factory, validation_policy=PassiveValidate())
+
+        with PooledDatabaseConnection(pool) as connection:
+            assert connection.executed == []
+
+    @pytest.mark.unit
+    def test_dead_connection_is_replaced_on_checkout(self, connection_factory):
+        pool = ConnectionPool(1, 2, connection_factory, validation_policy=AlwaysValidate())
+        dead = connection_factory.created[0]
+        dead.unreachable = True
+
+        with PooledDatabaseConnection(pool) as connection:
+            assert connection is not dead
+
+        assert dead.closed
+        assert pool.idle_count == 1
@@ -0,0 +1,134 @@
+import logging
+from datetime import datetime
+
+import pytest
+
+from src.database.exceptions import (AdminInterventionError, AuthorizationError, DatabaseError, InputDataError,
+                                     InvalidTransactionStateError, ObjectStateError, ProgramLimitExceededError,
+                                     QueryError, QueryTimeoutError, SQLSyntaxError, SystemError,
+                                     exception_class_for)
+from src.database.metrics import ErrorRateLog, sqlstate_class
+
+
+class CountingDiag:
+    """A psycopg2 Diagnostics stand-in that counts which fields are read."""
+
+    def __init__(self, sqlstate, **fields):
+        self.reads = []
+        self._fields = {"sqlstate": sqlstate, **fields}
+
+    def __getattr__(self, name):
+        self.reads.append(name)
+        return self._fields.get(name)
+
+
+class ServerError(Exception):
+
+    def __init__(self, sqlstate, message="error raised by the fake server", **fields):
+        super().__init__(message)
+        self.diag = CountingDiag(sqlstate, **fields)
+        self.pgcode = sqlstate
+
+
+class TestFromPostgresException:
+
+    @pytest.mark.unit
+    def test_details_are_gathered_on_first_access(self):
+        server_error = ServerError("23505", constraint_name="orders_pkey", table_name="orders")
+
+        error = DatabaseError.from_postgres_exception(server_error, params={"api_token": "t", "id": 1},
+                                                      query="INSERT INTO orders ...")
+
+        assert server_error.diag.reads == ["sqlstate"]
+        assert error.sqlstate == "23505"
+        details = error.details
+        assert details["constraint_name"] == "orders_pkey"
+        assert details["table_name"] == "orders"
+        assert details["params"] == {"api_token": "[REDACTED]", "id": 1}
+        assert details["query"] == "INSERT INTO orders ..."
+        assert "column_name" not in details
+        assert isinstance(details["datetime"], datetime) and details["datetime"].tzinfo is not None
+        reads = len(server_error.diag.reads)
+        assert error.details is details
+        assert len(server_error.diag.reads) == reads
+
+    @pytest.mark.unit
+    def test_str_includes_details(self):
+        error = DatabaseError.from_postgres_exception(ServerError("42P01", 'relation "nope" does not exist'),
+                                                      query="SELECT * FROM nope")
+        assert str(error).startswith('relation "nope" does not exist [query=SELECT * FROM nope, sqlstate=42P01')
+
+    @pytest.mark.unit
+    def test_explicit_details(self):
+        error = QueryError("Query failed.", {"query": "SELECT 1"})
+        assert error.details == {"query": "SELECT 1"}
+        assert error.sqlstate is None
+        error.details = None
+        assert str(error) == "Query failed."
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("sqlstate, exception_class", [
+        ("22012", InputDataError),
+        ("25006", InvalidTransactionStateError),  # read_only_sql_transaction
+        ("25P02", InvalidTransactionStateError),  # in_failed_sql_transaction
+        ("3B001", InvalidTransactionStateError),  # invalid_savepoint_specification
+        ("28P01", AuthorizationError),
+        ("3D000", SQLSyntaxError),
+        ("54001", ProgramLimitExceededError),
+        ("55006", ObjectStateError),
+        ("55P03", QueryTimeoutError),
+        ("57014", QueryTimeoutError),
+        ("57P01", AdminInterventionError),
+        ("P0001", QueryError),
+        ("XX001", SystemError),
+        ("ZZ999", DatabaseError),
+        ("", DatabaseError),
+    ])
+    def test_exception_classes(self, sqlstate, exception_class):
+        assert exception_class_for(sqlstate) is exception_class
+        assert type(DatabaseError.from_postgres_exception(ServerError(sqlstate))) is exception_class
+
+    @pytest.mark.unit
+    def test_sqlstate_class_leaves_details_alone(self):
+        server_error = ServerError("53300")
+        error = DatabaseError.from_postgres_exception(server_error)
+        assert sqlstate_class(error) == "53"
+        assert server_error.diag.reads == ["sqlstate"]
+
+
+class TestErrorRateLog:
+
+    @pytest.fixture
+    def clock(self):
+        now = [100.0]
+        clock = lambda: now[0]
+        clock.now = now
+        return clock
+
+    @pytest.mark.unit
+    def test_repeated_errors_are_counted_not_logged(self, clock, caplog):
+        error_log = ErrorRateLog(logging.getLogger("test.errors"), interval=10.0, clock=clock)
+        refused = DatabaseError.from_postgres_exception(ServerError("08006", "connection refused"))
+
+        with caplog.at_level(logging.WARNING, logger="test.errors"):
+            for _ in range(50):
+                error_log.report(refused, "Failed to acquire connection.")
+            error_log.report(DatabaseError.from_postgres_exception(ServerError("53300")), "Out of resources.")
+            clock.now[0] += 12.0
+            error_log.report(refused, "Failed to acquire connection.")
+
+        messages = [record.getMessage() for record in caplog.records]
+        assert len(messages) == 3
+        assert messages[0].startswith("Failed to acquire connection. connection refused")
+        assert messages[1].startswith("Out of resources.")
+        assert "and 49 more like it in the last 12 seconds" in messages[2]
+        assert error_log.counts() == {("ConnectionError", "08006"): 51, ("OutOfResourcesError", "53300"): 1}
+
+    @pytest.mark.unit
+    def test_rates(self, clock):
+        error_log = ErrorRateLog(logging.getLogger("test.errors"), interval=10.0, clock=clock)
+        error = QueryError("Query failed.")
+        for _ in range(20):
+            error_log.report(error, "Failed.")
+        clock.now[0] += 5.0
+        assert error_log.rates() == {("QueryError", None): 2.0}
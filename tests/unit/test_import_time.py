@@ -0,0 +1,70 @@
+import asyncio
+import subprocess
+import sys
+
+import psycopg2
+import pytest
+
+import src.database
+from benchmarks.import_time import ROOT
+from src.database import query_executors
+from src.database.retrying import retry
+
+HEAVY_DEPENDENCIES = ("psycopg2", "pydantic", "pydantic_settings", "stamina", "dotenv", "polars", "pyarrow")
+
+
+def loaded_after(code):
+    """The heavy dependencies in sys.modules after running code in a fresh interpreter."""
+    check = f"import sys\n{code}\nprint(' '.join(m for m in {HEAVY_DEPENDENCIES!r} if m in sys.modules))"
+    completed = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True, check=True)
+    return completed.stdout.split()
+
+
+class TestLazyImports:
+
+    @pytest.mark.unit
+    def test_importing_the_packages_loads_no_heavy_dependency(self):
+        assert loaded_after("import src.database, src.database.exceptions, config") == []
+
+    @pytest.mark.unit
+    def test_query_builder_needs_no_settings_or_retries(self):
+        assert loaded_after("from src.database import QueryBuilder") == ["psycopg2"]
+
+    @pytest.mark.unit
+    def test_exports_resolve_on_first_use(self):
+        assert src.database.QueryBuilder is query_executors.QueryBuilder
+        assert "PooledDatabaseConnection" in dir(src.database)
+        with pytest.raises(AttributeError):
+            src.database.NoSuchThing
+
+
+class TestLazyRetry:
+
+    @pytest.mark.unit
+    def test_retries_functions(self):
+        calls = []
+
+        @retry(on=psycopg2.OperationalError, attempts=3, wait_initial=0.0, wait_max=0.0, wait_jitter=0.0)
+        def flaky():
+            """Fails once."""
+            calls.append(1)
+            if len(calls) == 1:
+                raise psycopg2.OperationalError("server closed the connection unexpectedly")
+            return "connected"
+
+        assert flaky() == "connected"
+        assert len(calls) == 2
+        assert flaky.__doc__ == "Fails once."
+
+    @pytest.mark.unit
+    def test_retries_coroutine_functions(self):
+        calls = []
+
+        @retry(on=psycopg2.OperationalError, attempts=2, wait_initial=0.0, wait_max=0.0, wait_jitter=0.0)
+        async def always_failing():
+            calls.append(1)
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+        with pytest.raises(psycopg2.OperationalError):
+            asyncio.run(always_failing())
+        assert len(calls) == 2
@@ -0,0 +1,146 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from src.database.pagination import (InvalidCursorError, decode_cursor, encode_cursor, keyset_condition,
+                                     parse_order_by)
+from src.database.query_executors import QueryBuilder
+
+
+def orders_page(after=None, order_by=("order_date", "order_id"), page_size=3):
+    return (QueryBuilder()
+            .select("order_id", "order_date", "customer_id")
+            .from_table("orders")
+            .paginate_after(list(order_by), after, page_size))
+
+
+class TestKeysetCondition:
+
+    @pytest.mark.unit
+    def test_parse_order_by(self):
+        assert parse_order_by(["a", "b desc", "c ASC"]) == [("a", "ASC"), ("b", "DESC"), ("c", "ASC")]
+
+    @pytest.mark.unit
+    def test_parse_order_by_rejects_expressions(self):
+        with pytest.raises(ValueError, match="column \\[ASC\\|DESC\\]"):
+            parse_order_by(["a NULLS LAST"])
+
+    @pytest.mark.unit
+    def test_ascending_uses_row_comparison(self):
+        assert keyset_condition([("a", "ASC"), ("b", "ASC")], [1, 2]) == ("(a, b) > (%s, %s)", [1, 2])
+
+    @pytest.mark.unit
+    def test_descending_uses_row_comparison(self):
+        assert keyset_condition([("a", "DESC"), ("b", "DESC")], [1, 2]) == ("(a, b) < (%s, %s)", [1, 2])
+
+    @pytest.mark.unit
+    def test_single_column(self):
+        assert keyset_condition([("id", "ASC")], [7]) == ("id > %s", [7])
+
+    @pytest.mark.unit
+    def test_mixed_directions_expand(self):
+        condition, params = keyset_condition([("a", "DESC"), ("b", "ASC"), ("c", "DESC")], [1, 2, 3])
+
+        assert condition == "a <= %s AND ((a < %s) OR (a = %s AND b > %s) OR (a = %s AND b = %s AND c < %s))"
+        assert params == [1, 1, 1, 2, 1, 2, 3]
+
+    @pytest.mark.unit
+    def test_wrong_number_of_values(self):
+        with pytest.raises(ValueError, match="Expected 2 values"):
+            keyset_condition([("a", "ASC"), ("b", "ASC")], [1])
+
+
+class TestCursorToken:
+    KEYS = [("order_date", "DESC"), ("order_id", "DESC")]
+
+    @pytest.mark.unit
+    def test_round_trip_keeps_types(self):
+        values = [datetime(2024, 5, 1, 12, 30), date(2024, 5, 1), Decimal("12.50"), "ALFKI", 10248, None]
+        keys = [(f"c{index}", "ASC") for index in range(len(values))]
+
+        assert decode_cursor(keys, encode_cursor(keys, values)) == values
+
+    @pytest.mark.unit
+    def test_token_is_url_safe(self):
+        token = encode_cursor(self.KEYS, [date(2024, 5, 1), 10248])
+        assert all(character.isalnum() or character in "-_" for character in token)
+
+    @pytest.mark.unit
+    def test_token_of_other_sort_order_is_rejected(self):
+        token = encode_cursor(self.KEYS, [date(2024, 5, 1), 10248])
+
+        with pytest.raises(InvalidCursorError, match="different sort order"):
+            decode_cursor([("order_date", "ASC"), ("order_id", "ASC")], token)
+
+    @pytest.mark.unit
+    def test_malformed_token_is_rejected(self):
+        with pytest.raises(InvalidCursorError, match="Malformed"):
+            decode_cursor(self.KEYS, "not a token!")
+
+
+class TestPaginateAfter:
+
+    @pytest.mark.unit
+    def test_first_page(self):
+        sql, params = orders_page().get_sql()
+
+        assert sql == "SELECT order_id,order_date,customer_id\nFROM orders\nORDER BY order_date ASC, order_id ASC\nLIMIT 3"
+        assert params is None
+
+    @pytest.mark.unit
+    def test_page_after_values(self):
+        sql, params = orders_page(after=[date(1996, 7, 4), 10248]).get_sql()
+
+        assert "WHERE (order_date, order_id) > (%s, %s)\nORDER BY order_date ASC, order_id ASC\nLIMIT 3" in sql
+        assert params == [date(1996, 7, 4), 10248]
+
+    @pytest.mark.unit
+    def test_keyset_is_anded_with_existing_conditions(self):
+        builder = (QueryBuilder().select("order_id").from_table("orders")
+                   .where("customer_id = %s", "ALFKI").or_where("customer_id = %s", "ANATR")
+                   .paginate_after(["order_id"], [10248], 10))
+
+        sql, params = builder.get_sql()
+        assert "WHERE (customer_id = %s OR customer_id = %s) AND order_id > %s" in sql
+        assert params == ["ALFKI", "ANATR", 10248]
+
+    @pytest.mark.unit
+    def test_replaces_offset(self):
+        builder = QueryBuilder().select("order_id").from_table("orders").limit(10).offset(500)
+        builder.paginate_after(["order_id"], None, 10)
+
+        assert "OFFSET" not in str(builder)
+
+    @pytest.mark.unit
+    def test_next_cursor_from_tuple_rows(self):
+        builder = orders_page()
+        rows = [(10248, date(1996, 7, 4), "VINET"), (10249, date(1996, 7, 5), "TOMSP"), (10250, date(1996, 7, 8), "HANAR")]
+
+        token = builder.next_cursor(rows)
+        next_page = orders_page(after=token)
+        assert next_page.get_params() == [date(1996, 7, 8), 10250]
+
+    @pytest.mark.unit
+    def test_next_cursor_from_dict_rows(self):
+        builder = (QueryBuilder().select("o.order_id", "o.order_date").from_table("orders o")
+                   .paginate_after(["o.order_date DESC", "o.order_id DESC"], None, 1))
+
+        token = builder.next_cursor([{"order_id": 10250, "order_date": date(1996, 7, 8)}])
+        assert decode_cursor([("o.order_date", "DESC"), ("o.order_id", "DESC")], token) == [date(1996, 7, 8), 10250]
+
+    @pytest.mark.unit
+    def test_short_page_is_the_last(self):
+        assert orders_page().next_cursor([(10248, date(1996, 7, 4), "VINET")]) is None
+
+    @pytest.mark.unit
+    def test_sort_column_missing_from_select(self):
+        builder = QueryBuilder().select("customer_id").from_table("orders").paginate_after(["order_id"], None, 1)
+
+        with pytest.raises(ValueError, match="select list"):
+            builder.next_cursor([("VINET",)])
+
+    @pytest.mark.unit
+    def test_page_size_must_be_positive(self):
+        with pytest.raises(ValueError, match="Page size must be a positive integer"):
+            orders_page(page_size=0)
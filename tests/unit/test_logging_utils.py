@@ -0,0 +1,106 @@
+import json
+import logging
+import threading
+
+import pytest
+
+import src.database.connection  # noqa: F401, importing it must not configure logging
+from src.utils.logging_utils import JsonFormatter, RateLimitFilter, configure_logging, stop_logging
+
+
+class RecordingHandler(logging.Handler):
+    """Keeps formatted records along with the thread that formatted them."""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+        self.threads = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.append(threading.current_thread().name)
+
+
+def make_record(message="Connection acquired.", args=(), **extra):
+    record = logging.LogRecord("src.database.connection", logging.INFO, __file__, 1, message, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+@pytest.fixture
+def restore_root():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    stop_logging()
+    root.handlers, root.level = handlers, level
+
+
+class TestImport:
+
+    @pytest.mark.unit
+    def test_library_does_not_configure_the_root_logger(self):
+        root = logging.getLogger()
+        assert not any(isinstance(handler, logging.FileHandler) and handler.baseFilename.endswith("example.log")
+                       for handler in root.handlers)
+
+
+class TestJsonFormatter:
+
+    @pytest.mark.unit
+    def test_structured_fields(self):
+        entry = json.loads(JsonFormatter().format(make_record("Checked out %s", ("conn-1",), pool="primary")))
+        assert entry["message"] == "Checked out conn-1"
+        assert entry["level"] == "INFO"
+        assert entry["logger"] == "src.database.connection"
+        assert entry["pool"] == "primary"
+        assert "args" not in entry and "msecs" not in entry
+
+
+class TestRateLimitFilter:
+
+    @pytest.mark.unit
+    def test_bursts_then_rate(self):
+        now = [0.0]
+        rate_limit = RateLimitFilter(rate=2.0, burst=3, clock=lambda: now[0])
+
+        passed = [rate_limit.filter(make_record()) for _ in range(10)]
+        assert passed == [True] * 3 + [False] * 7
+        assert rate_limit.filter(make_record("Another message."))
+
+        now[0] += 1.0  # Two more tokens
+        record = make_record()
+        assert rate_limit.filter(record)
+        assert record.suppressed == 7
+        assert rate_limit.filter(make_record())
+        assert not rate_limit.filter(make_record())
+
+
+class TestConfigureLogging:
+
+    @pytest.mark.unit
+    def test_records_are_formatted_on_the_listener_thread(self, restore_root):
+        handler = RecordingHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        configure_logging(level=logging.INFO, handlers=[handler])
+
+        logging.getLogger("test.queue").info("Checked out %d connections.", 3)
+        logging.getLogger("test.queue").debug("Not at this level.")
+        stop_logging()
+
+        assert handler.lines == ["INFO Checked out 3 connections."]
+        assert handler.threads != [threading.current_thread().name]
+
+    @pytest.mark.unit
+    def test_json_lines_to_a_file(self, restore_root, tmp_path):
+        log_file = tmp_path / "app.log"
+        configure_logging(filename=str(log_file))
+        configure_logging(filename=str(log_file))  # Replaces the first setup, no duplicate lines
+
+        logging.getLogger("test.queue").warning("Pool exhausted.", extra={"waiting": 12})
+        stop_logging()
+
+        [line] = log_file.read_text().splitlines()
+        entry = json.loads(line)
+        assert entry["message"] == "Pool exhausted."
+        assert entry["waiting"] == 12
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+from src.database.pool import ConnectionPool, PoolMaintenance
+
+
+class TestMaxLifetime:
+
+    @pytest.mark.unit
+    def test_expired_connection_is_closed_when_returned(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory, max_lifetime=0.01)
+        connection = pool.getconn()
+        time.sleep(0.02)
+
+        pool.putconn(connection)
+
+        assert connection.closed
+        assert pool.size == 0
+
+    @pytest.mark.unit
+    def test_maintain_replaces_expired_idle_connections(self, connection_factory):
+        pool = ConnectionPool(2, 2, connection_factory, max_lifetime=0.01)
+        original = list(connection_factory.created)
+        time.sleep(0.02)
+
+        closed, opened = pool.maintain()
+
+        assert (closed, opened) == (2, 2)
+        assert all(connection.closed for connection in original)
+        assert pool.idle_count == 2
+
+    @pytest.mark.unit
+    def test_connections_within_lifetime_are_kept(self, connection_factory):
+        pool = ConnectionPool(2, 2, connection_factory, max_lifetime=3600)
+
+        assert pool.maintain() == (0, 0)
+        assert pool.idle_count == 2
+
+
+class TestIdleReaping:
+
+    @pytest.mark.unit
+    def test_idle_connections_shrink_back_to_min_connections(self, connection_factory):
+        pool = ConnectionPool(1, 4, connection_factory, max_idle_time=0.01)
+        connections = [pool.getconn() for _ in range(4)]
+        for connection in connections:
+            pool.putconn(connection)
+        time.sleep(0.02)
+
+        closed, opened = pool.maintain()
+
+        assert (closed, opened) == (3, 0)
+        assert pool.size == 1
+        assert pool.idle_count == 1
+
+    @pytest.mark.unit
+    def test_warmest_connection_survives_reaping(self, connection_factory):
+        pool = ConnectionPool(1, 2, connection_factory, max_idle_time=0.01)
+        cold, warm = pool.getconn(), pool.getconn()
+        pool.putconn(cold)
+        pool.putconn(warm)
+        time.sleep(0.02)
+
+        pool.maintain()
+
+        assert cold.closed
+        assert not warm.closed
+
+    @pytest.mark.unit
+    def test_checked_out_connections_are_left_alone(self, connection_factory):
+        pool = ConnectionPool(0, 2, connection_factory, max_idle_time=0.01, max_lifetime=0.01)
+        connection = pool.getconn()
+        time.sleep(0.02)
+
+        pool.maintain()
+
+        assert not connection.closed
+        assert pool.in_use_count == 1
+
+
+class TestPrewarming:
+
+    @pytest.mark.unit
+    def test_maintain_opens_connections_up_to_min(self, connection_factory):
+        pool = ConnectionPool(3, 3, connection_factory)
+        pool.putconn(pool.getconn(), close=True)
+        pool.putconn(pool.getconn(), close=True)
+
+        assert pool.maintain() == (0, 2)
+        assert pool.idle_count == 3
+
+    @pytest.mark.unit
+    def test_failed_prewarm_releases_reserved_slots(self, connection_factory):
+        pool = ConnectionPool(2, 2, connection_factory)
+        pool.putconn(pool.getconn(), close=True)
+
+        def refuse():
+            raise OSError("connection refused")
+        pool._connection_factory = refuse
+
+        assert pool.maintain() == (0, 0)
+        assert pool.size == 1
+
+    @pytest.mark.unit
+    def test_maintenance_thread_runs_periodically(self, connection_factory):
+        pool = ConnectionPool(2, 2, connection_factory)
+        pool.putconn(pool.getconn(), close=True)
+        maintenance = PoolMaintenance(interval=0.01)
+
+        maintenance.start(pool)
+        try:
+            deadline = time.monotonic() + 2
+            while pool.idle_count != 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            maintenance.stop()
+
+        assert pool.idle_count == 2
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import psycopg2
+import pytest
+from src.database.connection import PooledDatabaseConnection
+from src.database.exceptions import PoolTimeoutError
+from src.database.metrics import LatencyReservoir, render_prometheus
+from src.database.pool import ConnectionPool
+from src.database.validation import PassiveValidate
+
+
+class TestLatencyReservoir:
+
+    @pytest.mark.unit
+    def test_percentiles(self):
+        reservoir = LatencyReservoir()
+        for sample in range(1, 101):
+            reservoir.record(sample / 1000)
+
+        percentiles = reservoir.percentiles(0.5, 0.99)
+
+        assert percentiles[0.5] == pytest.approx(0.05, abs=0.001)
+        assert percentiles[0.99] == pytest.approx(0.099, abs=0.001)
+        assert reservoir.count == 100
+
+    @pytest.mark.unit
+    def test_only_recent_samples_are_kept(self):
+        reservoir = LatencyReservoir(size=10)
+        for sample in range(100):
+            reservoir.record(sample)
+
+        assert reservoir.percentiles(0.0)[0.0] == 90
+        assert reservoir.count == 100
+
+    @pytest.mark.unit
+    def test_empty_reservoir(self):
+        assert LatencyReservoir().percentiles(0.5) == {0.5: 0.0}
+
+
+class TestPoolStats:
+
+    @pytest.mark.unit
+    def test_counts_connections_and_checkouts(self, connection_factory):
+        pool = ConnectionPool(1, 3, connection_factory)
+        first, second = pool.getconn(), pool.getconn()
+        pool.putconn(first)
+        pool.putconn(second, close=True)
+
+        stats = pool.stats()
+
+        assert stats.size == 1
+        assert stats.idle == 1
+        assert stats.in_use == 0
+        assert stats.checkouts == 2
+        assert stats.connections_opened == 2
+        assert stats.connections_closed == 1
+
+    @pytest.mark.unit
+    def test_records_hold_time(self, connection_factory):
+        pool = ConnectionPool(1, 1, connection_factory)
+        connection = pool.getconn()
+        time.sleep(0.02)
+        pool.putconn(connection)
+
+        assert pool.stats().hold_time.p50 >= 0.02
+
+    @pytest.mark.unit
+    def test_records_wait_time_and_timeouts(self, connection_factory):
+        pool = ConnectionPool(0, 1, connection_factory)
+        connection = pool.getconn()
+        with pytest.raises(PoolTimeoutError):
+            pool.getconn(timeout=0.01)
+
+        thread = threading.Thread(target=lambda: pool.putconn(pool.getconn(timeout=5)))
+        thread.start()
+        time.sleep(0.05)
+        pool.putconn(connection)
+        thread.join()
+
+        stats = pool.stats()
+        assert stats.timeouts == 1
+        assert stats.wait_time.p99 >= 0.05
+
+    @pytest.mark.unit
+    def test_metrics_can_be_switched_off(self, connection_factory):
+        pool = ConnectionPool(1, 1, connection_factory, record_metrics=False)
+        pool.putconn(pool.getconn())
+
+        assert pool.stats().hold_time.count == 0
+
+    @pytest.mark.unit
+    def test_errors_are_counted_by_sqlstate_class(self, connection_factory, make_postgres_error):
+        pool = ConnectionPool(1, 1, connection_factory, validation_policy=PassiveValidate())
+        error = make_postgres_error("53300", "too many connections")
+
+        with pytest.raises(psycopg2.Error):
+            with PooledDatabaseConnection(pool):
+                raise error
+
+        assert pool.stats().errors == {"53": 1}
+
+
+class TestPrometheusExport:
+
+    @pytest.mark.unit
+    def test_render_prometheus(self, connection_factory, make_postgres_error):
+        pool = ConnectionPool(1, 2, connection_factory)
+        pool.putconn(pool.getconn())
+        pool.metrics.record_error(make_postgres_error("08006", "connection failure"))
+
+        text = render_prometheus(pool.stats(), labels={"pool": "primary"})
+
+        assert '# TYPE pg_pool_connections gauge' in text
+        assert 'pg_pool_connections{pool="primary"} 1' in text
+        assert 'pg_pool_checkouts_total{pool="primary"} 1' in text
+        assert 'pg_pool_wait_seconds{pool="primary",quantile="0.99"}' in text
+        assert 'pg_pool_errors_total{pool="primary",sqlstate_class="08",error="ConnectionError"} 1' in text
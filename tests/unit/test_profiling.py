@@ -0,0 +1,160 @@
+import dataclasses
+import json
+import logging
+
+import pytest
+
+from src.database import profiling
+from src.database.exceptions import DatabaseError
+from src.database.pool import ConnectionPool
+from src.database.profiling import QueryProfiler, disable_profiling, enable_profiling, load_query_log
+from src.database.query_executors import QueryBuilder
+from src.database.validation import PassiveValidate
+from tests.conftest import FakeConnection
+
+PLAN = [{"Plan": {"Node Type": "Seq Scan", "Shared Hit Blocks": 12, "Shared Read Blocks": 3},
+         "Planning Time": 0.1, "Execution Time": 42.5}]
+
+
+@pytest.fixture(autouse=True)
+def no_profiler():
+    yield
+    disable_profiling()
+
+
+@pytest.fixture
+def connection():
+    return FakeConnection()
+
+
+@pytest.fixture
+def pool(connection):
+    return ConnectionPool(0, 1, lambda: connection, validation_policy=PassiveValidate())
+
+
+def select_orders():
+    return QueryBuilder().select("id", "total").from_table("orders").where("total > %s", 10)
+
+
+class TestMeasuring:
+
+    @pytest.mark.unit
+    def test_nothing_is_measured_while_disabled(self, connection):
+        result = select_orders().execute(connection)
+        assert result._measurement is None
+        assert profiling.active_profiler() is None
+
+    @pytest.mark.unit
+    def test_records_rows_bytes_and_timings(self, connection, tmp_path):
+        log_path = tmp_path / "slow.jsonl"
+        profiler = enable_profiling(threshold=60.0, log_path=str(log_path))
+        connection.results = [[(1, 25.0), (2, 99.5)]]
+
+        rows = select_orders().execute(connection).fetch_all()
+
+        assert len(rows) == 2
+        [record] = profiler.records
+        assert record.query.startswith("SELECT id,total\nFROM orders")
+        assert record.params == [10]
+        assert record.rows == 2
+        assert record.bytes > 0
+        assert record.duration_ms >= record.first_result_ms >= 0
+        assert record.error is None
+        assert not log_path.exists()  # Not slow
+
+    @pytest.mark.unit
+    def test_fetch_batches_counts_rows(self, connection):
+        profiler = enable_profiling(threshold=60.0)
+        connection.results = [[(i, 1.0) for i in range(5)]]
+
+        batches = list(select_orders().execute(connection).fetch_batches(2))
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert profiler.records[0].rows == 5
+
+    @pytest.mark.unit
+    def test_failed_query_records_its_sqlstate(self, connection, make_postgres_error):
+        profiler = enable_profiling(threshold=60.0)
+        connection.errors = [make_postgres_error("42601")]
+
+        with pytest.raises(DatabaseError):
+            select_orders().execute(connection)
+
+        assert profiler.records[0].error == "42601"
+
+    @pytest.mark.unit
+    def test_keeps_max_records(self, connection):
+        profiler = enable_profiling(threshold=60.0, max_records=2)
+        for _ in range(3):
+            select_orders().execute(connection).fetch_all()
+        assert len(profiler.records) == 2
+
+
+class TestSlowQueryLog:
+
+    @pytest.mark.unit
+    def test_slow_queries_are_logged_with_a_sampled_plan(self, pool, connection, tmp_path, caplog):
+        log_path = tmp_path / "slow.jsonl"
+        profiler = enable_profiling(threshold=0.0, explain_sample_rate=0.5, log_path=str(log_path),
+                                    sample=lambda: 0.2)
+        connection.results = [[(1, 25.0)], [(PLAN,)]]
+
+        with caplog.at_level(logging.WARNING, logger="src.database.slow_queries"):
+            select_orders().execute(pool).fetch_all()
+            assert profiler.wait_for_explains(timeout=5)
+
+        explain_sql, explain_params = connection.executed[-1]
+        assert explain_sql.startswith("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT id,total\nFROM orders")
+        assert explain_params == [10]
+        assert "rollback" in connection.transactions  # EXPLAIN ANALYZE really ran the query
+        [line] = log_path.read_text().splitlines()
+        entry = json.loads(line)
+        assert entry["plan"] == PLAN
+        assert entry["rows"] == 1
+        assert json.loads(caplog.records[-1].getMessage())["plan"] == PLAN
+
+    @pytest.mark.unit
+    def test_unsampled_and_bare_connection_queries_get_no_plan(self, pool, connection, tmp_path):
+        log_path = tmp_path / "slow.jsonl"
+        enable_profiling(threshold=0.0, explain_sample_rate=0.5, log_path=str(log_path), sample=lambda: 0.7)
+        select_orders().execute(pool).fetch_all()
+        enable_profiling(threshold=0.0, explain_sample_rate=1.0, log_path=str(log_path))
+        select_orders().execute(connection).fetch_all()
+
+        entries = [json.loads(line) for line in log_path.read_text().splitlines()]
+        assert [entry["plan"] for entry in entries] == [None, None]
+        assert not any(sql.startswith("EXPLAIN") for sql, _ in connection.executed)
+
+    @pytest.mark.unit
+    def test_inserts_are_never_explained(self, pool, connection, tmp_path):
+        enable_profiling(threshold=0.0, explain_sample_rate=1.0, log_path=str(tmp_path / "slow.jsonl"))
+        QueryBuilder().insert("orders", {"id": 1, "total": 5.0}).execute(pool)
+        assert not any(sql.startswith("EXPLAIN") for sql, _ in connection.executed)
+
+
+class TestFrames:
+
+    @pytest.mark.unit
+    def test_load_query_log(self, tmp_path):
+        log_path = tmp_path / "slow.jsonl"
+        profiler = QueryProfiler(threshold=0.0, log_path=str(log_path))
+        record = profiling.QueryRecord(timestamp="2026-01-05T10:00:00+00:00", query="SELECT 1", params=None,
+                                       duration_ms=1500.0, first_result_ms=20.0, rows=1, bytes=64)
+        profiler._log_slow(record)
+        profiler._log_slow(dataclasses.replace(record, plan=PLAN))
+
+        frame = load_query_log(log_path)
+
+        assert frame.height == 2
+        assert frame["duration_ms"].to_list() == [1500.0, 1500.0]
+        assert frame["execution_ms"].to_list() == [None, 42.5]
+        assert frame["shared_read_blocks"].to_list() == [None, 3]
+        assert json.loads(frame["plan"][1]) == PLAN
+
+    @pytest.mark.unit
+    def test_to_frame(self, connection):
+        profiler = enable_profiling(threshold=60.0)
+        select_orders().execute(connection).fetch_all()
+        frame = profiler.to_frame()
+        assert frame.columns[:4] == ["timestamp", "query", "params", "duration_ms"]
+        assert frame["params"].to_list() == ["[10]"]
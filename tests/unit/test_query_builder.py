@@ -1,5 +1,7 @@
+import dataclasses
+
 import pytest
-from src.database.query_executors import QueryBuilder
+from src.database.query_executors import CompiledQuery, QueryBuilder, QueryResult, compile_shape
 
 class TestQueryBuilderBasics:
     """Test basic QueryBuilder functionality."""
@@ -400,6 +402,14 @@ class TestQueryBuilderWhereConditions:
         query_str = str(builder)
         assert "WHERE role = 'admin' OR role = 'manager'" in query_str
 
+    @pytest.mark.unit
+    def test_and_or_where_without_where(self):
+        """Test and_where/or_where conditions are rendered with their params when where() is not set."""
+        assert QueryBuilder().select("*").from_table("t").and_where("a = %s", 1).get_sql() == (
+            "SELECT *\nFROM t\nWHERE a = %s", [1])
+        assert QueryBuilder().select("*").from_table("t").or_where("a = %s", 1).or_where("b = %s", 2).get_sql() == (
+            "SELECT *\nFROM t\nWHERE a = %s OR b = %s", [1, 2])
+
     @pytest.mark.unit
     def test_complex_where_with_and_or(self):
         """Test complex WHERE with both AND and OR."""
@@ -613,13 +623,14 @@ class TestQueryBuilderUtilityMethods:
     
     @pytest.mark.unit
     def test_get_sql_returns_string(self):
-        """Test get_sql() returns the SQL string."""
+        """Test get_sql() returns the SQL string and its parameters."""
         builder = QueryBuilder()
         builder.select("name").from_table("users").where("active = true")
         
-        sql = builder.get_sql()
+        sql, params = builder.get_sql()
         assert isinstance(sql, str)
-        assert "SELECT name FROM users WHERE active = true" in sql
+        assert sql == "SELECT name\nFROM users\nWHERE active = true"
+        assert params is None
 
     @pytest.mark.unit
     def test_get_params_returns_parameters(self):
@@ -631,14 +642,14 @@ class TestQueryBuilderUtilityMethods:
         assert params == [18, "New York"]
 
     @pytest.mark.unit
-    def test_execute_method_exists(self):
+    def test_execute_method_exists(self, connection_factory):
         """Test execute() method for running the query."""
         builder = QueryBuilder()
         builder.select("*").from_table("users")
         
-        # execute() should return self for method chaining in builder pattern
-        result = builder.execute()
-        assert result is builder
+        # execute() runs the query and returns its rows
+        result = builder.execute(connection_factory())
+        assert isinstance(result, QueryResult)
 
 
 class TestQueryBuilderComplexScenarios:
@@ -788,4 +799,147 @@ class TestQueryBuilderParameterization:
         """Test that mixing parameter styles raises error."""
         builder = QueryBuilder()
         with pytest.raises(ValueError, match="Cannot mix parameter styles"):
-            builder.select("*").from_table("users").where("age > %s", [18]).and_where("city = %(city)s", {"city": "NYC"})
\ No newline at end of file
+            builder.select("*").from_table("users").where("age > %s", [18]).and_where("city = %(city)s", {"city": "NYC"})
+
+    @pytest.mark.unit
+    def test_scalar_values_follow_their_condition(self):
+        """Test values passed inline after each condition are collected in order."""
+        builder = QueryBuilder()
+        builder.select("*").from_table("users").where("active = %s", True, "city = %s", "Berlin")
+        builder.or_where("role = %s", "admin")
+
+        sql, params = builder.get_sql()
+        assert "WHERE active = %s AND city = %s OR role = %s" in sql
+        assert params == [True, "Berlin", "admin"]
+
+    @pytest.mark.unit
+    def test_same_shape_gives_same_sql(self):
+        """Test queries that only differ in their values produce identical SQL."""
+        first = QueryBuilder().select("*").from_table("users").where("id = %s", 1)
+        second = QueryBuilder().select("*").from_table("users").where("id = %s", 2)
+
+        assert first.get_sql()[0] == second.get_sql()[0]
+        assert first.get_params() == [1]
+        assert second.get_params() == [2]
+
+    @pytest.mark.unit
+    def test_having_params_come_after_where_params(self):
+        """Test HAVING parameters follow WHERE parameters, matching placeholder order."""
+        builder = QueryBuilder()
+        builder.select("department", "COUNT(*)").from_table("employees")
+        builder.having("COUNT(*) > %s", 5).group_by("department").where("active = %s", True)
+
+        assert builder.get_params() == [True, 5]
+
+    @pytest.mark.unit
+    def test_wrong_parameter_count_raises_error(self):
+        """Test a parameter sequence must match the condition's placeholders."""
+        builder = QueryBuilder()
+        with pytest.raises(ValueError, match="Expected 2 parameters, got 1"):
+            builder.select("*").from_table("users").where("age > %s AND city = %s", [18])
+
+    @pytest.mark.unit
+    def test_missing_named_parameter_raises_error(self):
+        """Test every named placeholder needs a value."""
+        builder = QueryBuilder()
+        with pytest.raises(ValueError, match="Missing named parameters: city"):
+            builder.select("*").from_table("users").where("age > %(age)s AND city = %(city)s", {"age": 18})
+
+    @pytest.mark.unit
+    def test_literal_percent_is_not_a_placeholder(self):
+        """Test %% doesn't consume a parameter."""
+        builder = QueryBuilder()
+        builder.select("*").from_table("users").where("name LIKE 'J%%' AND age > %s", 18)
+
+        assert builder.get_params() == [18]
+
+    @pytest.mark.unit
+    def test_insert_values_are_parameters(self):
+        """Test inserted values are sent as parameters, not SQL text."""
+        builder = QueryBuilder()
+        builder.insert("users", [{"name": "John", "age": 30}, {"name": "Jane", "age": 25}])
+
+        sql, params = builder.get_sql()
+        assert sql == "INSERT INTO users (name, age)\nVALUES (%s, %s),\n(%s, %s)"
+        assert params == ["John", 30, "Jane", 25]
+
+    @pytest.mark.unit
+    def test_insert_rows_must_share_columns(self):
+        """Test rows with different columns can't go into one INSERT."""
+        builder = QueryBuilder()
+        with pytest.raises(ValueError, match="same columns"):
+            builder.insert("users", {"name": "John"}, {"email": "jane@example.com"})
+
+
+class TestQueryBuilderCompile:
+    """Test compiled query templates and the shared template cache."""
+
+    @pytest.fixture(autouse=True)
+    def empty_template_cache(self):
+        compile_shape.cache_clear()
+        yield
+        compile_shape.cache_clear()
+
+    @pytest.mark.unit
+    def test_compile_returns_immutable_template(self):
+        """Test compile() freezes the SQL and its parameter slots."""
+        template = QueryBuilder().select("*").from_table("users").where("age > %s AND city = %s", [18, "Berlin"]).compile()
+
+        assert isinstance(template, CompiledQuery)
+        assert template.sql == "SELECT *\nFROM users\nWHERE age > %s AND city = %s"
+        assert template.param_count == 2
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            template.sql = "DROP TABLE users"
+
+    @pytest.mark.unit
+    def test_bind_returns_sql_and_params(self):
+        """Test binding new values reuses the template's SQL."""
+        template = QueryBuilder().select("*").from_table("users").where("id = %s", 1).compile()
+
+        sql, params = template.bind([42])
+        assert sql is template.sql
+        assert params == [42]
+
+    @pytest.mark.unit
+    def test_bind_checks_parameter_count(self):
+        """Test binding the wrong number of values raises error."""
+        template = QueryBuilder().select("*").from_table("users").where("id = %s", 1).compile()
+
+        with pytest.raises(ValueError, match="Expected 1 parameters, got 2"):
+            template.bind([1, 2])
+
+    @pytest.mark.unit
+    def test_bind_named_parameters(self):
+        """Test named templates take a dict with every name."""
+        template = QueryBuilder().select("*").from_table("users").where("city = %(city)s", {"city": "Berlin"}).compile()
+
+        assert template.bind({"city": "Paris"}) == (template.sql, {"city": "Paris"})
+        with pytest.raises(ValueError, match="Missing named parameters: city"):
+            template.bind({})
+
+    @pytest.mark.unit
+    def test_same_shape_shares_one_template(self):
+        """Test builders of the same shape get the same cached template."""
+        first = QueryBuilder().select("*").from_table("users").where("id = %s", 1).compile()
+        second = QueryBuilder().select("*").from_table("users").where("id = %s", 2).compile()
+        other = QueryBuilder().select("*").from_table("users").where("id = %s", 1).limit(5).compile()
+
+        assert first is second
+        assert other is not first
+        info = compile_shape.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+
+    @pytest.mark.unit
+    def test_get_sql_uses_template_of_builder_shape(self):
+        """Test get_sql() returns the cached template's SQL."""
+        builder = QueryBuilder().select("*").from_table("users").where("id = %s", 1)
+        template = builder.compile()
+
+        assert builder.get_sql()[0] is template.sql
+        assert compile_shape.cache_info().hits == 1
+
+    @pytest.mark.unit
+    def test_compile_without_table_raises_error(self):
+        """Test an incomplete builder can't be compiled."""
+        with pytest.raises(ValueError, match="Table must be specified"):
+            QueryBuilder().select("*").compile()
@@ -0,0 +1,184 @@
+import psycopg2
+import pytest
+
+from src.database.exceptions import DatabaseError
+from src.database.pool import ConnectionPool
+from src.database.query_executors import QueryBuilder
+from src.database.validation import PassiveValidate
+
+ROWS = [(index, f"customer {index}") for index in range(10)]
+
+
+def customers_query():
+    return QueryBuilder().select("id", "name").from_table("customers").where("country = %s", "Germany")
+
+
+@pytest.fixture
+def connection(connection_factory):
+    connection = connection_factory()
+    connection.results.append(ROWS)
+    return connection
+
+
+@pytest.fixture
+def pool(connection_factory):
+    pool = ConnectionPool(1, 1, connection_factory, validation_policy=PassiveValidate())
+    yield pool
+    pool.closeall()
+
+
+class TestExecute:
+
+    @pytest.mark.unit
+    def test_select_runs_on_named_server_side_cursor(self, connection):
+        result = customers_query().execute(connection, itersize=500)
+
+        cursor = connection.cursors[0]
+        assert cursor.name.startswith("qb_cursor_")
+        assert cursor.itersize == 500
+        assert connection.executed == [("SELECT id,name\nFROM customers\nWHERE country = %s", ["Germany"])]
+        assert result.fetch_all() == ROWS
+
+    @pytest.mark.unit
+    def test_every_execution_gets_its_own_cursor_name(self, connection):
+        connection.results.append(ROWS)
+        customers_query().execute(connection)
+        customers_query().execute(connection)
+
+        assert connection.cursors[0].name != connection.cursors[1].name
+
+    @pytest.mark.unit
+    def test_insert_runs_on_regular_cursor(self, connection):
+        result = QueryBuilder().insert("customers", {"name": "Alfreds"}).execute(connection)
+
+        assert connection.cursors[0].name is None
+        assert result.rowcount == len(ROWS)
+
+    @pytest.mark.unit
+    def test_prepared_select_runs_through_statement_cache(self, connection):
+        connection.results.append(ROWS)
+        first = customers_query().prepared().execute(connection)
+        second = customers_query().prepared().execute(connection)
+
+        assert [cursor.name for cursor in connection.cursors] == [None, None]
+        (prepare, params), (execute, repeat_params) = connection.executed
+        assert prepare.startswith("PREPARE qb_")
+        assert "WHERE country = $1" in prepare
+        assert params == ["Germany"]
+        assert execute.startswith("EXECUTE qb_") and execute.endswith("(%s)")
+        assert repeat_params == ["Germany"]
+        assert first.fetch_all() == ROWS
+        assert second.fetch_all() == ROWS
+
+    @pytest.mark.unit
+    def test_postgres_errors_are_translated(self, connection, make_postgres_error):
+        connection.errors.append(make_postgres_error("42601"))
+
+        with pytest.raises(DatabaseError) as error:
+            customers_query().execute(connection)
+        assert error.value.details["query"].startswith("SELECT id,name")
+
+
+class TestQueryResult:
+
+    @pytest.mark.unit
+    def test_iteration_streams_rows_and_closes_cursor(self, connection):
+        result = customers_query().execute(connection)
+
+        assert next(result) == ROWS[0]
+        assert not connection.cursors[0].closed
+        assert list(result) == ROWS[1:]
+        assert connection.cursors[0].closed
+
+    @pytest.mark.unit
+    def test_fetch_one_closes_result(self, connection):
+        result = customers_query().execute(connection)
+
+        assert result.fetch_one() == ROWS[0]
+        assert connection.cursors[0].closed
+        assert result.fetch_all() == []
+
+    @pytest.mark.unit
+    def test_fetch_one_on_empty_result(self, connection_factory):
+        connection = connection_factory()
+        connection.results.append([])
+
+        assert customers_query().execute(connection).fetch_one() is None
+
+    @pytest.mark.unit
+    def test_fetch_batches(self, connection):
+        batches = list(customers_query().execute(connection).fetch_batches(4))
+
+        assert batches == [ROWS[:4], ROWS[4:8], ROWS[8:]]
+        assert connection.cursors[0].closed
+
+    @pytest.mark.unit
+    def test_fetch_batches_rejects_empty_batches(self, connection):
+        with pytest.raises(ValueError, match="Batch size must be positive"):
+            next(customers_query().execute(connection).fetch_batches(0))
+
+    @pytest.mark.unit
+    def test_autocommit_connection_uses_holdable_cursor(self, connection):
+        connection.autocommit = True
+        customers_query().execute(connection)
+
+        assert connection.cursors[0].name is not None
+
+    @pytest.mark.unit
+    def test_own_connection_transaction_is_left_alone(self, connection):
+        customers_query().execute(connection).fetch_all()
+
+        assert connection.transactions == []
+
+
+class TestExecuteOnPool:
+
+    @pytest.mark.unit
+    def test_connection_is_held_until_result_is_exhausted(self, pool, connection_factory):
+        connection_factory.created[0].results.append(ROWS)
+        result = customers_query().execute(pool)
+
+        assert pool.in_use_count == 1
+        assert result.fetch_all() == ROWS
+        assert pool.in_use_count == 0
+        assert connection_factory.created[0].transactions == ["commit"]
+
+    @pytest.mark.unit
+    def test_closing_early_returns_connection(self, pool, connection_factory):
+        with customers_query().execute(pool) as result:
+            next(result)
+
+        assert pool.in_use_count == 0
+
+    @pytest.mark.unit
+    def test_failed_query_rolls_back_and_returns_connection(self, pool, connection_factory, make_postgres_error):
+        connection = connection_factory.created[0]
+        connection.errors.append(make_postgres_error("42P01"))
+
+        with pytest.raises(DatabaseError):
+            customers_query().execute(pool)
+
+        assert pool.in_use_count == 0
+        assert connection.transactions == ["rollback"]
+        assert pool.stats().errors == {"42": 1}
+
+    @pytest.mark.unit
+    def test_error_while_fetching_rolls_back(self, pool, connection_factory):
+        connection = connection_factory.created[0]
+        result = customers_query().execute(pool)
+        connection.cursors[0].fetchmany = lambda size: (_ for _ in ()).throw(
+            psycopg2.OperationalError("server closed the connection unexpectedly"))
+
+        with pytest.raises(DatabaseError):
+            next(result.fetch_batches(10))
+
+        assert pool.in_use_count == 0
+        assert connection.transactions == ["rollback"]
+
+    @pytest.mark.unit
+    def test_insert_is_committed_right_away(self, pool, connection_factory):
+        result = QueryBuilder().insert("customers", {"name": "Alfreds"}).execute(pool)
+
+        assert pool.in_use_count == 0
+        assert connection_factory.created[0].transactions == ["commit"]
+        assert result.rowcount == 1
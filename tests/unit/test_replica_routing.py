@@ -0,0 +1,205 @@
+import time
+
+import psycopg2
+import pytest
+
+from config import DataBaseSettings
+from src.database.connection import PooledDatabaseConnection, PostgreSQLConnectionPool, replica_address
+from src.database.exceptions import ConfigurationError
+from src.database.pool import ConnectionPool
+from src.database.query_executors import QueryBuilder
+from src.database.routing import ReplicaRouter, read_source
+from src.database.validation import PassiveValidate
+from tests.conftest import FakeConnection
+
+
+def fake_pool(size=2):
+    """A pool of FakeConnections, which remembers every connection it opened in created."""
+    created = []
+
+    def factory():
+        created.append(FakeConnection())
+        return created[-1]
+
+    pool = ConnectionPool(0, size, factory, validation_policy=PassiveValidate())
+    pool.created = created
+    return pool
+
+
+def executed_on(pool):
+    return [sql for connection in pool.created for sql, _ in connection.executed]
+
+
+@pytest.fixture
+def router():
+    return ReplicaRouter(fake_pool(), [fake_pool(), fake_pool()])
+
+
+class TestRouting:
+
+    @pytest.mark.unit
+    def test_writes_go_to_the_primary(self, router):
+        connection = router.getconn()
+        assert router.primary.in_use_count == 1
+        router.putconn(connection)
+
+        QueryBuilder().insert("orders", {"order_id": 1}).execute(router)
+
+        assert executed_on(router.primary) == ["INSERT INTO orders (order_id)\nVALUES (%s)"]
+        assert all(not executed_on(replica) for replica in router.replicas)
+
+    @pytest.mark.unit
+    def test_pooled_connections_are_primary_connections(self, router):
+        with PooledDatabaseConnection(router) as connection:
+            assert connection in router.primary.created
+        assert router.stats().checkouts == 1
+
+    @pytest.mark.unit
+    def test_selects_go_to_a_replica(self, router):
+        QueryBuilder().select("*").from_table("orders").execute(router).fetch_all()
+
+        assert not executed_on(router.primary)
+        assert sum(len(executed_on(replica)) for replica in router.replicas) == 1
+        assert router.reads == {"primary": 0, "replica": 1}
+
+    @pytest.mark.unit
+    def test_plain_sources_are_not_routed(self, router):
+        connection = FakeConnection()
+        assert read_source(connection) is connection
+        assert read_source(router.primary) is router.primary
+
+    @pytest.mark.unit
+    def test_round_robin(self):
+        router = ReplicaRouter(fake_pool(), [fake_pool(), fake_pool(), fake_pool()], strategy="round_robin")
+        picked = [router.read_pool() for _ in range(6)]
+        assert picked == router.replicas * 2
+
+    @pytest.mark.unit
+    def test_least_outstanding_prefers_idle_replicas(self, router):
+        busy, idle = router.replicas
+        held = busy.getconn()
+
+        assert all(router.read_pool() is idle for _ in range(4))
+        busy.putconn(held)
+        assert {router.read_pool() for _ in range(2)} == {busy, idle}
+
+    @pytest.mark.unit
+    def test_least_outstanding_accounts_for_pool_size(self):
+        small, large = fake_pool(size=1), fake_pool(size=10)
+        router = ReplicaRouter(fake_pool(), [small, large])
+        small.getconn()
+        large.getconn()
+
+        assert router.read_pool() is large
+
+    @pytest.mark.unit
+    def test_unknown_strategy(self):
+        with pytest.raises(ConfigurationError):
+            ReplicaRouter(fake_pool(), [], strategy="random")
+
+
+class TestReplicaLag:
+
+    def queue_lag(self, replica, lag):
+        connection = replica.getconn()
+        connection.results.append([(lag,)])
+        replica.putconn(connection)
+
+    @pytest.mark.unit
+    def test_lagging_replicas_get_no_reads(self):
+        router = ReplicaRouter(fake_pool(), [fake_pool(), fake_pool()], max_lag=5.0)
+        behind, current = router.replicas
+        self.queue_lag(behind, 12.5)
+        self.queue_lag(current, 0.2)
+
+        router.check_replicas()
+
+        assert router.lags == [12.5, 0.2]
+        assert "pg_last_xact_replay_timestamp()" in executed_on(behind)[0]
+        assert all(router.read_pool() is current for _ in range(4))
+
+    @pytest.mark.unit
+    def test_reads_fall_back_to_the_primary(self):
+        router = ReplicaRouter(fake_pool(), [fake_pool()], max_lag=5.0)
+        self.queue_lag(router.replicas[0], 60.0)
+        router.check_replicas()
+
+        assert router.read_pool() is router.primary
+        assert router.reads == {"primary": 1, "replica": 0}
+
+    @pytest.mark.unit
+    def test_lag_is_ignored_without_max_lag(self, router):
+        self.queue_lag(router.replicas[0], 600.0)
+        router.check_replicas()
+
+        assert router.replicas[0] in router.healthy_replicas()
+
+    @pytest.mark.unit
+    def test_unreachable_replicas_get_no_reads_until_they_recover(self, router):
+        down, up = router.replicas
+        connection = down.getconn()
+        connection.unreachable = True
+        down.putconn(connection)
+
+        router.check_replicas()
+
+        assert router.lags[0] is None
+        assert down.size == 0
+        assert router.healthy_replicas() == [up]
+
+        router.check_replicas()
+        assert router.lags[0] == 1.0
+        assert router.healthy_replicas() == [down, up]
+
+    @pytest.mark.unit
+    def test_busy_replica_is_not_waited_for(self):
+        busy = ConnectionPool(0, 1, FakeConnection, timeout=30.0, validation_policy=PassiveValidate())
+        router = ReplicaRouter(fake_pool(), [busy, fake_pool()])
+        busy.getconn()
+        self.queue_lag(router.replicas[1], 0.5)
+
+        started = time.monotonic()
+        router.check_replicas()
+
+        assert time.monotonic() - started < 1.0
+        assert router.lags == [None, 0.5]
+
+
+class TestReplicaConfiguration:
+
+    @pytest.mark.unit
+    def test_replica_address(self):
+        assert replica_address("replica-1") == {"host": "replica-1"}
+        assert replica_address("replica-2:5433") == {"host": "replica-2", "port": 5433}
+
+    @pytest.mark.unit
+    def test_pool_with_replica_hosts_is_a_router(self):
+        settings = DataBaseSettings(HOST="127.0.0.1", NAME="test_db", USERNAME="test_user", PASSWORD="test_password",
+                                    MIN_CONNECTIONS=0, REPLICA_HOSTS=["127.0.0.1:1", "127.0.0.1:2"],
+                                    ROUTING_STRATEGY="round_robin", MAX_REPLICA_LAG=2.0)
+
+        with PostgreSQLConnectionPool("test-replicas", settings=settings) as router:
+            assert isinstance(router, ReplicaRouter)
+            assert router.strategy == "round_robin" and router.max_lag == 2.0
+            assert [replica._connection_factory.keywords["port"] for replica in router.replicas] == [1, 2]
+            # Nothing listens on those ports, so reads stay on the primary
+            assert router.lags == [None, None]
+            assert router.read_pool() is router.primary
+        assert router.primary.closed and all(replica.closed for replica in router.replicas)
+
+    @pytest.mark.unit
+    def test_unreachable_replica_at_startup_gets_no_reads(self, monkeypatch):
+        def connect(**parameters):
+            if parameters["host"] == "replica-down":
+                raise psycopg2.OperationalError("could not connect to server")
+            return FakeConnection()
+
+        monkeypatch.setattr(psycopg2, "connect", connect)
+        settings = DataBaseSettings(HOST="primary", NAME="test_db", USERNAME="test_user", PASSWORD="test_password",
+                                    MIN_CONNECTIONS=1, VALIDATION_POLICY="passive",
+                                    REPLICA_HOSTS=["replica-down", "replica-up"])
+
+        with PostgreSQLConnectionPool("test-replica-down", settings=settings) as router:
+            assert router.lags == [None, 1.0]
+            assert router.healthy_replicas() == [router.replicas[1]]
+            assert [replica.min_connections for replica in router.replicas] == [1, 1]
@@ -0,0 +1,161 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from src.models.customer import Customer
+from src.models.order import Order
+from src.repositories import CustomerRepository, DataLoader, OrderRepository, ProductRepository, RequestScope
+from tests.conftest import FakeConnection
+
+
+def customer_row(customer_id, company_name):
+    return (customer_id, company_name, None, None, "Berlin", "Germany", None)
+
+
+def order_row(order_id, customer_id):
+    return (order_id, customer_id, 1, date(1997, 8, 25), None, Decimal("29.46"), "Germany")
+
+
+def product_row(order_id, product_id, name):
+    return (order_id, product_id, name, 1, 1, Decimal("18.00"), 39, False)
+
+
+class RecordingBatchLoad:
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, keys):
+        self.calls.append(keys)
+        if self.fail:
+            raise RuntimeError("database is down")
+        return {key: key * 10 for key in keys if key > 0}
+
+
+class TestDataLoader:
+
+    @pytest.mark.unit
+    def test_loads_are_coalesced_and_deduplicated(self):
+        batch_load = RecordingBatchLoad()
+        loader = DataLoader(batch_load)
+
+        first, second, again = loader.load(1), loader.load(2), loader.load(1)
+        assert batch_load.calls == []
+
+        assert first.result() == 10
+        assert second.result() == 20 and again is first
+        assert loader.load_many([2, 1, -1]) == [20, 10, None]
+        assert batch_load.calls == [[1, 2], [-1]]
+
+    @pytest.mark.unit
+    def test_max_batch_size(self):
+        batch_load = RecordingBatchLoad()
+        loader = DataLoader(batch_load, max_batch_size=2)
+        assert loader.load_many([1, 2, 3, 4, 5]) == [10, 20, 30, 40, 50]
+        assert batch_load.calls == [[1, 2], [3, 4], [5]]
+        assert loader.batches == 3
+
+    @pytest.mark.unit
+    def test_failures_are_not_cached(self):
+        batch_load = RecordingBatchLoad(fail=True)
+        loader = DataLoader(batch_load)
+        deferred = loader.load(1)
+        with pytest.raises(RuntimeError):
+            deferred.result()
+        with pytest.raises(RuntimeError):
+            deferred.result()
+
+        batch_load.fail = False
+        assert loader.load(1).result() == 10
+        assert len(batch_load.calls) == 2
+
+    @pytest.mark.unit
+    def test_prime_and_clear(self):
+        batch_load = RecordingBatchLoad()
+        loader = DataLoader(batch_load)
+        queued = loader.load(3)
+
+        loader.prime(3, "primed")
+        loader.prime(4, "primed")
+        assert queued.result() == "primed"
+        assert loader.load(4).result() == "primed"
+        assert batch_load.calls == []
+
+        loader.clear(4)
+        assert loader.load(4).result() == 40
+        loader.clear()
+        assert loader.load(3).result() == 30
+
+
+class TestRepositories:
+
+    @pytest.fixture
+    def connection(self):
+        return FakeConnection()
+
+    @pytest.mark.unit
+    def test_get_by_id_calls_share_one_query(self, connection):
+        connection.results = [[customer_row("ALFKI", "Alfreds Futterkiste"), customer_row("ANATR", "Ana Trujillo")]]
+        customers = CustomerRepository(connection)
+
+        alfki, anatr, missing = customers.load("ALFKI"), customers.load("ANATR"), customers.load("NOONE")
+
+        assert alfki.result() == Customer("ALFKI", "Alfreds Futterkiste", city="Berlin", country="Germany")
+        assert anatr.result().company_name == "Ana Trujillo"
+        assert missing.result() is None
+        assert customers.get_by_id("ALFKI") is alfki.result()
+        [(sql, params)] = connection.executed
+        assert sql.startswith("SELECT customer_id,company_name,contact_name")
+        assert "FROM customers\nWHERE customer_id = ANY(%s)" in sql
+        assert params == [["ALFKI", "ANATR", "NOONE"]]
+
+    @pytest.mark.unit
+    def test_orders_for_customers_prime_orders_by_id(self, connection):
+        connection.results = [[order_row(10643, "ALFKI"), order_row(10692, "ALFKI")]]
+        orders = OrderRepository(connection)
+
+        by_customer = orders.for_customers(["ALFKI", "ANATR"])
+
+        assert [order.order_id for order in by_customer["ALFKI"]] == [10643, 10692]
+        assert by_customer["ANATR"] == []
+        assert isinstance(orders.get_by_id(10692), Order)
+        assert len(connection.executed) == 1
+
+    @pytest.mark.unit
+    def test_products_for_orders_share_instances(self, connection):
+        connection.results = [[product_row(10248, 11, "Queso Cabrales"), product_row(10248, 42, "Tofu"),
+                               product_row(10249, 42, "Tofu")]]
+        products = ProductRepository(connection)
+
+        by_order = products.for_orders([10248, 10249, 10250])
+
+        assert [product.product_id for product in by_order[10248]] == [11, 42]
+        assert by_order[10249][0] is by_order[10248][1]
+        assert by_order[10250] == []
+        assert products.get_by_id(42).product_name == "Tofu"
+        [(sql, params)] = connection.executed
+        assert "FROM order_details od\nINNER JOIN products p ON p.product_id = od.product_id" in sql
+        assert params == [[10248, 10249, 10250]]
+
+    @pytest.mark.unit
+    def test_request_scope_avoids_n_plus_one(self, connection):
+        connection.results = [
+            [customer_row("ALFKI", "Alfreds Futterkiste"), customer_row("ANATR", "Ana Trujillo")],
+            [order_row(10643, "ALFKI"), order_row(10692, "ALFKI"), order_row(10308, "ANATR")],
+            [product_row(10643, 28, "Rössle Sauerkraut"), product_row(10692, 63, "Vegie-spread"),
+             product_row(10308, 69, "Gudbrandsdalsost")],
+        ]
+        scope = RequestScope(connection)
+
+        result = scope.customer_orders_with_products(["ALFKI", "ANATR"])
+
+        customer, orders = result["ALFKI"]
+        assert customer.company_name == "Alfreds Futterkiste"
+        assert [(order.order_id, [product.product_id for product in products]) for order, products in orders] == \
+            [(10643, [28]), (10692, [63])]
+        assert len(connection.executed) == 3
+        assert scope.customers is scope.customers
+        assert scope.customers.get_by_id("ANATR") is result["ANATR"][0]
+        assert len(connection.executed) == 3
@@ -0,0 +1,290 @@
+import threading
+
+import pytest
+
+from src.database.bulk import bulk_insert
+from src.database.query_executors import CachedQueryResult, QueryBuilder
+from src.database.result_cache import (ResultCache, estimate_size, freeze_params, referenced_tables, table_name,
+                                       tables_written, transaction_ended)
+from src.database.transaction import transaction
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return ResultCache(default_ttl=60, clock=clock)
+
+
+def load(rows):
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return rows
+
+    loader.calls = calls
+    return loader
+
+
+class TestKeys:
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("reference, expected", [
+        ("categories", "categories"),
+        ("public.Orders o", "orders"),
+        ('"Suppliers" s', "suppliers"),
+    ])
+    def test_table_name(self, reference, expected):
+        assert table_name(reference) == expected
+
+    @pytest.mark.unit
+    def test_referenced_tables_include_joins(self):
+        joins = ["INNER JOIN categories c ON c.category_id = p.category_id", "LEFT JOIN suppliers s ON true"]
+        assert referenced_tables("products p", joins) == {"products", "categories", "suppliers"}
+
+    @pytest.mark.unit
+    def test_freeze_params(self):
+        assert freeze_params([1, [2, 3]]) == (1, (2, 3))
+        assert freeze_params({"b": 1, "a": [2]}) == (("a", (2,)), ("b", 1))
+        assert hash(freeze_params({"ids": [1, 2]}))
+
+
+class TestResultCache:
+
+    @pytest.mark.unit
+    def test_hit_after_fill(self, cache):
+        loader = load([(1, "Beverages")])
+
+        assert cache.get_or_load("key", loader) == ((1, "Beverages"),)
+        assert cache.get_or_load("key", loader) == ((1, "Beverages"),)
+        assert len(loader.calls) == 1
+        assert cache.stats()["hits"] == 1
+
+    @pytest.mark.unit
+    def test_entries_expire_after_ttl(self, cache, clock):
+        loader = load([(1,)])
+        cache.get_or_load("key", loader, ttl=10)
+
+        clock.now += 9
+        cache.get_or_load("key", loader, ttl=10)
+        clock.now += 2
+        cache.get_or_load("key", loader, ttl=10)
+        assert len(loader.calls) == 2
+
+    @pytest.mark.unit
+    def test_lru_is_bounded_by_size(self, clock):
+        rows = [(index, "x" * 100) for index in range(10)]
+        cache = ResultCache(max_bytes=3 * estimate_size(tuple(rows)), clock=clock)
+
+        for key in ("a", "b", "c"):
+            cache.get_or_load(key, load(rows))
+        cache.get_or_load("a", load(rows))
+        cache.get_or_load("d", load(rows))
+
+        assert cache.stats()["bytes"] <= cache.max_bytes
+        assert cache.evictions == 1
+        assert cache.get_or_load("a", load([])) == tuple(rows)
+        assert cache.get_or_load("b", load([])) == ()
+
+    @pytest.mark.unit
+    def test_result_bigger_than_cache_is_not_stored(self, clock):
+        cache = ResultCache(max_bytes=10, clock=clock)
+        cache.get_or_load("key", load([(1,)]))
+
+        assert len(cache) == 0
+
+    @pytest.mark.unit
+    def test_failed_load_is_not_cached(self, cache):
+        def failing():
+            raise RuntimeError("query failed")
+
+        with pytest.raises(RuntimeError):
+            cache.get_or_load("key", failing)
+        assert cache.get_or_load("key", load([(1,)])) == ((1,),)
+
+    @pytest.mark.unit
+    def test_concurrent_misses_share_one_fill(self, cache):
+        release = threading.Event()
+        calls = []
+
+        def slow_load():
+            calls.append(1)
+            release.wait(5)
+            return [(1,)]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("key", slow_load)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced < 4:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [((1,),)] * 5
+
+    @pytest.mark.unit
+    def test_waiters_see_the_fill_error(self, cache):
+        release = threading.Event()
+
+        def failing_load():
+            release.wait(5)
+            raise RuntimeError("query failed")
+
+        errors = []
+
+        def get():
+            try:
+                cache.get_or_load("key", failing_load)
+            except RuntimeError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced < 2:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(errors) == 3
+
+    @pytest.mark.unit
+    def test_write_invalidates_entries_reading_table(self, cache):
+        cache.get_or_load("categories", load([(1,)]), tables={"categories"})
+        cache.get_or_load("products", load([(2,)]), tables={"products", "categories"})
+        cache.get_or_load("shippers", load([(3,)]), tables={"shippers"})
+
+        tables_written("public.categories")
+
+        assert len(cache) == 1
+        assert cache.invalidations == 2
+
+    @pytest.mark.unit
+    def test_write_during_fill_keeps_result_out_of_cache(self, cache):
+        def load_then_write():
+            cache.invalidate_tables("categories")
+            return [(1,)]
+
+        cache.get_or_load("key", load_then_write, tables={"categories"})
+        assert len(cache) == 0
+
+
+class TestCachedQueries:
+
+    @pytest.fixture
+    def categories(self, cache):
+        return QueryBuilder().select("category_id", "name").from_table("categories").cached(cache=cache)
+
+    @pytest.mark.unit
+    def test_second_execute_is_served_from_cache(self, categories, connection_factory):
+        connection = connection_factory()
+        connection.results.append([(1, "Beverages"), (2, "Condiments")])
+
+        first = categories.execute(connection).fetch_all()
+        second = categories.execute(connection)
+
+        assert isinstance(second, CachedQueryResult)
+        assert second.fetch_all() == first == [(1, "Beverages"), (2, "Condiments")]
+        assert len(connection.executed) == 1
+
+    @pytest.mark.unit
+    def test_cached_result_interface(self, categories, connection_factory):
+        connection = connection_factory()
+        connection.results.append([(1,), (2,), (3,)])
+        categories.execute(connection).fetch_all()
+
+        assert list(categories.execute(connection).fetch_batches(2)) == [[(1,), (2,)], [(3,)]]
+        assert categories.execute(connection).fetch_one() == (1,)
+        assert categories.execute(connection).rowcount == 3
+
+    @pytest.mark.unit
+    def test_params_are_part_of_the_key(self, cache, connection_factory):
+        connection = connection_factory()
+        for category in (1, 2, 1):
+            (QueryBuilder().select("*").from_table("products").where("category_id = %s", category)
+             .cached(cache=cache).execute(connection).fetch_all())
+
+        assert len(connection.executed) == 2
+
+    @pytest.mark.unit
+    def test_insert_through_builder_invalidates(self, categories, connection_factory):
+        connection = connection_factory()
+        categories.execute(connection).fetch_all()
+
+        QueryBuilder().insert("categories", {"name": "Seafood"}).execute(connection)
+        categories.execute(connection).fetch_all()
+
+        assert len(connection.executed) == 3
+
+    @pytest.mark.unit
+    def test_bulk_insert_invalidates(self, categories, connection_factory):
+        connection = connection_factory()
+        categories.execute(connection).fetch_all()
+
+        bulk_insert(connection, "categories", [{"name": "Seafood"}])
+        categories.execute(connection).fetch_all()
+
+        assert len(connection.executed) == 3
+
+    @pytest.mark.unit
+    def test_uncommitted_write_is_invalidated_again_when_its_transaction_ends(self, categories, connection_factory):
+        connection = connection_factory()
+        reader = connection_factory()
+        QueryBuilder().insert("categories", {"name": "Seafood"}).execute(connection)
+
+        categories.execute(reader).fetch_all()  # Still sees the rows from before the write
+        connection.commit()
+        transaction_ended(connection)
+        categories.execute(reader).fetch_all()
+
+        assert len(reader.executed) == 2
+
+    @pytest.mark.unit
+    def test_transaction_invalidates_after_commit(self, categories, connection_factory):
+        connection = connection_factory()
+        reader = connection_factory()
+
+        with transaction(connection) as conn:
+            bulk_insert(conn, "categories", [{"name": "Seafood"}])
+            categories.execute(reader).fetch_all()
+        categories.execute(reader).fetch_all()
+
+        assert connection.transactions == ["commit"]
+        assert len(reader.executed) == 2
+
+    @pytest.mark.unit
+    def test_autocommit_write_is_not_pending(self, categories, connection_factory):
+        connection = connection_factory()
+        connection.autocommit = True
+        tables_written("categories", connection=connection)
+        categories.execute(connection).fetch_all()
+
+        transaction_ended(connection)
+        categories.execute(connection).fetch_all()
+
+        assert len(connection.executed) == 1
+
+    @pytest.mark.unit
+    def test_uncached_builder_streams(self, connection_factory):
+        connection = connection_factory()
+        result = QueryBuilder().select("*").from_table("categories").execute(connection)
+
+        assert not isinstance(result, CachedQueryResult)
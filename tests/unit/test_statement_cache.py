@@ -0,0 +1,161 @@
+import psycopg2.extensions
+import pytest
+from src.database.statement_cache import (PreparedStatementCache, get_statement_cache, normalize_sql,
+                                          to_server_placeholders)
+
+
+class TestSqlNormalization:
+
+    @pytest.mark.unit
+    def test_whitespace_is_collapsed(self):
+        assert normalize_sql("SELECT name\n  FROM users\tWHERE id = %s ") == "SELECT name FROM users WHERE id = %s"
+
+    @pytest.mark.unit
+    def test_quoted_text_is_left_alone(self):
+        assert normalize_sql("SELECT  'a   b' FROM \"My  Table\"") == "SELECT 'a   b' FROM \"My  Table\""
+
+    @pytest.mark.unit
+    def test_comments_are_dropped(self):
+        query = "SELECT name -- the display name\n  FROM users /* all of them */\nWHERE id = %s -- by key"
+        assert normalize_sql(query) == "SELECT name FROM users WHERE id = %s"
+
+    @pytest.mark.unit
+    def test_comment_markers_in_quotes_are_kept(self):
+        query = "SELECT '--  not a comment', E'it\\'s -- text', $body$a  -- b$body$\nFROM t"
+        assert normalize_sql(query) == "SELECT '--  not a comment', E'it\\'s -- text', $body$a  -- b$body$ FROM t"
+
+    @pytest.mark.unit
+    def test_nested_block_comments_are_left_alone(self):
+        query = "SELECT 1 /* outer /* inner */ still a comment */\nFROM t"
+        assert normalize_sql(query) == query
+
+    @pytest.mark.unit
+    def test_positional_placeholders(self):
+        assert to_server_placeholders("a = %s AND b = %s") == ("a = $1 AND b = $2", 2)
+
+    @pytest.mark.unit
+    def test_named_placeholders_are_numbered_once(self):
+        translated, names = to_server_placeholders("a = %(x)s OR b = %(y)s OR c = %(x)s")
+
+        assert translated == "a = $1 OR b = $2 OR c = $1"
+        assert names == ["x", "y"]
+
+    @pytest.mark.unit
+    def test_escaped_percent(self):
+        assert to_server_placeholders("name LIKE 'J%%' AND id = %s") == ("name LIKE 'J%' AND id = $1", 1)
+
+    @pytest.mark.unit
+    def test_mixed_placeholders_raise(self):
+        with pytest.raises(ValueError, match="Cannot mix parameter styles"):
+            to_server_placeholders("a = %s AND b = %(b)s")
+
+
+class TestPreparedStatementCache:
+
+    @pytest.mark.unit
+    def test_first_execution_prepares_and_repeat_only_executes(self, connection_factory):
+        connection = connection_factory()
+        cache = PreparedStatementCache()
+
+        cache.execute(connection.cursor(), "SELECT * FROM orders WHERE customer_id = %s", ["ALFKI"])
+        cache.execute(connection.cursor(), "SELECT *  FROM orders\nWHERE customer_id = %s", ["ANATR"])
+
+        first, second = connection.executed
+        assert first[0].startswith("PREPARE qb_")
+        assert "AS SELECT * FROM orders WHERE customer_id = $1; EXECUTE qb_" in first[0]
+        assert first[0].endswith("(%s)")
+        assert second == (first[0].split("; ")[1], ["ANATR"])
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @pytest.mark.unit
+    def test_named_parameters(self, connection_factory):
+        connection = connection_factory()
+        cache = PreparedStatementCache()
+
+        cache.execute(connection.cursor(), "SELECT * FROM users WHERE city = %(city)s", {"city": "Berlin"})
+
+        query, params = connection.executed[0]
+        assert query.endswith("(%(city)s)")
+        assert params == {"city": "Berlin"}
+
+    @pytest.mark.unit
+    def test_least_recently_used_statement_is_deallocated(self, connection_factory):
+        connection = connection_factory()
+        cache = PreparedStatementCache(max_size=2)
+
+        cache.execute(connection.cursor(), "SELECT 1")
+        cache.execute(connection.cursor(), "SELECT 2")
+        cache.execute(connection.cursor(), "SELECT 1")
+        cache.execute(connection.cursor(), "SELECT 3")
+        cache.execute(connection.cursor(), "SELECT 1")
+
+        assert "SELECT 2" not in cache
+        assert "SELECT 1" in cache
+        assert connection.executed[-1][0].startswith("DEALLOCATE qb_")
+        assert cache.stats()["evictions"] == 1
+
+    @pytest.mark.unit
+    def test_stale_plan_is_prepared_again_and_retried(self, connection_factory, make_postgres_error):
+        connection = connection_factory()
+        cache = PreparedStatementCache()
+        cache.execute(connection.cursor(), "SELECT * FROM products")
+        connection.errors.append(make_postgres_error("0A000", "cached plan must not change result type"))
+
+        cache.execute(connection.cursor(), "SELECT * FROM products")
+
+        retried = connection.executed[-1][0]
+        assert retried.startswith("DEALLOCATE qb_")
+        assert "PREPARE" in retried
+        assert cache.invalidations == 1
+
+    @pytest.mark.unit
+    def test_stale_plan_inside_transaction_is_raised(self, connection_factory, make_postgres_error):
+        connection = connection_factory()
+        cache = PreparedStatementCache()
+        cache.execute(connection.cursor(), "SELECT * FROM products")
+        connection.errors.append(make_postgres_error("0A000", "cached plan must not change result type"))
+        connection.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+        with pytest.raises(psycopg2.errors.FeatureNotSupported):
+            cache.execute(connection.cursor(), "SELECT * FROM products")
+        assert "SELECT * FROM products" not in cache
+
+    @pytest.mark.unit
+    def test_failed_prepare_is_forgotten(self, connection_factory, make_postgres_error):
+        connection = connection_factory()
+        cache = PreparedStatementCache()
+        connection.errors.append(make_postgres_error("42601", "syntax error"))
+
+        with pytest.raises(psycopg2.Error):
+            cache.execute(connection.cursor(), "SELEC 1")
+        connection.results.append([])  # The PREPARE failed, nothing to deallocate
+        cache.execute(connection.cursor(), "SELEC 1")
+
+        first_name = connection.executed[0][0].split()[1]
+        second_name = connection.executed[-1][0].split()[1]
+        assert first_name != second_name
+        assert connection.executed[1] == ("SELECT name FROM pg_prepared_statements WHERE name = ANY(%s)",
+                                          [[first_name]])
+
+    @pytest.mark.unit
+    def test_statement_of_failed_execute_is_deallocated(self, connection_factory, make_postgres_error):
+        connection = connection_factory()
+        cache = PreparedStatementCache()
+        insert = "INSERT INTO customers (customer_id) VALUES (%s)"
+        connection.errors.append(make_postgres_error("23505", "duplicate key value violates unique constraint"))
+
+        with pytest.raises(psycopg2.Error):
+            cache.execute(connection.cursor(), insert, ["ALFKI"])
+        leaked = connection.executed[0][0].split()[1]
+        connection.results.append([(leaked,)])  # PREPARE went through, EXECUTE failed
+        cache.execute(connection.cursor(), insert, ["ANATR"])
+
+        assert connection.executed[-1][0].startswith(f"DEALLOCATE {leaked}; PREPARE qb_")
+        assert leaked not in connection.executed[-1][0].split("; ", 1)[1]
+
+    @pytest.mark.unit
+    def test_one_cache_per_connection(self, connection_factory):
+        first, second = connection_factory(), connection_factory()
+
+        assert get_statement_cache(first) is get_statement_cache(first)
+        assert get_statement_cache(first) is not get_statement_cache(second)
@@ -0,0 +1,240 @@
+import asyncio
+import socket
+import time
+from types import SimpleNamespace
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import pytest
+
+from src.database.async_connection import execute
+from src.database.connection import PooledDatabaseConnection
+from src.database.exceptions import AdminInterventionError, DatabaseError, QueryTimeoutError
+from src.database.pool import ConnectionPool
+from src.database.query_executors import QueryBuilder
+from src.database.timeouts import (Deadline, connection_options, is_timeout, reset_timeouts, set_timeouts,
+                                   watch)
+from src.database.validation import PassiveValidate
+from tests.conftest import FakeConnection
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def server_error(sqlstate, message="canceling statement due to statement timeout"):
+    """An exception carrying its SQLSTATE in diag, like the ones psycopg2 raises for the server."""
+    diag = SimpleNamespace(sqlstate=sqlstate, message_detail=None, constraint_name=None, schema_name=None,
+                           table_name=None, column_name=None, statement_position=None)
+    return type("ServerError", (psycopg2.OperationalError,), {"diag": diag})(message)
+
+
+def wait_until(condition, timeout=2.0):
+    ends = time.monotonic() + timeout
+    while not condition() and time.monotonic() < ends:
+        time.sleep(0.005)
+    return condition()
+
+
+@pytest.fixture
+def pool(connection_factory):
+    return ConnectionPool(0, 1, connection_factory, validation_policy=PassiveValidate())
+
+
+class TestDeadline:
+
+    @pytest.mark.unit
+    def test_remaining(self):
+        clock = FakeClock()
+        deadline = Deadline(2.0, clock)
+        clock.now += 0.5
+        assert deadline.remaining() == 1.5 and not deadline.expired
+        clock.now += 5
+        assert deadline.remaining() == 0.0 and deadline.expired
+
+    @pytest.mark.unit
+    def test_of_and_earliest(self):
+        deadline = Deadline(10.0)
+        assert Deadline.of(None) is None
+        assert Deadline.of(deadline) is deadline
+        sooner = Deadline.of(1.0)
+        assert Deadline.earliest(deadline, None, sooner) is sooner
+        assert Deadline.earliest(None, None) is None
+
+
+class TestServerTimeouts:
+
+    @pytest.mark.unit
+    def test_connection_options(self):
+        assert connection_options() is None
+        assert connection_options(30, 0.5) == "-c statement_timeout=30000 -c lock_timeout=500"
+
+    @pytest.mark.unit
+    def test_set_timeouts_for_the_transaction(self):
+        connection = FakeConnection()
+
+        assert set_timeouts(connection, 1.5, 0.25) is False
+        assert connection.executed == [("SELECT set_config(%s, %s, %s), set_config(%s, %s, %s)",
+                                         ["statement_timeout", "1500ms", True, "lock_timeout", "250ms", True])]
+
+    @pytest.mark.unit
+    def test_set_timeouts_for_an_autocommit_session(self):
+        connection = FakeConnection()
+        connection.autocommit = True
+
+        assert set_timeouts(connection, lock_timeout=2) is True
+        assert connection.executed[0][1] == ["lock_timeout", "2000ms", False]
+        reset_timeouts(connection)
+        assert connection.executed[1][0] == "RESET statement_timeout; RESET lock_timeout"
+
+    @pytest.mark.unit
+    def test_no_timeouts_no_round_trip(self):
+        connection = FakeConnection()
+        assert set_timeouts(connection) is False
+        assert connection.executed == []
+
+    @pytest.mark.unit
+    def test_timeout_errors(self, make_postgres_error):
+        assert is_timeout(make_postgres_error("57014"))
+        assert is_timeout(make_postgres_error("55P03"))
+        assert not is_timeout(make_postgres_error("57P01"))
+
+        assert isinstance(DatabaseError.from_postgres_exception(server_error("57014")), QueryTimeoutError)
+        assert isinstance(DatabaseError.from_postgres_exception(server_error("55P03")), QueryTimeoutError)
+        assert isinstance(DatabaseError.from_postgres_exception(server_error("57P01")), AdminInterventionError)
+
+
+class TestWatchdog:
+
+    @pytest.mark.unit
+    def test_cancels_when_the_deadline_passes(self):
+        late, early, stopped = FakeConnection(), FakeConnection(), FakeConnection()
+        late_watch = watch(late, Deadline(0.05))
+        early_watch = watch(early, Deadline(0.01))
+        watch(stopped, Deadline(0.01)).stop()
+
+        assert wait_until(lambda: late.cancelled)
+        assert early.cancelled and early_watch.fired and late_watch.fired
+        assert not stopped.cancelled
+
+
+class TestQueryBuilderTimeouts:
+
+    @pytest.mark.unit
+    def test_timeout_sets_statement_timeout(self, pool, connection_factory):
+        result = QueryBuilder().select("*").from_table("orders").timeout(2.0, lock_timeout=0.5).execute(pool)
+        result.close()
+
+        setting_sql, setting_params = connection_factory.created[0].executed[0]
+        assert setting_sql.startswith("SELECT set_config")
+        assert setting_params[1] in ("2000ms", "1999ms") and setting_params[4] == "500ms"
+        assert not connection_factory.created[0].cancelled
+
+    @pytest.mark.unit
+    def test_expired_deadline_fails_without_running(self, pool, connection_factory):
+        deadline = Deadline(-1.0)
+
+        with pytest.raises(QueryTimeoutError):
+            QueryBuilder().select("*").from_table("orders").execute(pool, deadline=deadline)
+        assert connection_factory.created[0].executed == []
+        assert pool.idle_count == 1
+
+    @pytest.mark.unit
+    def test_cancelled_query_is_rolled_back(self, pool, connection_factory):
+        result = QueryBuilder().select("*").from_table("orders").execute(pool, deadline=0.01)
+        connection = connection_factory.created[0]
+        assert wait_until(lambda: connection.cancelled)
+
+        result.close()
+        assert connection.transactions == ["rollback"]
+        assert pool.idle_count == 1
+
+
+class TestPooledDeadline:
+
+    @pytest.mark.unit
+    def test_deadline_cancels_and_raises_query_timeout(self, pool):
+        with pytest.raises(QueryTimeoutError):
+            with PooledDatabaseConnection(pool, deadline=0.01) as connection:
+                assert wait_until(lambda: connection.cancelled)
+                connection.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+                raise psycopg2.errors.lookup("57014")("canceling statement due to user request")
+
+        assert connection.transactions == ["rollback"]
+        assert pool.idle_count == 1
+
+    @pytest.mark.unit
+    def test_statement_timeout_leaves_a_clean_connection(self, pool, make_postgres_error):
+        with pytest.raises(QueryTimeoutError):
+            with PooledDatabaseConnection(pool) as connection:
+                connection.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+                raise make_postgres_error("57014", "canceling statement due to statement timeout")
+
+        assert connection.transactions == ["rollback"]
+
+    @pytest.mark.unit
+    def test_other_errors_pass_through(self, pool, make_postgres_error):
+        with pytest.raises(psycopg2.errors.UniqueViolation):
+            with PooledDatabaseConnection(pool, deadline=10.0) as connection:
+                raise make_postgres_error("23505")
+        assert not connection.cancelled and connection.transactions == []
+
+
+class SlowAsyncConnection:
+    """An asynchronous connection whose query only ends when it is cancelled."""
+
+    def __init__(self):
+        self._server, self._client = socket.socketpair()
+        self.cancelled = False
+        self.finished = False
+
+    def cursor(self):
+        return SimpleNamespace(execute=lambda query, params=None: None)
+
+    def fileno(self):
+        return self._client.fileno()
+
+    def poll(self):
+        if not self.cancelled:
+            return psycopg2.extensions.POLL_READ
+        self._client.recv(1)
+        self.finished = True
+        raise psycopg2.errors.lookup("57014")("canceling statement due to user request")
+
+    def cancel(self):
+        self.cancelled = True
+        self._server.send(b"x")
+
+    def isexecuting(self):
+        return not self.finished
+
+
+class TestAsyncCancellation:
+
+    @pytest.mark.unit
+    def test_timeout_cancels_on_the_server(self):
+        connection = SlowAsyncConnection()
+
+        with pytest.raises(QueryTimeoutError):
+            asyncio.run(execute(connection, "SELECT pg_sleep(60)", timeout=0.01))
+        assert connection.cancelled and not connection.isexecuting()
+
+    @pytest.mark.unit
+    def test_task_cancellation_cancels_on_the_server(self):
+        connection = SlowAsyncConnection()
+
+        async def scenario():
+            task = asyncio.create_task(execute(connection, "SELECT pg_sleep(60)"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await task
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(scenario())
+        assert connection.cancelled and not connection.isexecuting()
@@ -0,0 +1,229 @@
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from src.database.connection import PooledDatabaseConnection
+from src.database.exceptions import IntegrityConstraintViolation, TransactionError
+from src.database.metrics import render_prometheus
+from src.database.pool import ConnectionPool
+from src.database.transaction import is_retryable, transaction, transaction_attempts, transaction_mode
+from src.database.validation import PassiveValidate
+from tests.conftest import FakeConnection, FakeCursor
+
+IDLE = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+INTRANS = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+FAST_RETRIES = {"wait_initial": 0.001, "wait_max": 0.001, "wait_jitter": 0.0}
+
+
+class TransactionalCursor(FakeCursor):
+    """Tracks the transaction status like libpq does."""
+
+    def execute(self, query, params=None):
+        super().execute(query, params)
+        if query.startswith(("COMMIT", "ROLLBACK")) and not query.startswith("ROLLBACK TO"):
+            self.connection.transaction_status = IDLE
+        elif query.startswith("BEGIN") or not self.connection.autocommit:
+            self.connection.transaction_status = INTRANS
+
+
+class TransactionalConnection(FakeConnection):
+    """Like psycopg2, commit() and rollback() outside a transaction don't reach the server."""
+
+    def __init__(self):
+        super().__init__()
+        self.commit_errors = []
+
+    def cursor(self, name=None, **kwargs):
+        return TransactionalCursor(self, name)
+
+    def commit(self):
+        if self.transaction_status == IDLE:
+            return
+        if self.commit_errors:
+            self.transaction_status = IDLE
+            raise self.commit_errors.pop(0)
+        super().commit()
+
+    def rollback(self):
+        if self.transaction_status != IDLE:
+            super().rollback()
+
+
+@pytest.fixture
+def connection():
+    return TransactionalConnection()
+
+
+@pytest.fixture
+def pool(connection):
+    return ConnectionPool(0, 1, lambda: connection, validation_policy=PassiveValidate())
+
+
+def statements(connection):
+    return [sql for sql, _ in connection.executed]
+
+
+class TestTransactionMode:
+
+    @pytest.mark.unit
+    def test_modes(self):
+        assert transaction_mode() == ""
+        assert transaction_mode("serializable", read_only=True, deferrable=True) == \
+            "ISOLATION LEVEL SERIALIZABLE, READ ONLY, DEFERRABLE"
+        assert transaction_mode("REPEATABLE_READ") == "ISOLATION LEVEL REPEATABLE READ"
+        with pytest.raises(ValueError):
+            transaction_mode("snapshot")
+
+    @pytest.mark.unit
+    def test_is_retryable(self, make_postgres_error):
+        assert is_retryable(TransactionError("could not serialize access"))
+        assert is_retryable(make_postgres_error("40001"))
+        assert is_retryable(make_postgres_error("40P01"))
+        assert not is_retryable(make_postgres_error("23505"))
+        assert not is_retryable(IntegrityConstraintViolation("duplicate key"))
+
+
+class TestTransaction:
+
+    @pytest.mark.unit
+    def test_commits_on_success(self, pool, connection):
+        with transaction(pool, isolation_level="serializable", read_only=True, deferrable=True) as conn:
+            conn.cursor().execute("SELECT 1")
+
+        assert statements(connection) == ["SET TRANSACTION ISOLATION LEVEL SERIALIZABLE, READ ONLY, DEFERRABLE",
+                                          "SELECT 1"]
+        assert connection.transactions == ["commit"]
+        assert pool.in_use_count == 0
+
+    @pytest.mark.unit
+    def test_rolls_back_on_error(self, pool, connection):
+        with pytest.raises(RuntimeError):
+            with transaction(pool) as conn:
+                conn.cursor().execute("UPDATE orders SET freight = 0")
+                raise RuntimeError("changed my mind")
+
+        assert connection.transactions == ["rollback"]
+        assert pool.in_use_count == 0
+
+    @pytest.mark.unit
+    def test_autocommit_connection(self, connection):
+        connection.autocommit = True
+
+        with transaction(connection, isolation_level="repeatable read") as conn:
+            conn.cursor().execute("SELECT 1")
+
+        assert statements(connection) == ["BEGIN ISOLATION LEVEL REPEATABLE READ", "SELECT 1", "COMMIT"]
+        assert connection.transaction_status == IDLE
+
+    @pytest.mark.unit
+    def test_nested_transactions_are_savepoints(self, connection):
+        with transaction(connection) as conn:
+            conn.cursor().execute("INSERT INTO orders VALUES (1)")
+            with pytest.raises(RuntimeError):
+                with transaction(conn):
+                    conn.cursor().execute("INSERT INTO orders VALUES (2)")
+                    raise RuntimeError("undo the second order only")
+            with transaction(conn):
+                conn.cursor().execute("INSERT INTO orders VALUES (3)")
+
+        savepoints = [sql for sql in statements(connection) if "SAVEPOINT" in sql]
+        first, second = savepoints[0].split()[-1], savepoints[3].split()[-1]
+        assert savepoints == [f"SAVEPOINT {first}", f"ROLLBACK TO SAVEPOINT {first}", f"RELEASE SAVEPOINT {first}",
+                              f"SAVEPOINT {second}", f"RELEASE SAVEPOINT {second}"]
+        assert connection.transactions == ["commit"]
+
+    @pytest.mark.unit
+    def test_nested_transactions_cannot_change_the_mode(self, connection):
+        with transaction(connection) as conn:
+            conn.cursor().execute("SELECT 1")
+            with pytest.raises(ValueError):
+                with transaction(conn, read_only=True):
+                    pass
+
+
+class TestRetries:
+
+    @pytest.mark.unit
+    def test_serialization_failures_are_retried(self, pool, connection, make_postgres_error):
+        failures = [make_postgres_error("40001"), make_postgres_error("40P01")]
+        runs = 0
+
+        for attempt in transaction_attempts(pool, isolation_level="serializable", **FAST_RETRIES):
+            with attempt as conn:
+                runs += 1
+                conn.cursor().execute("UPDATE accounts SET balance = balance - 1")
+                if failures:
+                    raise failures.pop(0)
+
+        assert runs == 3
+        assert connection.transactions == ["rollback", "rollback", "commit"]
+        stats = pool.stats()
+        assert stats.transaction_retries == 2 and stats.serialization_failures == 2
+        assert "pg_pool_transaction_retries_total 2" in render_prometheus(stats)
+
+    @pytest.mark.unit
+    def test_commit_failures_are_retried(self, pool, connection, make_postgres_error):
+        connection.commit_errors.append(make_postgres_error("40001"))
+        runs = 0
+
+        for attempt in transaction_attempts(pool, **FAST_RETRIES):
+            with attempt as conn:
+                runs += 1
+                conn.cursor().execute("UPDATE accounts SET balance = balance - 1")
+
+        assert runs == 2
+        assert pool.stats().transaction_retries == 1
+
+    @pytest.mark.unit
+    def test_gives_up_after_the_last_attempt(self, pool, make_postgres_error):
+        with pytest.raises(psycopg2.errors.SerializationFailure):
+            for attempt in transaction_attempts(pool, attempts=3, **FAST_RETRIES):
+                with attempt:
+                    raise make_postgres_error("40001")
+
+        stats = pool.stats()
+        assert stats.transaction_retries == 2 and stats.serialization_failures == 3
+        assert pool.in_use_count == 0
+
+    @pytest.mark.unit
+    def test_other_errors_are_not_retried(self, pool, make_postgres_error):
+        runs = 0
+        with pytest.raises(psycopg2.errors.UniqueViolation):
+            for attempt in transaction_attempts(pool, **FAST_RETRIES):
+                with attempt:
+                    runs += 1
+                    raise make_postgres_error("23505")
+        assert runs == 1
+
+    @pytest.mark.unit
+    def test_nested_attempts_are_not_retried(self, connection, make_postgres_error):
+        runs = 0
+        with transaction(connection) as conn:
+            conn.cursor().execute("SELECT 1")
+            with pytest.raises(psycopg2.errors.SerializationFailure):
+                for attempt in transaction_attempts(conn, **FAST_RETRIES):
+                    with attempt:
+                        runs += 1
+                        raise make_postgres_error("40001")
+            conn.rollback()
+        assert runs == 1
+
+
+class TestPooledConnectionCleanup:
+
+    @pytest.mark.unit
+    def test_open_transaction_is_rolled_back(self, pool, connection):
+        with PooledDatabaseConnection(pool) as conn:
+            conn.cursor().execute("UPDATE orders SET freight = 0")
+
+        assert connection.transactions == ["rollback"]
+        assert connection.transaction_status == IDLE
+
+    @pytest.mark.unit
+    def test_committed_connection_is_returned_as_is(self, pool, connection):
+        with PooledDatabaseConnection(pool) as conn:
+            conn.cursor().execute("UPDATE orders SET freight = 0")
+            conn.commit()
+
+        assert connection.transactions == ["commit"]